@@ -0,0 +1,278 @@
+"""
+Airport Offline Benchmark
+
+ローカルのフィクスチャサイトに対して autopilot.run_workflow と ReActAgent.run を実行し、
+ステップ数・フェーズ別時間・モデル呼び出し回数・アップロードバイト数・成功率を計測する。
+LLM は記録済みテープ (ReplayBackend) から再生するので、API キーもネットワークも不要。
+
+Usage:
+    python benchmarks/run_bench.py                       # 全ケース実行 → results/bench/*.json
+    python benchmarks/run_bench.py --cases forms_dom shop_vision --repeat 3
+    python benchmarks/run_bench.py --latency 1.5         # 全モデル呼び出しに 1.5 秒の遅延を注入
+    python benchmarks/run_bench.py --compare old.json new.json
+"""
+
+import argparse
+import functools
+import http.server
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import yaml
+
+from src.config import RESULTS_DIR
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+DEFAULT_SUITE = os.path.join(BENCH_DIR, "suite.yaml")
+BENCH_RESULTS_DIR = RESULTS_DIR / "bench"
+
+
+# ---- fixture server ----
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server():
+    """Serves benchmarks/fixtures on a free localhost port. Returns (server, base_url)."""
+    handler = functools.partial(_QuietHandler, directory=FIXTURES_DIR)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _materialize(path, base_url, suffix):
+    """Copies a plan/tape to a temp file with {BASE_URL} substituted."""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read().replace("{BASE_URL}", base_url)
+    tmp = tempfile.NamedTemporaryFile(delete=False, mode="w", encoding="utf-8", suffix=suffix)
+    tmp.write(content)
+    tmp.close()
+    return tmp.name
+
+
+def _empty_tape():
+    # テープなしのケースでも LLM 呼び出しがネットワークに出ないよう、空テープで再生モードにする
+    tmp = tempfile.NamedTemporaryFile(delete=False, mode="w", suffix=".jsonl")
+    tmp.close()
+    return tmp.name
+
+
+# ---- case runners ----
+def run_autopilot_case(case, plan_path):
+    from src import autopilot
+
+    tasks = autopilot.run_workflow(plan_path)
+    phases = {}
+    for task in tasks:
+        for step in task["steps"]:
+            _add_phases(phases, step["phases"])
+    return {
+        "success": bool(tasks) and all(t["success"] for t in tasks),
+        "steps": sum(t["steps_completed"] for t in tasks),
+        "phases": phases,
+        "errors": [t["error"] for t in tasks if t["error"]],
+    }
+
+
+def _add_phases(total, phases):
+    for name, seconds in phases.items():
+        total[name] = total.get(name, 0.0) + seconds
+
+
+def run_react_case(case, tape_path, latency):
+    from src.llm_backend import ReplayBackend
+    from src.main import ATC
+    from src.react_agent import ReActAgent
+
+    agent = ReActAgent(ATC(), enable_desktop=False, backend=ReplayBackend(tape_path, latency=latency))
+    agent.max_steps = case.get("max_steps", 20)
+
+    # フェーズ別の時間は ReActAgent がステップごとに計測している (metrics.StepTimer)
+    phases = {}
+    result = agent.run(case["goal"], on_step_timing=lambda step, timing: _add_phases(phases, timing["phases"]))
+
+    success = result["success"]
+    if success and case.get("expect"):
+        success = case["expect"] in str(result.get("final_result", ""))
+    return {
+        "success": success,
+        "steps": result["steps_taken"],
+        "phases": phases,
+        "errors": [] if result["success"] else [result.get("final_result")],
+    }
+
+
+def run_case(case, suite_dir, base_url, latency):
+    from src.accounting import USAGE_TOTALS
+    from src.llm_backend import LLM_CALL_STATS
+    from src.structured_output import PARSE_STATS
+
+    tape = case.get("tape")
+    tape_path = _materialize(os.path.join(suite_dir, tape), base_url, ".jsonl") if tape else _empty_tape()
+    os.environ["AIRPORT_LLM_BACKEND"] = "replay"
+    os.environ["AIRPORT_LLM_TAPE"] = tape_path
+    os.environ["AIRPORT_LLM_REPLAY_LATENCY"] = str(latency)
+
+    LLM_CALL_STATS.reset()
+    PARSE_STATS.reset()
+    USAGE_TOTALS.reset()
+    print(f"\n🏁 [{case['name']}] ({case['kind']})")
+
+    started = time.time()
+    try:
+        if case["kind"] == "autopilot":
+            plan_path = _materialize(os.path.join(suite_dir, case["plan"]), base_url, ".yaml")
+            try:
+                outcome = run_autopilot_case(case, plan_path)
+            finally:
+                os.remove(plan_path)
+        elif case["kind"] == "react":
+            outcome = run_react_case(case, tape_path, latency)
+        else:
+            raise ValueError(f"Unknown case kind: {case['kind']}")
+    except Exception as e:
+        outcome = {"success": False, "steps": 0, "phases": {}, "errors": [f"Crashed: {e}"]}
+    finally:
+        os.remove(tape_path)
+
+    calls = LLM_CALL_STATS.snapshot()
+    parse = PARSE_STATS.snapshot()["totals"]
+    usage = USAGE_TOTALS.totals()
+    return {
+        "name": case["name"],
+        "kind": case["kind"],
+        "success": outcome["success"],
+        "steps": outcome["steps"],
+        "wall_time": round(time.time() - started, 3),
+        "phases": {k: round(v, 3) for k, v in outcome["phases"].items()},
+        "model_calls": calls["calls"],
+        "model_latency": calls["latency_total"],
+        "bytes_uploaded": calls["bytes_uploaded"],
+        "tokens": usage["total_tokens"],
+        "cost": usage["cost"],
+        "parse_repairs": parse["repairs"],
+        "parse_failures": parse["parse_failures"],
+        "errors": outcome["errors"],
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def summarize(cases):
+    runs = len(cases)
+    return {
+        "runs": runs,
+        "success_rate": round(sum(c["success"] for c in cases) / runs, 3) if runs else 0.0,
+        "wall_time": round(sum(c["wall_time"] for c in cases), 3),
+        "steps": sum(c["steps"] for c in cases),
+        "model_calls": sum(c["model_calls"] for c in cases),
+        "bytes_uploaded": sum(c["bytes_uploaded"] for c in cases),
+        "tokens": sum(c.get("tokens", 0) for c in cases),
+        "cost": round(sum(c.get("cost", 0.0) for c in cases), 6),
+    }
+
+
+def print_table(cases):
+    print("\n" + "=" * 78)
+    print(f"{'case':<16}{'ok':<5}{'steps':>6}{'wall(s)':>10}{'calls':>7}{'upload(KB)':>12}  phases")
+    print("-" * 78)
+    for c in cases:
+        phases = " ".join(f"{k}={v:.2f}" for k, v in sorted(c["phases"].items(), key=lambda kv: -kv[1])[:3])
+        print(f"{c['name']:<16}{'✅' if c['success'] else '❌':<5}{c['steps']:>6}{c['wall_time']:>10.2f}"
+              f"{c['model_calls']:>7}{c['bytes_uploaded'] / 1024:>12.1f}  {phases}")
+    print("=" * 78)
+
+
+def compare(old_path, new_path):
+    """Prints per-case deltas between two benchmark result files."""
+    with open(old_path) as f:
+        old = {c["name"]: c for c in json.load(f)["cases"]}
+    with open(new_path) as f:
+        new_report = json.load(f)
+
+    print(f"{'case':<16}{'wall(s)':>20}{'steps':>14}{'calls':>14}")
+    for c in new_report["cases"]:
+        before = old.get(c["name"])
+        if not before:
+            print(f"{c['name']:<16}{'(new case)':>20}")
+            continue
+        delta = c["wall_time"] - before["wall_time"]
+        pct = (delta / before["wall_time"] * 100) if before["wall_time"] else 0.0
+        print(f"{c['name']:<16}{before['wall_time']:>7.2f} → {c['wall_time']:>6.2f} ({pct:+5.1f}%)"
+              f"{before['steps']:>6} → {c['steps']:<5}{before['model_calls']:>6} → {c['model_calls']:<5}"
+              f"{'' if c['success'] == before['success'] else '  ⚠️ success changed'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Airport offline benchmark")
+    parser.add_argument("--suite", default=DEFAULT_SUITE, help="Suite YAML")
+    parser.add_argument("--cases", nargs="*", help="Only run these case names")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case")
+    parser.add_argument("--latency", type=float, default=0.0, help="Injected model latency per call (seconds)")
+    parser.add_argument("--output", help="Result JSON path (default: results/bench/bench_<time>_<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with open(args.suite, "r", encoding="utf-8") as f:
+        suite = yaml.safe_load(f)
+    suite_dir = os.path.dirname(os.path.abspath(args.suite))
+    cases = [c for c in suite.get("cases", []) if not args.cases or c["name"] in args.cases]
+
+    server, base_url = start_fixture_server()
+    print(f"🛬 Fixture server: {base_url}")
+    results = []
+    try:
+        for case in cases:
+            for _ in range(args.repeat):
+                results.append(run_case(case, suite_dir, base_url, args.latency))
+    finally:
+        server.shutdown()
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_commit": commit,
+            "python": sys.version.split()[0],
+            "latency": args.latency,
+            "repeat": args.repeat,
+        },
+        "summary": summarize(results),
+        "cases": results,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(str(BENCH_RESULTS_DIR), exist_ok=True)
+        output = str(BENCH_RESULTS_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print_table(results)
+    print(f"📊 Success rate: {report['summary']['success_rate']:.0%}  Total wall: {report['summary']['wall_time']:.1f}s")
+    print(f"💾 Results: {output}")
+
+
+if __name__ == "__main__":
+    main()
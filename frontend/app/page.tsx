@@ -20,12 +20,23 @@ type Message = {
   intent?: string;
 };
 
+type UsageTotals = {
+  calls: number;
+  retries: number;
+  input_tokens: number;
+  output_tokens: number;
+  total_tokens: number;
+  image_bytes: number;
+  cost: number;
+};
+
 type Flight = {
   flight_id: string;
   start_time: string;
   end_time?: string;
   status: string;
   mission: string;
+  usage?: { totals: UsageTotals; budget_exceeded?: string | null };
 };
 
 type LogEntry = {
@@ -52,6 +63,23 @@ type FlightPlan = {
   error?: string;
 };
 
+type TimingSpan = {
+  phase: string;
+  start: number;
+  duration: number;
+  depth: number;
+};
+
+type StepTiming = {
+  step: number;
+  action: string;
+  site: string;
+  duration: number;
+  phases: Record<string, number>;
+  spans: TimingSpan[];
+  usage?: UsageTotals;
+};
+
 type ReActStep = {
   step: number;
   observation: string;
@@ -59,8 +87,56 @@ type ReActStep = {
   action: string;
   params: Record<string, any>;
   screenshot?: string;
+  timing?: StepTiming;
+};
+
+const PHASE_COLORS: Record<string, string> = {
+  capture: "bg-sky-500",
+  encode: "bg-cyan-400",
+  queue: "bg-gray-500",
+  inference: "bg-purple-500",
+  parse: "bg-pink-400",
+  act: "bg-amber-500",
+  settle: "bg-emerald-500",
+  persist: "bg-slate-400",
 };
 
+// ステップのフェーズ別ウォーターフォール（入れ子のフェーズは下の段に描画）
+function StepWaterfall({ timing }: { timing: StepTiming }) {
+  const total = Math.max(timing.duration, 0.001);
+  const rows = Math.max(1, ...timing.spans.map(s => s.depth + 1));
+  return (
+    <div className="space-y-1">
+      <div className="relative bg-gray-900 rounded" style={{ height: rows * 8 }}>
+        {timing.spans.map((span, i) => (
+          <div
+            key={i}
+            title={`${span.phase}: ${span.duration.toFixed(3)}s @ +${span.start.toFixed(3)}s`}
+            className={clsx("absolute h-[6px] rounded-sm opacity-80", PHASE_COLORS[span.phase] || "bg-gray-600")}
+            style={{
+              left: `${(span.start / total) * 100}%`,
+              width: `${Math.max((span.duration / total) * 100, 0.5)}%`,
+              top: span.depth * 8 + 1,
+            }}
+          />
+        ))}
+      </div>
+      <div className="flex flex-wrap gap-x-3 text-[9px] font-mono text-gray-500">
+        <span className="text-gray-400">{timing.duration.toFixed(2)}s</span>
+        {timing.usage && timing.usage.calls > 0 && (
+          <span className="text-gray-400">{timing.usage.total_tokens} tok · ${timing.usage.cost.toFixed(4)}</span>
+        )}
+        {Object.entries(timing.phases).filter(([, v]) => v > 0).map(([phase, seconds]) => (
+          <span key={phase} className="flex items-center gap-1">
+            <span className={clsx("inline-block w-2 h-2 rounded-sm", PHASE_COLORS[phase] || "bg-gray-600")} />
+            {phase} {seconds.toFixed(2)}s
+          </span>
+        ))}
+      </div>
+    </div>
+  );
+}
+
 export default function Home() {
   const [messages, setMessages] = useState<Message[]>([
     {
@@ -96,6 +172,7 @@ export default function Home() {
   const [flights, setFlights] = useState<Flight[]>([]);
   const [selectedFlightId, setSelectedFlightId] = useState<string | null>(null);
   const [flightLogs, setFlightLogs] = useState<LogEntry[]>([]);
+  const [flightArtifacts, setFlightArtifacts] = useState<Record<string, string>>({});
 
   const logEndRef = useRef<HTMLDivElement>(null);
   const chatEndRef = useRef<HTMLDivElement>(null);
@@ -184,6 +261,7 @@ export default function Home() {
     try {
       const res = await axios.get(`${API_URL}/flights/${id}`);
       setFlightLogs(res.data.logs);
+      setFlightArtifacts(res.data.artifacts || {});
     } catch (e) { console.error(e); }
   };
 
@@ -694,6 +772,7 @@ export default function Home() {
                             </div>
                           </div>
                         </div>
+                        {step.timing && <StepWaterfall timing={step.timing} />}
                       </div>
                     </div>
                   ))
@@ -770,7 +849,10 @@ export default function Home() {
                     )}
                   >
                     <div className="font-bold truncate">{f.flight_id}</div>
-                    <div className="opacity-60 text-[10px]">{f.status}</div>
+                    <div className="opacity-60 text-[10px]">
+                      {f.status}
+                      {f.usage && ` · ${f.usage.totals.total_tokens} tok · $${f.usage.totals.cost.toFixed(4)}`}
+                    </div>
                   </button>
                 ))}
               </div>
@@ -778,6 +860,16 @@ export default function Home() {
               <div className="w-2/3 bg-black border border-gray-900 rounded-2xl p-3 overflow-hidden flex flex-col">
                 <div className="flex items-center gap-2 text-sky-500 mb-3 font-orbitron text-sm border-b border-gray-900 pb-2">
                   <History className="w-4 h-4" /> BLACK BOX
+                  {flightArtifacts.profile && (
+                    <a
+                      href={flightArtifacts.profile}
+                      download
+                      title="Collapsed stacks (speedscope / flamegraph.pl)"
+                      className="ml-auto text-[10px] font-mono text-amber-400 hover:underline"
+                    >
+                      🔬 PROFILE
+                    </a>
+                  )}
                 </div>
                 <div className="flex-grow overflow-y-auto space-y-1 custom-scrollbar">
                   {flightLogs.length === 0 && <div className="text-gray-700 text-xs">No logs</div>}
@@ -788,7 +880,11 @@ export default function Home() {
                         "font-bold ml-1",
                         log.type === "ERROR" ? "text-red-500" : log.type === "REACT" ? "text-purple-500" : "text-sky-600"
                       )}>[{log.type}]</span>
-                      <span className="text-gray-400 ml-1">{log.details.substring(0, 100)}</span>
+                      {log.type === "TIMING" ? (
+                        <div className="mt-1 mr-2"><StepWaterfall timing={JSON.parse(log.details)} /></div>
+                      ) : (
+                        <span className="text-gray-400 ml-1">{log.details.substring(0, 100)}</span>
+                      )}
                     </div>
                   ))}
                 </div>
@@ -7,6 +7,7 @@ sys.path.append(os.path.join(os.getcwd(), "src"))
 
 from src import autopilot
 from src import desktop_controller
+from src.profiler import start_from_env
 
 def run_web(args):
     # シナリオファイルのパス解決
@@ -21,7 +22,8 @@ def run_web(args):
             return
 
     print(f"✈️ Running Web Scenario: {scenario_path}")
-    autopilot.run_workflow(scenario_path)
+    autopilot.run_workflow(scenario_path, workers=args.workers, session=args.session, profile=args.profile,
+                           engine=args.engine, browsing=args.browsing)
 
 def run_desktop(args):
     print("🖥️ Running Desktop Demo")
@@ -34,12 +36,25 @@ if __name__ == "__main__":
     # Web Autopilot
     web_parser = subparsers.add_parser("web", help="Run web automation scenario")
     web_parser.add_argument("scenario", help="Path to YAML scenario file (e.g. test_scenarios.yaml)")
+    web_parser.add_argument("--workers", type=int, default=None,
+                            help="Run independent tasks concurrently (default: AIRPORT_AUTOPILOT_WORKERS)")
+    web_parser.add_argument("--session", choices=autopilot.SESSION_POLICIES, default=None,
+                            help="task = fresh browser per task, worker = reuse each worker's browser")
+    web_parser.add_argument("--profile", choices=list(autopilot.EXECUTION_PROFILES), default=None,
+                            help="Click execution profile: fast (no screenshots), audit, debug (default: AIRPORT_EXECUTION_PROFILE)")
+    web_parser.add_argument("--engine", choices=autopilot.ENGINES, default=None,
+                            help="sync = thread + browser per worker, async = one event loop and a shared browser (default: AIRPORT_AUTOPILOT_ENGINE)")
+    web_parser.add_argument("--browsing", choices=list(autopilot.BROWSING_PROFILES), default=None,
+                            help="Browsing profile: full, lite (no media/fonts/ad and tracker domains), text (lite + placeholder images) (default: AIRPORT_BROWSING_PROFILE)")
     
     # Desktop
     desktop_parser = subparsers.add_parser("desktop", help="Run desktop automation demo")
 
     args = parser.parse_args()
 
+    # サーバーからプロファイル付きで起動された場合（AIRPORT_PROFILE_OUT）のみサンプリングする
+    start_from_env()
+
     if args.command == "web":
         run_web(args)
     elif args.command == "desktop":
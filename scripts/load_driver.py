@@ -0,0 +1,198 @@
+"""
+Load Driver - launches N concurrent missions against the Cockpit API and reports
+throughput and p50/p95/p99 step latency.
+
+Airport の API サーバーと、LLM 側には scripts/mock_gemini_server.py を立てておく:
+    python scripts/mock_gemini_server.py --config mock.yaml &
+    GOOGLE_API_KEY=mock AIRPORT_GEMINI_ENDPOINT=http://127.0.0.1:8089 uvicorn src.server:app --port 8000 &
+    python scripts/load_driver.py --mode react -n 8 --missions 32
+
+Step latency はフライトの Black Box のタイムスタンプから計算する
+（react: REACT イベント間隔 / execute: "Step N:" ログ行の間隔）。
+サーバーがミッションを受け付けない（実行中で 400）場合は、受け付けられるまで再試行し、その待ち時間も記録する。
+"""
+
+import argparse
+import json
+import math
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+
+def _request(method: str, url: str, body: dict = None, timeout: float = 30):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as res:
+            return res.status, json.loads(res.read() or b"null")
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b"null")
+        except ValueError:
+            return e.code, None
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(math.ceil(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def _parse_ts(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+class LoadDriver:
+    def __init__(self, server: str, mode: str, goal: str = None, plan: list = None,
+                 max_steps: int = 10, poll: float = 0.5, mission_timeout: float = 600):
+        self.server = server.rstrip("/")
+        self.mode = mode
+        self.goal = goal
+        self.plan = plan
+        self.max_steps = max_steps
+        self.poll = poll
+        self.mission_timeout = mission_timeout
+        self.lock = threading.Lock()
+        self.missions = []
+
+    # ---- mission lifecycle ----
+    def _submit(self) -> tuple:
+        """Submits one mission, retrying while the server is busy. Returns (flight_id, admission_wait, rejections)."""
+        started = time.time()
+        rejections = 0
+        while time.time() - started < self.mission_timeout:
+            if self.mode == "react":
+                status, body = _request("POST", f"{self.server}/api/react",
+                                        {"goal": self.goal, "max_steps": self.max_steps})
+            else:
+                status, body = _request("POST", f"{self.server}/api/execute",
+                                        {"plan": self.plan, "summary": "Load driver mission"})
+            if status == 200:
+                return body["flight_id"], time.time() - started, rejections
+            rejections += 1
+            time.sleep(self.poll)
+        raise TimeoutError("Mission was never admitted")
+
+    def _wait_finished(self, flight_id: str):
+        deadline = time.time() + self.mission_timeout
+        while time.time() < deadline:
+            _, body = _request("GET", f"{self.server}/api/flights/{flight_id}")
+            metadata = (body or {}).get("metadata") or {}
+            if metadata.get("status") not in (None, "IN_PROGRESS"):
+                return metadata, (body or {}).get("logs", [])
+            time.sleep(self.poll)
+        raise TimeoutError(f"Flight {flight_id} did not finish")
+
+    def _step_latencies(self, metadata: dict, logs: list) -> list:
+        """Intervals between consecutive step events in the black box."""
+        if self.mode == "react":
+            marks = [_parse_ts(e["timestamp"]) for e in logs if e.get("type") == "REACT"]
+        else:
+            marks = [_parse_ts(e["timestamp"]) for e in logs
+                     if e.get("type") == "ACTION" and re.match(r"^Step \d+:", str(e.get("details", "")))]
+            marks.append(_parse_ts(metadata["end_time"]))
+        previous = _parse_ts(metadata["start_time"])
+        latencies = []
+        for mark in marks:
+            latencies.append(mark - previous)
+            previous = mark
+        return latencies
+
+    def _run_one(self, index: int):
+        record = {"index": index, "success": False}
+        started = time.time()
+        try:
+            flight_id, admission_wait, rejections = self._submit()
+            record.update(flight_id=flight_id, admission_wait=round(admission_wait, 3), rejections=rejections)
+            metadata, logs = self._wait_finished(flight_id)
+            record["status"] = metadata.get("status")
+            record["success"] = metadata.get("status") == "COMPLETED"
+            record["step_latencies"] = [round(v, 3) for v in self._step_latencies(metadata, logs)]
+        except Exception as e:
+            record["error"] = str(e)
+        record["duration"] = round(time.time() - started, 3)
+        with self.lock:
+            self.missions.append(record)
+        print(f"   ✈️ mission {index}: {record.get('status', record.get('error'))} in {record['duration']:.1f}s")
+
+    # ---- driver ----
+    def run(self, concurrency: int, total: int) -> dict:
+        started = time.time()
+        pending = list(range(total))
+        pending_lock = threading.Lock()
+
+        def worker():
+            while True:
+                with pending_lock:
+                    if not pending:
+                        return
+                    index = pending.pop(0)
+                self._run_one(index)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.report(time.time() - started, concurrency)
+
+    def report(self, wall: float, concurrency: int) -> dict:
+        steps = [v for m in self.missions for v in m.get("step_latencies", [])]
+        completed = [m for m in self.missions if m["success"]]
+        admission = [m["admission_wait"] for m in self.missions if "admission_wait" in m]
+        return {
+            "mode": self.mode,
+            "concurrency": concurrency,
+            "missions": len(self.missions),
+            "completed": len(completed),
+            "failed": len(self.missions) - len(completed),
+            "wall_time": round(wall, 3),
+            "throughput_missions_per_min": round(len(completed) / wall * 60, 3) if wall else 0.0,
+            "throughput_steps_per_min": round(len(steps) / wall * 60, 3) if wall else 0.0,
+            "step_latency": {f"p{p}": round(percentile(steps, p), 3) for p in (50, 95, 99)},
+            "admission_wait": {f"p{p}": round(percentile(admission, p), 3) for p in (50, 95, 99)},
+            "rejections": sum(m.get("rejections", 0) for m in self.missions),
+            "details": sorted(self.missions, key=lambda m: m["index"]),
+        }
+
+
+DEFAULT_PLAN = [
+    {"step": 1, "action": "goto", "url": "https://example.com"},
+    {"step": 2, "action": "click_vision", "instruction": "Click the 'More information' link"},
+    {"step": 3, "action": "wait", "seconds": 1},
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Airport load driver")
+    parser.add_argument("--server", default="http://127.0.0.1:8000")
+    parser.add_argument("--mode", choices=["react", "execute"], default="react")
+    parser.add_argument("-n", "--concurrency", type=int, default=4)
+    parser.add_argument("--missions", type=int, default=8, help="Total missions to launch")
+    parser.add_argument("--goal", default="Open example.com and report the page title")
+    parser.add_argument("--plan", help="JSON file with a plan list for --mode execute")
+    parser.add_argument("--max-steps", type=int, default=10)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    plan = DEFAULT_PLAN
+    if args.plan:
+        with open(args.plan, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+
+    print(f"🚦 Load: {args.missions} {args.mode} missions, concurrency {args.concurrency} → {args.server}")
+    driver = LoadDriver(args.server, args.mode, goal=args.goal, plan=plan, max_steps=args.max_steps)
+    report = driver.run(args.concurrency, args.missions)
+
+    summary = {k: v for k, v in report.items() if k != "details"}
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Report: {args.output}")
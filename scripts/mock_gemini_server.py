@@ -0,0 +1,326 @@
+"""
+Mock Gemini Server - generative API stand-in for load and tail-latency testing.
+
+Airport が使う REST の範囲 (models/{model}:generateContent / :streamGenerateContent) を話す。
+レイテンシ分布・エラー率・クォータ(429)・スクリプト応答を設定ファイルで変えられる。
+
+Usage:
+    python scripts/mock_gemini_server.py --port 8089 --config mock_gemini.yaml
+
+    # Airport 側 (.env)
+    GOOGLE_API_KEY=mock
+    AIRPORT_GEMINI_ENDPOINT=http://127.0.0.1:8089
+
+Config (YAML / JSON, すべて省略可):
+    latency:
+      distribution: lognormal      # fixed | uniform | normal | lognormal | pareto
+      value: 1.0                   # fixed
+      min: 0.5                     # uniform
+      max: 3.0                     # uniform / 上限 (全分布共通)
+      mean: 1.0                    # normal
+      stddev: 0.3                  # normal
+      median: 1.0                  # lognormal
+      sigma: 0.6                   # lognormal
+      scale: 0.8                   # pareto (最小値)
+      alpha: 2.5                   # pareto
+    error_rate: 0.02               # 500 INTERNAL を返す確率
+    rate_limit_rate: 0.05          # クォータとは無関係に 429 を返す確率
+    quota:
+      requests_per_minute: 60      # 直近60秒の受付数が超えたら 429
+    stream_chunk_size: 32
+    react_steps: 3                 # 既定の ReAct 応答で done を返すステップ
+    responses:                     # プロンプトに match を含むリクエストへの応答（順番に循環）
+      - match: "検索ボックス"
+        responses:
+          - {"x": 640, "y": 120, "confidence": 0.9}
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import yaml
+
+
+DEFAULT_CONFIG = {
+    "latency": {"distribution": "lognormal", "median": 0.8, "sigma": 0.5, "max": 30.0},
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "quota": {"requests_per_minute": 0},
+    "stream_chunk_size": 32,
+    "react_steps": 3,
+    "responses": [],
+}
+
+
+def sample_latency(spec: dict, rng: random.Random) -> float:
+    kind = spec.get("distribution", "fixed")
+    if kind == "fixed":
+        value = spec.get("value", 0.0)
+    elif kind == "uniform":
+        value = rng.uniform(spec.get("min", 0.0), spec.get("max", 1.0))
+    elif kind == "normal":
+        value = rng.gauss(spec.get("mean", 1.0), spec.get("stddev", 0.2))
+    elif kind == "lognormal":
+        value = rng.lognormvariate(math.log(spec.get("median", 1.0)), spec.get("sigma", 0.5))
+    elif kind == "pareto":
+        value = spec.get("scale", 0.5) * rng.paretovariate(spec.get("alpha", 2.0))
+    else:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    return max(0.0, min(value, spec.get("max", float("inf"))))
+
+
+class MockState:
+    """Config + counters shared by all request handler threads."""
+
+    def __init__(self, config: dict, seed: int = None):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window = deque()
+        self.rule_cursors = {}
+        self.stats = {"requests": 0, "ok": 0, "quota_429": 0, "random_429": 0, "errors_500": 0, "latencies": []}
+
+    # ---- admission ----
+    def admit(self):
+        """Returns None to serve the request, or (status, message) to reject it."""
+        now = time.time()
+        with self.lock:
+            self.stats["requests"] += 1
+            rpm = (self.config.get("quota") or {}).get("requests_per_minute", 0)
+            while self.window and now - self.window[0] > 60:
+                self.window.popleft()
+            if rpm and len(self.window) >= rpm:
+                self.stats["quota_429"] += 1
+                return 429, "Resource has been exhausted (e.g. check quota)."
+            self.window.append(now)
+
+            if self.rng.random() < self.config.get("rate_limit_rate", 0.0):
+                self.stats["random_429"] += 1
+                return 429, "Resource has been exhausted (e.g. check quota)."
+            if self.rng.random() < self.config.get("error_rate", 0.0):
+                self.stats["errors_500"] += 1
+                return 500, "An internal error has occurred."
+            return None
+
+    def latency(self) -> float:
+        with self.lock:
+            return sample_latency(self.config.get("latency", {}), self.rng)
+
+    def record(self, latency: float):
+        with self.lock:
+            self.stats["ok"] += 1
+            self.stats["latencies"].append(latency)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.stats["latencies"])
+            result = {k: v for k, v in self.stats.items() if k != "latencies"}
+        result["latency"] = {f"p{p}": round(percentile(latencies, p), 3) for p in (50, 95, 99)}
+        return result
+
+    # ---- scripted responses ----
+    def respond(self, prompt: str) -> str:
+        for index, rule in enumerate(self.config.get("responses") or []):
+            if rule.get("match", "") in prompt:
+                with self.lock:
+                    cursor = self.rule_cursors.get(index, 0)
+                    self.rule_cursors[index] = cursor + 1
+                responses = rule.get("responses") or [rule.get("response")]
+                value = responses[cursor % len(responses)]
+                return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        value = self.default_response(prompt)
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+    def default_response(self, prompt: str):
+        """Airport のプロンプトの種類を見分けて、それらしい既定応答を返す"""
+        if "自律型GUIエージェント" in prompt:
+            match = re.search(r"## 現在のステップ\s*(\d+)/(\d+)", prompt)
+            step = int(match.group(1)) if match else 1
+            if step >= self.config.get("react_steps", 3):
+                return {"action": "done", "params": {"result": "Mock mission completed"},
+                        "observation": "Mock observation", "reasoning": "Mock reasoning"}
+            return {"action": "scroll", "params": {"direction": "down", "amount": 300},
+                    "observation": "Mock observation", "reasoning": "Mock reasoning"}
+        if "numbered user instructions" in prompt:
+            # まとめてのグラウンディング（VisionCore.analyze_image_batch）: 番号付きの指示ごとに 1 件
+            indexes = [int(i) for i in re.findall(r"^\s*(\d+)\. ", prompt, re.MULTILINE)]
+            return {"targets": [{"index": i, "found": True, "x": 640 + 40 * i, "y": 360, "confidence": 0.9}
+                                for i in indexes]}
+        if "center coordinates" in prompt:
+            return {"x": 640, "y": 360, "confidence": 0.9}
+        if "フライトプランナー" in prompt:
+            return {"summary": "Mock plan", "plan": [
+                {"step": 1, "action": "goto", "url": "https://example.com"},
+                {"step": 2, "action": "wait", "seconds": 1},
+            ]}
+        if "Attendant" in prompt:
+            return {"response": "Mock attendant reply", "intent": "chat",
+                    "needs_confirmation": False, "task_description": None}
+        return "Mock answer"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _prompt_text(body: dict) -> str:
+    texts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+def _candidate(text: str, finish: bool = True) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return candidate
+
+
+def _usage(prompt: str, text: str, body: dict) -> dict:
+    images = sum(1 for c in body.get("contents", []) for p in c.get("parts", []) if "inlineData" in p or "inline_data" in p)
+    prompt_tokens = len(prompt) // 4 + images * 258
+    output_tokens = max(1, len(text) // 4)
+    return {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens}
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    state: MockState = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str):
+        names = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 404: "NOT_FOUND", 400: "INVALID_ARGUMENT"}
+        self._send_json(status, {"error": {"code": status, "message": message, "status": names.get(status, "UNKNOWN")}})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ("/stats", "/mock/stats"):
+            self._send_json(200, self.state.snapshot())
+        elif path.startswith("/v1beta/models"):
+            self._send_json(200, {"models": [{"name": "models/mock", "supportedGenerationMethods": ["generateContent"]}]})
+        else:
+            self._send_error(404, f"Unknown path: {path}")
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        match = re.match(r"^/v1(?:beta)?/models/([^:]+):(generateContent|streamGenerateContent)$", parsed.path)
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "Invalid JSON body")
+            return
+        if not match:
+            self._send_error(404, f"Unknown path: {parsed.path}")
+            return
+
+        rejection = self.state.admit()
+        started = time.time()
+        delay = self.state.latency()
+        if rejection:
+            # 拒否は素早く返す（本物の API と同じく待たせない）
+            self._send_error(*rejection)
+            return
+
+        prompt = _prompt_text(body)
+        text = self.state.respond(prompt)
+        usage = _usage(prompt, text, body)
+
+        if match.group(2) == "generateContent":
+            time.sleep(delay)
+            self._send_json(200, {"candidates": [_candidate(text)], "usageMetadata": usage})
+        else:
+            sse = parse_qs(parsed.query).get("alt", [""])[0] == "sse"
+            self._stream(text, usage, delay, sse)
+        self.state.record(time.time() - started)
+
+    def _stream(self, text: str, usage: dict, delay: float, sse: bool):
+        size = self.state.config.get("stream_chunk_size", 32)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data: str):
+            raw = data.encode("utf-8")
+            self.wfile.write(f"{len(raw):X}\r\n".encode() + raw + b"\r\n")
+            self.wfile.flush()
+
+        # 最初のチャンクまでに遅延の半分、残りをチャンク間に均等に配分する
+        time.sleep(delay / 2)
+        if not sse:
+            write("[")
+        for i, piece in enumerate(pieces):
+            last = i == len(pieces) - 1
+            payload = {"candidates": [_candidate(piece, finish=last)]}
+            if last:
+                payload["usageMetadata"] = usage
+            data = json.dumps(payload, ensure_ascii=False)
+            write(f"data: {data}\r\n\r\n" if sse else (data if i == 0 else "," + data))
+            if not last:
+                time.sleep(delay / 2 / len(pieces))
+        if not sse:
+            write("]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def load_config(path: str) -> dict:
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def serve(port: int = 8089, config: dict = None, seed: int = None, host: str = "127.0.0.1"):
+    """Starts the mock server (blocking)."""
+    MockGeminiHandler.state = MockState(config, seed)
+    server = ThreadingHTTPServer((host, port), MockGeminiHandler)
+    server.daemon_threads = True
+    print(f"🧪 Mock Gemini listening on http://{host}:{server.server_address[1]}")
+    print(f"   latency={MockGeminiHandler.state.config['latency']} "
+          f"error_rate={MockGeminiHandler.state.config['error_rate']} "
+          f"rate_limit_rate={MockGeminiHandler.state.config['rate_limit_rate']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 {json.dumps(MockGeminiHandler.state.snapshot())}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Gemini API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--config", help="YAML/JSON config (latency, error_rate, quota, responses)")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+    args = parser.parse_args()
+    serve(args.port, load_config(args.config), args.seed, args.host)
@@ -80,4 +80,6 @@ def mission_weather_report():
     print("\n✅ MISSION COMPLETE\n")
 
 if __name__ == "__main__":
+    from src.profiler import start_from_env
+    start_from_env()  # AIRPORT_PROFILE_OUT が設定されている場合のみ
     mission_weather_report()
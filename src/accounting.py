@@ -0,0 +1,256 @@
+"""
+Usage Accounting - tokens, bytes, retries and estimated cost of every LLM call.
+
+- 全バックエンドの呼び出しを record_usage() で記録する（プロセス全体の USAGE_TOTALS と、
+  実行中ミッションの UsageLedger の両方）
+- Gemini の usage_metadata が無い場合（再生テープ・モック）は文字数と画像サイズから推定し、estimated として数える
+- UsageLedger はステップ別にも集計し、MissionBudget（最大トークン・最大コスト・最大呼び出し回数）を超えたら
+  exceeded() が理由を返す。ミッションを止めるのは呼び出し側（ReActAgent / autopilot）
+
+実行中ミッションの Ledger は metrics.StepTimer と同じくコンテキスト変数（スレッド・asyncio タスクごと）で引き回す。
+"""
+
+import contextvars
+import json
+import math
+import threading
+
+from src.config import BUDGET_MAX_CALLS, BUDGET_MAX_COST, BUDGET_MAX_TOKENS
+
+# USD / 1M tokens (input, output)。公開価格を元にした見積もり用の値
+MODEL_PRICES = {
+    "gemini-3-flash-preview": (0.50, 3.00),
+    "gemini-3-pro-preview": (2.00, 12.00),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gemini-2.0-flash": (0.10, 0.40),
+}
+DEFAULT_PRICE = (0.50, 3.00)
+
+# Gemini は画像を 768x768 タイルごとに 258 トークンとして数える
+IMAGE_TILE_SIZE = 768
+IMAGE_TILE_TOKENS = 258
+CHARS_PER_TOKEN = 4
+
+# サブプロセス (run_airport.py) からサーバーへ集計を渡すための stdout 行のプレフィックス
+USAGE_PREFIX = "💰 USAGE "
+
+_current_ledger = contextvars.ContextVar("airport_ledger", default=None)
+
+
+def image_tokens(image) -> int:
+    width, height = image.size
+    tiles = max(1, math.ceil(width / IMAGE_TILE_SIZE)) * max(1, math.ceil(height / IMAGE_TILE_SIZE))
+    return tiles * IMAGE_TILE_TOKENS
+
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def call_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    input_price, output_price = MODEL_PRICES.get(model or "", DEFAULT_PRICE)
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class MissionBudget:
+    """Per-mission limits. None / 0 means unlimited."""
+
+    def __init__(self, max_tokens: int = None, max_cost: float = None, max_calls: int = None):
+        self.max_tokens = max_tokens or None
+        self.max_cost = max_cost or None
+        self.max_calls = max_calls or None
+
+    @classmethod
+    def from_config(cls, max_tokens: int = None, max_cost: float = None, max_calls: int = None):
+        """Request values override the AIRPORT_BUDGET_* defaults."""
+        return cls(
+            max_tokens if max_tokens is not None else BUDGET_MAX_TOKENS,
+            max_cost if max_cost is not None else BUDGET_MAX_COST,
+            max_calls if max_calls is not None else BUDGET_MAX_CALLS,
+        )
+
+    def check(self, totals: dict):
+        """Returns a human-readable reason when a limit is exceeded, else None."""
+        if self.max_tokens and totals["total_tokens"] > self.max_tokens:
+            return f"token budget exceeded ({totals['total_tokens']} > {self.max_tokens})"
+        if self.max_cost and totals["cost"] > self.max_cost:
+            return f"cost budget exceeded (${totals['cost']:.4f} > ${self.max_cost:.4f})"
+        if self.max_calls and totals["calls"] > self.max_calls:
+            return f"model call budget exceeded ({totals['calls']} > {self.max_calls})"
+        return None
+
+    def as_dict(self) -> dict:
+        return {"max_tokens": self.max_tokens, "max_cost": self.max_cost, "max_calls": self.max_calls}
+
+
+def _zero_totals() -> dict:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "retries": 0,
+        "estimated_calls": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "total_tokens": 0,
+        "images": 0,
+        "image_bytes": 0,
+        "prompt_bytes": 0,
+        "cost": 0.0,
+    }
+
+
+def _accumulate(totals: dict, usage: dict):
+    for key, value in usage.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+class UsageLedger:
+    """
+    Usage totals for one mission (or the whole process), also rolled up per step.
+    A child ledger (parent=...) keeps its own step number and forwards every call to the parent,
+    so tasks running concurrently in one mission are attributed to their own steps and share the parent's budget.
+    """
+
+    def __init__(self, budget: MissionBudget = None, goal: str = None, parent: "UsageLedger" = None):
+        self.budget = budget or (parent.budget if parent else MissionBudget())
+        self.goal = goal
+        self.parent = parent
+        self.step = None  # ランナーが現在のステップ番号を設定する
+        self._lock = threading.Lock()
+        self._totals = _zero_totals()
+        self._steps = {}
+        self._models = {}
+
+    def _add(self, usage: dict, model: str = None, step=None):
+        step = self.step if step is None else step
+        with self._lock:
+            _accumulate(self._totals, usage)
+            if step is not None:
+                _accumulate(self._steps.setdefault(step, _zero_totals()), usage)
+            if model:
+                _accumulate(self._models.setdefault(model, _zero_totals()), usage)
+        if self.parent:
+            self.parent._add(usage, model, step)
+
+    def record_call(self, model: str, input_tokens: int, output_tokens: int, images: int = 0,
+                    image_bytes: int = 0, prompt_bytes: int = 0, estimated: bool = False, error: bool = False):
+        self._add({
+            "calls": 1,
+            "errors": int(error),
+            "estimated_calls": int(estimated),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "images": images,
+            "image_bytes": image_bytes,
+            "prompt_bytes": prompt_bytes,
+            "cost": call_cost(model, input_tokens, output_tokens),
+        }, model)
+
+    def record_retry(self):
+        self._add({"retries": 1})
+
+    def totals(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+        totals["cost"] = round(totals["cost"], 6)
+        return totals
+
+    def step_totals(self, step) -> dict:
+        with self._lock:
+            totals = dict(self._steps.get(step) or _zero_totals())
+        totals["cost"] = round(totals["cost"], 6)
+        return totals
+
+    def exceeded(self):
+        """Reason string once the mission budget is exceeded, else None."""
+        if self.parent:
+            return self.parent.exceeded()
+        return self.budget.check(self.totals())
+
+    def summary(self) -> dict:
+        with self._lock:
+            steps = {str(step): {**t, "cost": round(t["cost"], 6)} for step, t in self._steps.items()}
+            models = {model: {**t, "cost": round(t["cost"], 6)} for model, t in self._models.items()}
+        return {
+            "goal": self.goal,
+            "totals": self.totals(),
+            "by_step": steps,
+            "by_model": models,
+            "budget": self.budget.as_dict(),
+            "budget_exceeded": self.exceeded(),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._totals = _zero_totals()
+            self._steps = {}
+            self._models = {}
+
+
+# プロセス全体（Attendant / プラン生成などミッション外の呼び出しも含む）
+USAGE_TOTALS = UsageLedger()
+
+
+def current_ledger():
+    return _current_ledger.get()
+
+
+def activate_ledger(ledger):
+    """Makes `ledger` the mission ledger of this thread or asyncio task (None to clear)."""
+    _current_ledger.set(ledger)
+    return ledger
+
+
+def record_usage(contents, usage: dict, model: str, response_text: str = "", error: bool = False, ledger=None):
+    """
+    Records one LLM call. `usage` is LLMResponse.usage (prompt_tokens / output_tokens);
+    when it is empty the tokens are estimated from the request and response size.
+    """
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    images = [p for p in parts if hasattr(p, "tobytes")]
+    texts = [p if isinstance(p, str) else str(p) for p in parts if not hasattr(p, "tobytes")]
+
+    from src.llm_backend import image_bytes  # 循環 import を避ける
+    uploaded_images = sum(image_bytes(img) for img in images)
+    prompt_bytes = sum(len(t.encode("utf-8")) for t in texts)
+
+    estimated = not usage
+    if usage:
+        input_tokens = usage.get("prompt_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+    elif error:
+        input_tokens = output_tokens = 0
+    else:
+        input_tokens = sum(estimate_text_tokens(t) for t in texts) + sum(image_tokens(img) for img in images)
+        output_tokens = estimate_text_tokens(response_text)
+
+    mission = ledger or current_ledger()
+    targets = [USAGE_TOTALS] if mission is None or mission is USAGE_TOTALS else [USAGE_TOTALS, mission]
+    for target in targets:
+        target.record_call(model, input_tokens, output_tokens, len(images), uploaded_images, prompt_bytes,
+                           estimated=estimated and not error, error=error)
+
+
+def record_retry():
+    USAGE_TOTALS.record_retry()
+    ledger = current_ledger()
+    if ledger is not None:
+        ledger.record_retry()
+
+
+def emit_usage(summary: dict):
+    """Prints the mission usage summary for run_process_wrapper to store in the flight metadata."""
+    print(USAGE_PREFIX + json.dumps(summary, ensure_ascii=False), flush=True)
+
+
+def parse_usage_line(line: str):
+    line = line.strip()
+    if not line.startswith(USAGE_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(USAGE_PREFIX):])
+    except ValueError:
+        return None
@@ -0,0 +1,182 @@
+"""
+Agent Memory - tiered ReAct history with constant RAM and constant prompt size per step.
+
+ReActAgent.history の置き換え。ステップは 3 段で保持する:
+    recent   - 直近 N ステップ（AIRPORT_MEMORY_RECENT_STEPS）はそのままの記録。プロンプトにもそのまま載る
+    summary  - それより古いステップは 1 行ずつ畳み込み、サイトごとの区間 (Step 3-9 @ www.google.com: …) にまとめる。
+               区間の数・区間内の行数には上限があり、溢れた古い区間はさらに粗くまとめる
+    facts    - 古いステップから取り出した事実（get_url の URL・read の値・保存したファイル・ユーザーの回答）。
+               上限を超えたら最も古く更新されたものから捨てる
+古いステップの完全な記録は spill_path (JSONL、サーバー経由ならフライトの Black Box の隣) に書き出してメモリから外す。
+
+list の代わりに使えるよう append / len / iter を持つ。iter はディスクに書き出した分も含め全ステップを順に返すので、
+ミッションのコンパイルやサイト知識の学習はこれまで通り全ステップを見られる（読むのは終了時の 1 回だけ）。
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+from src.config import MEMORY_MAX_FACTS, MEMORY_RECENT_STEPS
+from src.flight_index import compact_step
+from src.metrics import site_of
+
+SPILL_FILE = "react_history.jsonl"
+MAX_SEGMENTS = 8          # 要約の区間数の上限（溢れたら古い区間をまとめる）
+MAX_SEGMENT_ACTIONS = 6   # 区間ごとに残す行動の数（溢れたら先頭を「…」にする）
+FACT_LENGTH = 200
+
+
+def _short(value, limit: int = FACT_LENGTH) -> str:
+    text = " ".join(str(value).split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class AgentMemory:
+    def __init__(self, spill_path: str = None, recent: int = None, max_facts: int = None):
+        self.spill_path = spill_path
+        self.recent_limit = max(1, recent or MEMORY_RECENT_STEPS)
+        self.max_facts = max(1, max_facts or MEMORY_MAX_FACTS)
+        self.recent = []              # 直近のステップ（完全な記録）
+        self.segments = []            # {"first", "last", "sites", "steps", "errors", "actions"}
+        self.facts = OrderedDict()    # key -> 事実の1行
+        self.total = 0
+        self.folded = 0
+        if spill_path and os.path.exists(spill_path):
+            os.remove(spill_path)  # 同じパスで前の実行の記録が残っていれば捨てる
+
+    # ---- list 互換 ----
+    def append(self, entry: dict):
+        # 追加する前に溢れた分を畳む。直前のステップ（action_result を後から書き込む）は常に recent に残る
+        while len(self.recent) >= self.recent_limit:
+            self._fold(self.recent.pop(0))
+        self.recent.append(entry)
+        self.total += 1
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        """All steps in order: the spilled ones (read back from disk) followed by the recent ones."""
+        if self.folded and self.spill_path and os.path.exists(self.spill_path):
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        pass
+        yield from list(self.recent)
+
+    @property
+    def complete(self) -> bool:
+        """Whether iterating yields every step (nothing was evicted without being spilled)."""
+        return not self.folded or bool(self.spill_path)
+
+    # ---- folding ----
+    def _fold(self, entry: dict):
+        self._spill(entry)
+        self._extract_facts(entry)
+        self._summarize(entry)
+        self.folded += 1
+
+    def _spill(self, entry: dict):
+        if not self.spill_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.spill_path)), exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            print(f"   ⚠️ Memory Spill Error: {e}")
+
+    def _remember(self, key: str, text: str):
+        self.facts[key] = _short(text)
+        self.facts.move_to_end(key)
+        while len(self.facts) > self.max_facts:
+            # ユーザーの回答は最後まで残す（プロンプトで最優先と指示しているため）
+            oldest = next((k for k in self.facts if not k.startswith("user:")), next(iter(self.facts)))
+            del self.facts[oldest]
+
+    def _extract_facts(self, entry: dict):
+        if entry.get("role") == "user_intervention":
+            self._remember(f"user:{entry.get('step')}", f"👤 ユーザーの回答 (Step {entry.get('step')}): 「{entry.get('response', '')}」")
+            return
+        thought = entry.get("thought") or {}
+        action = thought.get("action")
+        params = thought.get("params") or {}
+        result = str(entry.get("action_result", ""))
+        if result.startswith("Error executing"):
+            return
+        if action == "read" and params.get("result"):
+            self._remember(f"read:{params.get('target')}", f"読み取り '{params.get('target', '')}': {params['result']}")
+        elif action == "get_url" and result.startswith("Got URL"):
+            label = params.get("label", "current_url")
+            self._remember(f"url:{label}", f"URL [{label}]: {result.split(': ', 1)[-1]}")
+        elif action == "save_file" and params.get("filename"):
+            self._remember(f"file:{params['filename']}", f"保存済み: {params['filename']}")
+        elif action == "run_terminal" and result:
+            self._remember(f"cmd:{params.get('command')}", f"`{_short(params.get('command', ''), 60)}` → {result}")
+
+    def _summarize(self, entry: dict):
+        step = entry.get("step")
+        if entry.get("role") == "user_intervention":
+            line, site, error = "👤 answered", None, False
+        else:
+            thought = entry.get("thought") or {}
+            action = thought.get("action") or "?"
+            line = compact_step(action, thought.get("params"))
+            url = entry.get("url") or ((thought.get("params") or {}).get("url") if action == "goto" else None)
+            site = site_of(url) if url else None
+            site = None if site in ("unknown", None) else site
+            error = str(entry.get("action_result", "")).startswith("Error executing")
+            if error:
+                line += " ✗"
+
+        last = self.segments[-1] if self.segments else None
+        if last is None or (site and last["sites"] and site not in last["sites"]):
+            last = {"first": step, "last": step, "sites": [], "steps": 0, "errors": 0, "actions": [], "dropped": 0}
+            self.segments.append(last)
+        if site and site not in last["sites"]:
+            last["sites"].append(site)
+        last["last"] = step
+        last["steps"] += 1
+        last["errors"] += int(error)
+        if not last["actions"] or last["actions"][-1] != line:
+            last["actions"].append(line)
+            if len(last["actions"]) > MAX_SEGMENT_ACTIONS:
+                last["actions"].pop(0)
+                last["dropped"] += 1
+
+        if len(self.segments) > MAX_SEGMENTS:
+            # 最も古い 2 区間を行動の詳細を捨てて 1 つにまとめる
+            oldest, second = self.segments.pop(0), self.segments[0]
+            sites = oldest["sites"] + [s for s in second["sites"] if s not in oldest["sites"]]
+            self.segments[0] = {
+                "first": oldest["first"], "last": second["last"], "sites": sites[:5],
+                "steps": oldest["steps"] + second["steps"], "errors": oldest["errors"] + second["errors"],
+                "actions": [], "dropped": oldest["dropped"] + second["dropped"] + len(oldest["actions"]) + len(second["actions"]),
+            }
+
+    # ---- prompt ----
+    def summary_text(self) -> str:
+        """Summary of the folded steps and the key facts (empty while everything is still verbatim)."""
+        if not self.folded:
+            return ""
+        lines = [f"これまでの要約 (古い {self.folded} ステップ):"]
+        for segment in self.segments:
+            span = f"Step {segment['first']}" + (f"-{segment['last']}" if segment["last"] != segment["first"] else "")
+            where = f" @ {', '.join(segment['sites'])}" if segment["sites"] else ""
+            errors = f", {segment['errors']} errors" if segment["errors"] else ""
+            if segment["actions"]:
+                actions = (["…"] if segment["dropped"] else []) + segment["actions"]
+                lines.append(f"- {span}{where}{errors}: " + " → ".join(actions))
+            else:
+                lines.append(f"- {span}{where}: {segment['steps']} steps{errors}")
+        if self.facts:
+            lines.append("判明している事実:")
+            lines.extend(f"- {fact}" for fact in self.facts.values())
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        return {"steps": self.total, "recent": len(self.recent), "folded": self.folded,
+                "segments": len(self.segments), "facts": len(self.facts), "spill_path": self.spill_path}
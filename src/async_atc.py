@@ -0,0 +1,471 @@
+"""
+Async ATC - asyncio-native Playwright engine: one event loop drives many browser sessions.
+
+ATC (src/main.py) は sync_playwright の上に作られていて、1 セッションが 1 スレッドを占有する
+（並列実行はワーカースレッドやサブプロセスごとにブラウザを起動していた）。AsyncATC は同じ操作
+(nav / click / type_text / type_text_vision / press_key / read_screen / screenshot / wait_for / 動画録画) を
+async_playwright の上で提供する:
+    AsyncBrowserPool - 1 つのブラウザを多数のセッションで共有し、セッションごとにコンテキスト
+                       （Cookie・ストレージ・動画が独立）を作る。セッションの追加コストはコンテキスト 1 つ分
+    ブロッキング処理 - Vision (LLM) 呼び出しとテンプレートマッチは asyncio.to_thread で実行し、ループを止めない
+    計測・使用量     - metrics.phase / Ledger / ルーターはコンテキスト変数なので、タスクごとに独立して記録される
+クリックの実行プロファイル (EXECUTION_PROFILES)・サイト知識・条件待ちの意味は ATC と同じ: どちらも
+src.main._ATCCommon の判断（解決の順序・撮影・条件の順序・settle の待ち方）を使い、違うのは Playwright の呼び出しだけ。
+既存のスクリプト・サーバーは同期の ATC をそのまま使える。
+"""
+
+import asyncio
+import io
+import os
+import time
+
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+from src.browsing import BrowsingGuard
+from src.config import BROWSING_PROFILE, EXECUTION_PROFILE, HEADLESS, SCREENSHOTS_DIR, VIDEOS_DIR, VIEWPORT_SIZE
+from src.main import (
+    CONDITION_POLL, DEFAULT_WAIT_TIMEOUT, SELECTOR_WAIT, WaitTimeout, _ATCCommon, _DESCRIBE_ELEMENT_JS, _HAS_TEXT_JS,
+    _LOCATE_ELEMENT_JS, _WAIT_FOR_SETTLE_JS, _box_center, _load_state, _poll_intervals, _stable_frame, _url_matcher,
+    _visual_target, _wanted_conditions,
+)
+from src.metrics import phase, site_of
+from src.mission_compiler import dhash
+from src.profile_store import masked
+from src.site_knowledge import SITE_KNOWLEDGE
+from src.template_matcher import MIN_CONFIDENCE, TEMPLATE_MATCHER
+
+
+class AsyncBrowserPool:
+    """One browser shared by many AsyncATC sessions on the same event loop (each session gets its own context)."""
+
+    def __init__(self, headless: bool = None):
+        self.headless = HEADLESS if headless is None else headless
+        self.playwright = None
+        self.browser = None
+        self.contexts = 0   # これまでに作ったコンテキストの数
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._lock:
+            if not self.browser:
+                self.playwright = await async_playwright().start()
+                self.browser = await self.playwright.chromium.launch(headless=self.headless)
+        return self.browser
+
+    async def new_context(self, record_video: bool = True, **extra):
+        browser = await self.start()
+        options = {"viewport": VIEWPORT_SIZE, **extra}
+        if record_video:
+            video_dir = str(VIDEOS_DIR)
+            os.makedirs(video_dir, exist_ok=True)
+            options.update(record_video_dir=video_dir, record_video_size=VIEWPORT_SIZE)
+        self.contexts += 1
+        return await browser.new_context(**options)
+
+    async def close(self):
+        async with self._lock:
+            if self.browser:
+                await self.browser.close()
+            if self.playwright:
+                await self.playwright.stop()
+            self.browser = None
+            self.playwright = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncATC(_ATCCommon):
+    def __init__(self, pool: AsyncBrowserPool = None, profile: str = None, record_video: bool = True,
+                 browsing: str = None):
+        """
+        pool: shared browser. Without one, the session owns a private pool (like ATC owns its browser).
+        record_video: records the session's context (the video path is returned by stop_session()).
+        browsing: browsing profile of the session's context (full / lite / text, see src.browsing).
+        """
+        self.pool = pool or AsyncBrowserPool()
+        self.owns_pool = pool is None
+        self.record_video = record_video
+        self.profile = None
+        self.set_profile(profile or EXECUTION_PROFILE)
+        self.browsing = None
+        self.set_browsing(browsing or BROWSING_PROFILE)
+        self.guard = None
+        self.img_base = str(SCREENSHOTS_DIR)
+        os.makedirs(self.img_base, exist_ok=True)
+        self.context = None
+        self.page = None
+        # このセッションでサイト知識（既知の要素）を使ったサイト
+        self.used_knowledge = set()
+
+    # ---- session ----
+    async def start_session(self):
+        """Opens a fresh context (cookies, storage, video) and page on the pool's browser."""
+        print("🛫 Starting Browser Session (async)...")
+        guard = BrowsingGuard(self.browsing)
+        self.context = await self.pool.new_context(record_video=self.record_video, **guard.context_options())
+        await guard.install_async(self.context)
+        self.guard = guard
+        self.page = await self.context.new_page()
+        return self.page
+
+    async def stop_session(self, keep_browser: bool = True):
+        """
+        Closes the session's context and returns the video path if recorded.
+        keep_browser: False also closes a privately owned browser (a shared pool is closed by its owner).
+        """
+        print("🛬 Ending Session...")
+        video_path = None
+        if self.page and self.page.video:
+            try:
+                video_path = await self.page.video.path()
+            except Exception:
+                pass
+        if self.context:
+            await self.context.close()  # これで動画ファイルが確定される
+        SITE_KNOWLEDGE.flush_settle()
+        if video_path:
+            print(f"🎥 Video saved to: {video_path}")
+        self.page = None
+        self.context = None
+        if not keep_browser and self.owns_pool:
+            await self.pool.close()
+        return video_path
+
+    async def __aenter__(self):
+        await self.start_session()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop_session(keep_browser=False)
+
+    def _require_page(self):
+        if not self.page: raise Exception("No active session")
+        return self.page
+
+    # ---- actions ----
+    async def nav(self, url, wait_until=None):
+        """Navigates to a URL. wait_until: load state to wait for (load / domcontentloaded / networkidle / commit)."""
+        if not self.page: await self.start_session()
+        print(f"🧭 Navigating to: {url}")
+        if wait_until:
+            await self.page.goto(url, wait_until=wait_until)
+        else:
+            await self.page.goto(url)
+
+    async def type_text(self, selector, text):
+        """Types text into an element."""
+        page = self._require_page()
+        print(f"⌨️ Typing '{masked(selector, text)}' into {selector}")
+        await page.fill(selector, text)
+
+    async def press_key(self, key):
+        """Presses a specific key (e.g., 'Enter', 'Tab')."""
+        page = self._require_page()
+        print(f"🎹 Pressing Key: '{key}'")
+        await page.keyboard.press(key)
+
+    async def screenshot(self, path=None):
+        """PNG bytes of the viewport (also written to `path` when given)."""
+        page = self._require_page()
+        with phase("capture"):
+            return await page.screenshot(path=path)
+
+    async def read_screen(self, instruction):
+        """Reads information from the screen using Vision."""
+        self._require_page()
+        print(f"👁️📄 Vision Reading: '{instruction}'")
+        img_path = self._shot_path("read")
+        await self.screenshot(img_path)
+
+        from src.llm_core import VisionCore
+        answer = await asyncio.to_thread(VisionCore().ask_about_image, img_path, instruction)
+        self._record_answer(instruction, answer)
+        return answer
+
+    async def type_text_vision(self, instruction, text, selectors=None, grounded=None):
+        """Types text using Vision to find the field (or one of `selectors`). Returns the click result."""
+        page = self._require_page()
+        print(f"👁️⌨️ Vision Typing: '{masked(instruction, text)}' -> Target: '{instruction}'")
+        result = await self.click(mode="llm", instruction=instruction, selectors=selectors, grounded=grounded)
+        if result["result"] == "Executed":
+            with phase("settle"):
+                await asyncio.sleep(0.5)
+            await page.keyboard.insert_text(text)
+            print(f"    ↳ Typed (Inserted): {masked(instruction, text)}")
+            return result
+
+    async def click(self, selector=None, mode="hybrid", instruction=None, profile=None, selectors=None, grounded=None):
+        """
+        Clicks an element using the specified mode (same modes, profiles, compiled `selectors` and look-ahead `grounded` point as ATC.click).
+        Returns the same dict as ATC.click.
+        """
+        page = self._require_page()
+        options = self._click_options(profile)
+        timestamp = int(time.time() * 1000)
+        pre_shot = self._shot_path("pre", timestamp)
+        frame = {}
+
+        async def capture_pre(for_vision=False):
+            """クリック前の画面を 1 回だけ撮り、グラウンディング・見た目の確認・証跡で共有する"""
+            if "png" not in frame:
+                keep = self._keeps_pre_shot(options, for_vision)
+                frame["png"] = await self.screenshot(pre_shot if keep else None)
+                frame["path"] = pre_shot if keep else None
+            return frame["png"]
+
+        target_x, target_y = 0, 0
+        resolved = {}
+        if mode == "llm":
+            site = site_of(page.url)
+            located = await self.locate_selectors(selectors) if selectors else None
+            known = not located
+            if known:
+                located = await self._locate_known(site, instruction)
+            if located:
+                target_x, target_y = located["x"], located["y"]
+                resolved = self._resolved_without_vision(instruction, located, known)
+            else:
+                self._vision_mode(instruction, grounded)
+                if grounded:
+                    point = grounded
+                else:
+                    from src.llm_core import VisionCore
+                    await capture_pre(for_vision=True)
+                    point = await asyncio.to_thread(VisionCore().analyze_image, pre_shot, instruction)
+                target_x, target_y = self._vision_target(point)
+                element = await self._describe_safely(target_x, target_y)
+                resolved = self._resolved_by_vision(site, instruction, element)
+        else:
+            if not selector: raise Exception("Selector required for non-LLM modes")
+            try:
+                await page.wait_for_selector(selector, timeout=5000)
+                element = await page.query_selector(selector)
+                box = await element.bounding_box()
+                target_x, target_y = _box_center(box)
+                if mode in ["gui", "hybrid"]:
+                    candidates = await self.match_element(element, await capture_pre(), key=(site_of(page.url), selector), box=box)
+                    target_x, target_y = _visual_target((target_x, target_y), candidates)
+            except Exception as e:
+                print(f"DOM/Wait Error: {e}")
+                if mode == "hybrid": raise
+
+        if options["pre_shot"]:
+            await capture_pre()
+
+        print(f"🖱️ Clicking at ({target_x}, {target_y})")
+        if options["animate"]:
+            await page.mouse.move(target_x, target_y, steps=5)
+            with phase("settle"):
+                await asyncio.sleep(0.2)
+        await page.mouse.click(target_x, target_y)
+
+        await self.settle("click", 1.0, fixed=options["settle"] != "dom")
+        post_shot = None
+        if options["post_shot"]:
+            post_shot = self._shot_path("post", timestamp)
+            await self.screenshot(post_shot)
+        return self._click_result((target_x, target_y), frame, post_shot, resolved)
+
+    async def locate_selectors(self, selectors, timeout=SELECTOR_WAIT):
+        """The first of `selectors` matching exactly one visible element → {"x", "y", "selector"} (see ATC.locate_selectors)."""
+        if not self.page or not selectors: return None
+        deadline = time.time() + timeout
+        while True:
+            for selector in selectors:
+                try:
+                    locator = self.page.locator(selector)
+                    if await locator.count() != 1:
+                        continue
+                    box = await locator.bounding_box(timeout=500)
+                except Exception:
+                    continue
+                if box and box["width"] > 0 and box["height"] > 0:
+                    x, y = _box_center(box)
+                    return {"x": x, "y": y, "selector": selector}
+            if time.time() >= deadline:
+                print(f"    🩹 No compiled selector matched ({len(selectors)} tried)")
+                return None
+            await asyncio.sleep(0.1)
+
+    async def _describe_safely(self, x, y):
+        try:
+            return await self.describe_element_at(x, y)
+        except Exception as e:
+            print(f"⚠️ Describe Element Error: {e}")
+            return None
+
+    async def match_element(self, element, screen_png, key=None, box=None):
+        """
+        Ranked visual candidates for a DOM element (see src.template_matcher), matched off the event loop.
+        The element screenshot is only taken when `key` has no cached template, or the cached one no longer matches.
+        """
+        viewport = self.page.viewport_size or {}
+        box = box or await element.bounding_box()
+        template = None if TEMPLATE_MATCHER.cached(key) is not None else await element.screenshot()
+
+        def _match(png):
+            return TEMPLATE_MATCHER.match(screen_png, capture=(lambda: png) if png else None, key=key, box=box,
+                                          viewport_width=viewport.get("width"))
+
+        candidates = await asyncio.to_thread(_match, template)
+        if template is None and (not candidates or candidates[0]["confidence"] < MIN_CONFIDENCE):
+            # 見た目が変わった要素: 撮り直したテンプレートで探し直す
+            TEMPLATE_MATCHER.forget(key)
+            candidates = await asyncio.to_thread(_match, await element.screenshot())
+        return candidates
+
+    # ---- site knowledge ----
+    async def _locate_known(self, site, instruction):
+        element = self._known_element(site, instruction)
+        if not element:
+            return None
+        return self._report_known(site, instruction, await self.locate_element(element))
+
+    async def describe_element_at(self, x, y):
+        """Semantic descriptor of the element at viewport (x, y), or None."""
+        if not self.page: return None
+        return await self.page.evaluate(_DESCRIBE_ELEMENT_JS, [x, y, False])
+
+    async def locate_element(self, descriptor):
+        """Finds the element of a descriptor on the current page. Returns {"x", "y", "strategy"} or None."""
+        if not self.page or not descriptor: return None
+        return await self.page.evaluate(_LOCATE_ELEMENT_JS, descriptor)
+
+    # ---- waits ----
+    async def wait_for_settle(self, timeout, quiet=0.5):
+        """Waits until the DOM has been quiet for `quiet` seconds and the page is loaded. Returns (elapsed, settled)."""
+        started = time.time()
+        while True:
+            remaining = timeout - (time.time() - started)
+            if remaining <= 0:
+                return time.time() - started, False
+            try:
+                settled = await self.page.evaluate(_WAIT_FOR_SETTLE_JS, [quiet * 1000, remaining * 1000])
+                return time.time() - started, bool(settled)
+            except Exception:
+                try:
+                    await self.page.wait_for_load_state("load", timeout=max(1, remaining * 1000))
+                except Exception:
+                    return time.time() - started, False
+
+    async def settle(self, action, default, use_knowledge=None, on_settled=None, fixed=True):
+        """Waits for the page to settle after `action` (see ATC.settle; on_settled is a coroutine function)."""
+        mode = self._settle_mode(use_knowledge, on_settled, fixed)
+        if mode == "sleep":
+            with phase("settle"):
+                await asyncio.sleep(default)
+            return
+        if mode == "dom":
+            started = time.time()
+            with phase("settle"):
+                _, settled = await self.wait_for_settle(default)
+            if settled and on_settled:
+                await on_settled()
+            if fixed:
+                with phase("settle"):
+                    await asyncio.sleep(max(0.0, default - (time.time() - started)))
+            return
+        site, budget = self._settle_budget(action, default)
+        with phase("settle"):
+            elapsed, settled = await self.wait_for_settle(budget)
+        SITE_KNOWLEDGE.observe_settle(site, action, elapsed, settled)
+        if settled and on_settled:
+            await on_settled()
+
+    async def wait_for(self, timeout=DEFAULT_WAIT_TIMEOUT, poll=None, state=None, **conditions):
+        """Waits until every given condition holds; same conditions and poll strategies as ATC.wait_for."""
+        self._require_page()
+        wanted = _wanted_conditions(conditions)
+
+        started = time.time()
+        deadline = started + timeout
+        with phase("settle"):
+            for name, value in wanted:
+                if not await self._wait_condition(name, value, deadline, poll, state):
+                    raise WaitTimeout(f"Timed out after {timeout}s waiting for {name}={value!r}")
+        return self._ready(started, wanted)
+
+    async def _wait_condition(self, name, value, deadline, poll, state=None):
+        page = self.page
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        ms = max(1, remaining * 1000)
+        try:
+            if name in ("load_state", "network_idle"):
+                await page.wait_for_load_state(_load_state(name, value), timeout=ms)
+                return True
+            if name == "url":
+                matches = _url_matcher(value)
+                if poll is None:
+                    await page.wait_for_url(matches, timeout=ms)
+                    return True
+                return await self._poll(lambda: matches(page.url), deadline, poll)
+            if name == "selector":
+                await page.wait_for_selector(value, state=state or "visible", timeout=ms)
+                return True
+            if name == "text":
+                if poll is None:
+                    try:
+                        await page.wait_for_function(_HAS_TEXT_JS, arg=value, timeout=ms, polling="raf")
+                        return True
+                    except PlaywrightTimeoutError:
+                        return False
+                    except Exception:
+                        pass  # 待機中のページ遷移でコンテキストが破棄された → 残り時間はポーリングで
+                return await self._poll(lambda: page.evaluate(_HAS_TEXT_JS, value), deadline,
+                                        poll or CONDITION_POLL[name])
+            if name == "settle":
+                return (await self.wait_for_settle(remaining))[1]
+            if name == "stable":
+                return await self._wait_stable(deadline, poll or CONDITION_POLL[name])
+            if name == "vision":
+                return await self._wait_vision(value, deadline, poll or CONDITION_POLL[name])
+        except PlaywrightTimeoutError:
+            return False
+        return False
+
+    async def _poll(self, check, deadline, poll):
+        """Awaits check() (a plain value or an awaitable) with the poll strategy's intervals until it is true or the deadline passes."""
+        for interval in _poll_intervals(poll):
+            try:
+                result = check()
+                if asyncio.iscoroutine(result) or asyncio.isfuture(result):
+                    result = await result
+                if result:
+                    return True
+            except Exception:
+                pass  # 遷移中などで確かめられなければ次の回に
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(interval, remaining))
+
+    async def _wait_stable(self, deadline, poll):
+        """Screenshots until STABLE_FRAMES consecutive frames have (nearly) the same dHash."""
+        frames = []
+
+        async def _check():
+            frame = dhash(io.BytesIO(await self.screenshot()))
+            return _stable_frame(frames, frame)
+
+        return await self._poll(_check, deadline, poll)
+
+    async def _wait_vision(self, question, deadline, poll):
+        """Asks the Vision model whether `question` holds for the current screen until it says yes."""
+        from src.llm_core import VisionCore
+        vision = VisionCore()
+
+        async def _check():
+            img_path = self._shot_path("wait")
+            await self.screenshot(img_path)
+            met, confidence = await asyncio.to_thread(vision.check_condition, img_path, question)
+            print(f"    👁️ '{question}' → {met} ({confidence})")
+            return met
+
+        return await self._poll(_check, deadline, poll)
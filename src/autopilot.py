@@ -1,70 +1,885 @@
+import os
+import sys
+import json
 import yaml
 import time
+import queue
+import asyncio
 import argparse
-from .main import ATC
+import threading
+from .async_atc import AsyncATC, AsyncBrowserPool
+from .browsing import BROWSING_PROFILES
+from .main import ATC, DEFAULT_WAIT_TIMEOUT, EXECUTION_PROFILES, WAIT_CONDITIONS, WaitTimeout
+from .metrics import METRICS, StepTimer, activate, emit_timing, phase, site_of
+from .accounting import MissionBudget, UsageLedger, activate_ledger, emit_usage
+from .config import (
+    AUTOPILOT_ENGINE, AUTOPILOT_SESSION, AUTOPILOT_WAITS, AUTOPILOT_WORKERS, BROWSING_PROFILE, EXECUTION_PROFILE,
+    LOOKAHEAD_GROUNDING, PLAN_COMPILER, PROFILE_STORE_ENABLED, SITE_KNOWLEDGE_ENABLED,
+)
+from .lookahead import LookAhead
+from .plan_compiler import PlanCompiler, is_vision_step
+from .profile_store import LoginReuse
+from .site_knowledge import SITE_KNOWLEDGE
 
-def run_workflow(yaml_path):
-    print(f"✈️ Loading Flight Plan: {yaml_path}")
-    
+SESSION_POLICIES = ("task", "worker")
+# sync = ATC (スレッドごとにブラウザ) / async = AsyncATC（1 つのイベントループ・共有ブラウザ、タスクごとにコンテキスト）
+ENGINES = ("sync", "async")
+# サブプロセス (run_airport.py) からサーバーへスイートの集計を渡すための stdout 行のプレフィックス
+SUITE_PREFIX = "📋 SUITE "
+
+# wait_for: / until: の省略形
+WAIT_SHORTHANDS = {
+    "settle": {"settle": True},
+    "stable": {"stable": True},
+    "networkidle": {"network_idle": True},
+    "load": {"load_state": "load"},
+    "domcontentloaded": {"load_state": "domcontentloaded"},
+}
+
+def wait_conditions(spec):
+    """A `wait_for:` / `until:` spec (a dict of ATC.wait_for conditions, or a shorthand such as "settle") → dict."""
+    if isinstance(spec, str):
+        if spec not in WAIT_SHORTHANDS:
+            raise ValueError(f"Unknown wait shorthand '{spec}' (expected one of {', '.join(WAIT_SHORTHANDS)} or a dict)")
+        return dict(WAIT_SHORTHANDS[spec])
+    return dict(spec or {})
+
+def _wait_spec(spec, timeout, optional):
+    """(conditions, timeout, optional) of a wait spec: its own timeout / optional keys take precedence."""
+    conditions = wait_conditions(spec)
+    return conditions, conditions.pop("timeout", timeout), conditions.pop("optional", optional)
+
+def _wait_timed_out(error, optional):
+    if not optional:
+        raise error
+    print(f"    ⏳ {error} (continuing)")
+
+def wait_until(atc, spec, timeout=DEFAULT_WAIT_TIMEOUT, optional=False):
+    """
+    Waits for the conditions of `spec` (its own timeout / poll / optional / state keys take precedence).
+    optional: a timeout is logged instead of failing the step.
+    """
+    conditions, timeout, optional = _wait_spec(spec, timeout, optional)
+    try:
+        atc.wait_for(timeout=timeout, **conditions)
+    except WaitTimeout as e:
+        _wait_timed_out(e, optional)
+
+async def wait_until_async(atc, spec, timeout=DEFAULT_WAIT_TIMEOUT, optional=False):
+    """wait_until for an AsyncATC."""
+    conditions, timeout, optional = _wait_spec(spec, timeout, optional)
+    try:
+        await atc.wait_for(timeout=timeout, **conditions)
+    except WaitTimeout as e:
+        _wait_timed_out(e, optional)
+
+def _step_call(step):
+    """(ATC method name, kwargs) of a step that maps to one ATC call, else None (wait / wait_for / unknown actions)."""
+    action = step.get("action")
+    if action == "goto":
+        return "nav", {"url": step.get("url"), "wait_until": step.get("wait_until")}
+    if action == "click":
+        return "click", {"selector": step.get("selector"), "mode": step.get("mode", "hybrid"),
+                         "instruction": step.get("instruction"), "profile": step.get("profile"),
+                         "selectors": step.get("selectors"), "grounded": step.get("grounded")}
+    if action == "type":
+        return "type_text", {"selector": step.get("selector"), "text": step.get("text")}
+    if action == "type_vision":
+        return "type_text_vision", {"instruction": step.get("instruction"), "text": step.get("text"),
+                                    "selectors": step.get("selectors"), "grounded": step.get("grounded")}
+    if action == "key":
+        return "press_key", {"key": step.get("key")}
+    if action == "read":
+        return "read_screen", {"instruction": step.get("instruction")}
+    return None
+
+def _step_wait(step, wait_mode):
+    """
+    What a step waits for: ("sleep", seconds), ("until", spec, timeout, optional) or None,
+    followed by its `wait_for:` post-condition (or None).
+    """
+    action = step.get("action")
+    wait = None
+    if action == "wait":
+        # until: があれば（またはプランの waits: で格上げされていれば）最大 seconds 秒、条件が揃った時点で進む
+        until = step.get("until") or (wait_mode if wait_mode not in (None, "fixed") else None)
+        if until:
+            wait = ("until", until, step.get("seconds", 1), True)
+        else:
+            wait = ("sleep", step.get("seconds", 1))
+    elif action == "wait_for":
+        conditions = {name: step[name] for name in WAIT_CONDITIONS + ("poll", "state") if name in step}
+        wait = ("until", conditions, step.get("timeout", DEFAULT_WAIT_TIMEOUT), step.get("optional", False))
+    post = step.get("wait_for") if action not in ("wait", "wait_for") else None
+    return wait, post
+
+def execute_step(atc, step, wait_mode=None, on_settled=None):
+    """
+    Dispatches one flight plan step to the ATC.
+    Any step may have a `wait_for:` post-condition (e.g. a selector that appears after a click).
+    wait_mode: how plain `wait: seconds` steps wait ("fixed", or a shorthand such as "settle" = at most N seconds).
+    Vision steps may carry compiled `selectors:` (see src.plan_compiler), tried before the Vision model,
+    and a look-ahead `grounded:` point (see src.lookahead) used instead of it.
+    on_settled: called during a fixed `wait: N` as soon as the page is quiet; the rest of the N seconds is still waited.
+    Returns what the ATC call returned (e.g. the click result), None for waits.
+    """
+    result = None
+    call = _step_call(step)
+    if call:
+        method, kwargs = call
+        result = getattr(atc, method)(**kwargs)
+    wait, post = _step_wait(step, wait_mode)
+    if wait and wait[0] == "sleep":
+        # 固定の待ち（サイト知識は使わない）。on_settled があれば DOM が落ち着いた時点で呼ぶ
+        atc.settle("wait", wait[1], use_knowledge=False, on_settled=on_settled)
+    elif wait:
+        wait_until(atc, wait[1], timeout=wait[2], optional=wait[3])
+    if post:
+        wait_until(atc, post)
+    return result
+
+async def execute_step_async(atc, step, wait_mode=None, on_settled=None):
+    """execute_step for an AsyncATC (on_settled is a coroutine function)."""
+    result = None
+    call = _step_call(step)
+    if call:
+        method, kwargs = call
+        result = await getattr(atc, method)(**kwargs)
+    wait, post = _step_wait(step, wait_mode)
+    if wait and wait[0] == "sleep":
+        await atc.settle("wait", wait[1], use_knowledge=False, on_settled=on_settled)
+    elif wait:
+        await wait_until_async(atc, wait[1], timeout=wait[2], optional=wait[3])
+    if post:
+        await wait_until_async(atc, post)
+    return result
+
+def load_plan(yaml_path):
     with open(yaml_path, 'r') as f:
-        plan = yaml.safe_load(f)
-        
-    atc = ATC()
-    
-    for task in plan.get("tasks", []):
+        return yaml.safe_load(f) or {}
+
+def task_dependencies(tasks):
+    """
+    Resolves each task's optional `depends_on` (a task name or a list of names) to task indices.
+    Raises ValueError for unknown / ambiguous names and dependency cycles.
+    """
+    names = {}
+    for index, task in enumerate(tasks):
+        names.setdefault(task.get("name"), []).append(index)
+    deps = []
+    for index, task in enumerate(tasks):
+        wanted = task.get("depends_on") or []
+        if isinstance(wanted, str):
+            wanted = [wanted]
+        resolved = []
+        for name in wanted:
+            matches = names.get(name, [])
+            if len(matches) != 1:
+                problem = "unknown" if not matches else "ambiguous"
+                raise ValueError(f"Task '{task.get('name')}' depends on {problem} task '{name}'")
+            if matches[0] == index:
+                raise ValueError(f"Task '{name}' depends on itself")
+            resolved.append(matches[0])
+        deps.append(resolved)
+
+    # 循環の検出（Kahn）
+    remaining = {i: set(d) for i, d in enumerate(deps)}
+    while remaining:
+        free = [i for i, d in remaining.items() if not d]
+        if not free:
+            cycle = ", ".join(str(tasks[i].get("name")) for i in sorted(remaining))
+            raise ValueError(f"Dependency cycle between tasks: {cycle}")
+        for i in free:
+            del remaining[i]
+        for d in remaining.values():
+            d.difference_update(free)
+    return deps
+
+def _new_task_result(task):
+    return {
+        "name": task.get("name"),
+        "success": False,
+        "steps_total": len(task.get("steps", [])),
+        "steps_completed": 0,
+        "error": None,
+        "steps": [],
+    }
+
+class _TaskRun:
+    """The engine-independent bookkeeping of one task (run_task and run_task_async only differ in the ATC calls)."""
+
+    def __init__(self, atc, task, task_index, ledger, more_tasks, compiler, lookahead, logins):
         print(f"\n🔹 Executing Task: {task.get('name')}")
-        
-        # Start persistent session for this task
-        atc.start_session()
-        
+        self.atc = atc
+        self.task_index = task_index
+        self.ledger = ledger
+        self.more_tasks = more_tasks
+        self.compiler = compiler
+        self.steps = task.get("steps", [])
+        self.result = _new_task_result(task)
+        self.result["started"] = round(time.time(), 3)
+        self.budget_stop = None
+        self.typed = None  # see _learn_typed
+        self.ahead = _look_ahead(atc, self.steps, task_index, compiler) if lookahead else None
+        self.login = _login_reuse(self.steps) if logins else None
+        self.timer = None
+        self.site = None
+
+    def begin_step(self, index, step):
+        """Starts the step's timing; returns the step as it will run (see _prepare)."""
+        print(f"  Step {index+1}: {step.get('action')}")
+        self.timer = activate(StepTimer(index + 1, step.get("action")))
+        self.ledger.step = f"{self.task_index + 1}.{index + 1}"
+        self.site = site_of(self.atc.page.url) if self.atc.page else None
+        return _prepare(self.compiler, self.task_index, index, step, self.atc.page)
+
+    def record(self, index, step, result):
+        if self.compiler:
+            self.compiler.record(PlanCompiler.step_key(self.task_index, index), step, self.site, result)
+
+    def fail(self, index, step, error):
+        print(f"    ❌ Step Failed: {error}")
+        # For now, a failed step ends the task.
+        self.result["error"] = f"Step {index+1} ({step.get('action')}): {error}"
+
+    def end_step(self, step):
+        _end_step(self.timer, self.atc, self.ledger, self.result, step.get("action"))
+
+    def next_step(self, step) -> bool:
+        """Counts a completed step; False when the mission budget stops the task here."""
+        self.result["steps_completed"] += 1
+        self.typed = _learn_typed(self.typed, step, self.atc.page)
+        self.budget_stop = _budget_stop(self.ledger, self.result, self.more_tasks)
+        return not self.budget_stop
+
+    def succeeded(self):
+        self.result["success"] = self.result["steps_completed"] == len(self.steps)
+
+    def finish(self):
+        """Before the session stops: the look-ahead / login summaries and the site knowledge outcome."""
+        if self.ahead and self.ahead.stats["batches"]:
+            self.result["lookahead"] = self.ahead.summary()
+        if self.login and any(self.login.stats.values()):
+            self.result["login"] = self.login.summary()
+        _end_task(self.atc, self.result)
+
+    def done(self):
+        """(task_result, budget_reason) once the session has stopped."""
+        self.result["duration"] = round(time.time() - self.result["started"], 3)
+        return self.result, self.budget_stop
+
+def run_task(atc, task, task_index, ledger, more_tasks=False, keep_browser=False, wait_mode=None, compiler=None,
+             lookahead=False, logins=False):
+    """
+    Runs one task in its own browser session (context) of `atc`.
+    Returns (task_result, budget_reason); budget_reason is set when the mission budget stopped the task.
+    keep_browser: the browser stays open for the next task (session policy "worker").
+    wait_mode: see execute_step.
+    compiler: the plan's PlanCompiler; vision steps run with its selectors and (re)compile them when Vision was used.
+    lookahead: ground vision steps ahead of time (src.lookahead): one batch per screen, started during fixed waits.
+    logins: reuse the saved login of the task's login steps and save it after a fresh login (src.profile_store).
+    """
+    run = _TaskRun(atc, task, task_index, ledger, more_tasks, compiler, lookahead, logins)
+    ahead, login = run.ahead, run.login
+    
+    # Start persistent session for this task
+    atc.start_session()
+    try:
+        for i, step in enumerate(run.steps):
+            run_step = run.begin_step(i, step)
+            try:
+                with phase("act"):
+                    if login and login.covers(i, atc):
+                        result = None  # 保存したログイン状態で済んだ
+                    else:
+                        on_settled = None
+                        if ahead:
+                            run_step = _pre_ground(atc, ahead, i, run_step)
+                            if ahead.group(i + 1):
+                                on_settled = lambda: _start_ahead(atc, ahead, i + 1)
+                        result = execute_step(atc, run_step, wait_mode, on_settled=on_settled)
+                run.record(i, step, result)
+                if login:
+                    login.after_step(i, atc)
+            except Exception as e:
+                run.fail(i, step, e)
+                break
+            finally:
+                run.end_step(step)
+            if not run.next_step(step):
+                break
+        run.succeeded()
+    finally:
+        run.finish()
+        atc.stop_session(keep_browser=keep_browser)
+    return run.done()
+
+async def run_task_async(atc, task, task_index, ledger, more_tasks=False, wait_mode=None, compiler=None,
+                         lookahead=False, logins=False):
+    """run_task for an AsyncATC: the task's context is opened on the ATC's browser pool and closed afterwards."""
+    run = _TaskRun(atc, task, task_index, ledger, more_tasks, compiler, lookahead, logins)
+    ahead, login = run.ahead, run.login
+    
+    await atc.start_session()
+    try:
+        for i, step in enumerate(run.steps):
+            run_step = run.begin_step(i, step)
+            try:
+                with phase("act"):
+                    if login and await login.covers_async(i, atc):
+                        result = None
+                    else:
+                        on_settled = None
+                        if ahead:
+                            run_step = await _pre_ground_async(atc, ahead, i, run_step)
+                            if ahead.group(i + 1):
+                                on_settled = lambda: _start_ahead_async(atc, ahead, i + 1)
+                        result = await execute_step_async(atc, run_step, wait_mode, on_settled=on_settled)
+                run.record(i, step, result)
+                if login:
+                    await login.after_step_async(i, atc)
+            except Exception as e:
+                run.fail(i, step, e)
+                break
+            finally:
+                run.end_step(step)
+            if not run.next_step(step):
+                break
+        run.succeeded()
+    finally:
+        run.finish()
+        await atc.stop_session()
+    return run.done()
+
+def _prepare(compiler, task_index, index, step, page):
+    """The step as it will run: with its compiled selectors, if the plan compiler has any for the current site."""
+    if not compiler:
+        return step
+    return compiler.prepare(PlanCompiler.step_key(task_index, index), step, site_of(page.url) if page else None)
+
+def _look_ahead(atc, steps, task_index, compiler):
+    return LookAhead(steps, atc.img_base, prepare=lambda index: _prepare(compiler, task_index, index, steps[index], atc.page))
+
+def _login_reuse(steps):
+    """The task's LoginReuse (src.profile_store), or None when it has no login steps."""
+    login = LoginReuse(steps)
+    return login if login.span else None
+
+def _pre_ground(atc, ahead, index, step):
+    """
+    A vision step with its look-ahead `grounded:` point: the prediction made earlier if the screen is unchanged,
+    otherwise one batch for the step's whole screen group (a lone step is left to ATC.click).
+    """
+    if not _wants_pre_ground(atc, ahead, index):
+        return step
+    shot = ahead.shot_path(index)
+    with phase("capture"):
+        atc.page.screenshot(path=shot)
+    entry = _ahead_entry(ahead, index, shot, atc.page.url)
+    if not entry:
+        return step
+    with phase("inference"):
+        grounded = ahead.join(entry)
+    return {**step, "grounded": grounded} if grounded else step
+
+def _wants_pre_ground(atc, ahead, index):
+    return bool(atc.page and (ahead.pending(index) or len(ahead.group(index)) > 1))
+
+def _ahead_entry(ahead, index, shot, url):
+    """The look-ahead prediction for the step on this screen, grounding its screen group now if there is none."""
+    entry = ahead.take(index, shot, url)
+    if not entry and ahead.start(index, shot, url, minimum=2):
+        entry = ahead.take(index, shot, url)
+    return entry
+
+def _start_ahead(atc, ahead, index):
+    """固定待ちの間に落ち着いた画面で、次のビジョンステップのグラウンディングを始める"""
+    shot = ahead.shot_path(index)
+    with phase("capture"):
+        atc.page.screenshot(path=shot)
+    ahead.start(index, shot, atc.page.url)
+
+async def _pre_ground_async(atc, ahead, index, step):
+    """_pre_ground for an AsyncATC."""
+    if not _wants_pre_ground(atc, ahead, index):
+        return step
+    shot = ahead.shot_path(index)
+    with phase("capture"):
+        await atc.page.screenshot(path=shot)
+    entry = _ahead_entry(ahead, index, shot, atc.page.url)
+    if not entry:
+        return step
+    with phase("inference"):
+        grounded = await ahead.join_async(entry)
+    return {**step, "grounded": grounded} if grounded else step
+
+async def _start_ahead_async(atc, ahead, index):
+    shot = ahead.shot_path(index)
+    with phase("capture"):
+        await atc.page.screenshot(path=shot)
+    ahead.start(index, shot, atc.page.url)
+
+def _end_step(timer, atc, ledger, task_result, action):
+    """Finishes a step's timing: METRICS, the TIMING line and the task result's step row."""
+    activate(None)
+    timer.site = site_of(atc.page.url) if atc.page else None
+    timing = timer.finish()
+    timing["usage"] = ledger.step_totals(ledger.step)
+    network = atc.network_usage()
+    if network:
+        timing["network"] = network
+    METRICS.observe_step(timing, kind="autopilot")
+    emit_timing(timing)
+    row = {
+        "action": action,
+        "duration": timing["duration"],
+        "phases": timing["phases"],
+        "usage": timing["usage"],
+    }
+    if network:
+        row["network"] = network
+    task_result["steps"].append(row)
+
+def _learn_typed(typed, step, page):
+    """
+    typed: (入力したテキスト, 残りステップ数)。入力の直後のページURLから検索URLを学習する。
+    Returns the new `typed` state.
+    """
+    if step.get("text"):
+        return (step["text"], 3)
+    if typed and SITE_KNOWLEDGE_ENABLED:
+        text, remaining = typed
+        learned = page and SITE_KNOWLEDGE.learn_search_url(page.url, text)
+        return None if learned or remaining <= 1 else (text, remaining - 1)
+    return typed
+
+def _budget_stop(ledger, task_result, more_tasks):
+    """The budget reason when the mission budget stops the task here (and records it on the result), else None."""
+    budget_reason = ledger.exceeded()
+    if budget_reason and (task_result["steps_completed"] < task_result["steps_total"] or more_tasks):
+        print(f"    💸 Mission budget exceeded: {budget_reason}")
+        task_result["error"] = f"Budget exceeded: {budget_reason}"
+        return budget_reason
+    return None
+
+def _end_task(atc, task_result):
+    # 既知の要素を使ったサイトにタスクの成否を返す（失敗が続けば知識を捨てる）
+    for site in atc.used_knowledge:
+        SITE_KNOWLEDGE.record_flight(site, task_result["success"], used_knowledge=True)
+    atc.used_knowledge.clear()
+
+class _LineWriter:
+    """
+    stdout for parallel tasks: each thread's output is written a whole line at a time,
+    so the TIMING / ROUTE lines of concurrent tasks reach run_process_wrapper intact.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def write(self, text):
+        lines = (getattr(self._local, "buffer", "") + text).split("\n")
+        self._local.buffer = lines.pop()
+        if lines:
+            with self._lock:
+                self.stream.write("".join(line + "\n" for line in lines))
+                self.stream.flush()
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class _Suite:
+    """Scheduling state of one flight plan: which tasks are pending / running / passed / failed / skipped."""
+
+    def __init__(self, tasks, deps, ledger, session, wait_mode=None, profile=None, compiler=None, lookahead=False,
+                 browsing=None, profile_store=False):
+        self.tasks = tasks
+        self.deps = deps
+        self.ledger = ledger
+        self.session = session
+        self.wait_mode = wait_mode
+        self.profile = profile
+        self.compiler = compiler
+        self.lookahead = lookahead
+        self.browsing = browsing
+        self.profile_store = profile_store
+        self.results = [None] * len(tasks)
+        self.status = ["pending"] * len(tasks)
+        self.budget_stop = None  # 予算超過で打ち切った場合の理由
+        self._lock = threading.Lock()
+
+    def _skip(self, index, reason):
+        print(f"\n⏭️ Skipping Task: {self.tasks[index].get('name')} ({reason})")
+        result = _new_task_result(self.tasks[index])
+        result["error"] = reason
+        result["skipped"] = True
+        self.results[index] = result
+        self.status[index] = "skipped"
+
+    def take_ready(self, limit):
+        """
+        Marks up to `limit` tasks whose dependencies all passed as running and returns their indices.
+        Tasks that can no longer run (a dependency failed / the budget is exhausted) are recorded as skipped.
+        """
+        ready = []
+        with self._lock:
+            changed = True
+            while changed:
+                changed = False
+                for index, status in enumerate(self.status):
+                    if status != "pending":
+                        continue
+                    failed = [d for d in self.deps[index] if self.status[d] in ("failed", "skipped")]
+                    if self.budget_stop:
+                        self._skip(index, f"Budget exceeded: {self.budget_stop}")
+                        changed = True
+                    elif failed:
+                        self._skip(index, f"Dependency failed: {self.tasks[failed[0]].get('name')}")
+                        changed = True
+                    elif len(ready) < limit and all(self.status[d] == "passed" for d in self.deps[index]):
+                        self.status[index] = "running"
+                        ready.append(index)
+        return ready
+
+    def _begin(self, index, worker):
+        """(more_tasks, ledger) of a task about to run. Parallel workers get a child ledger so their steps are attributed per task."""
+        task = self.tasks[index]
+        with self._lock:
+            more_tasks = any(s == "pending" for s in self.status) or self.status.count("running") > 1
+        ledger = self.ledger if worker is None else activate_ledger(UsageLedger(goal=task.get("name"), parent=self.ledger))
+        return more_tasks, ledger
+
+    def _task_error(self, index, error):
+        # セッションを開始できなかった場合など
+        print(f"    ❌ Task Failed: {error}")
+        result = _new_task_result(self.tasks[index])
+        result["error"] = f"Task error: {error}"
+        return result
+
+    def _end(self, index, result, budget_reason, worker):
+        if worker is not None:
+            activate_ledger(None)
+            result["worker"] = worker
+        with self._lock:
+            self.results[index] = result
+            self.status[index] = "passed" if result["success"] else "failed"
+            self.budget_stop = self.budget_stop or budget_reason
+
+    def run_one(self, atc, index, worker=None):
+        """Runs task `index` on `atc`."""
+        task = self.tasks[index]
+        more_tasks, ledger = self._begin(index, worker)
+        budget_reason = None
+        try:
+            atc.set_profile(task.get("profile") or self.profile)
+            atc.set_browsing(task.get("browsing") or self.browsing)
+            atc.shared_cache = self.profile_store
+            result, budget_reason = run_task(atc, task, index, ledger, more_tasks, keep_browser=self.session == "worker",
+                                             wait_mode=self.wait_mode, compiler=self.compiler, lookahead=self.lookahead,
+                                             logins=self.profile_store)
+        except Exception as e:
+            result = self._task_error(index, e)
+        self._end(index, result, budget_reason, worker)
+
+    async def run_one_async(self, pool, index, worker):
+        """Runs task `index` in a new AsyncATC session (context) on the shared browser `pool`."""
+        task = self.tasks[index]
+        more_tasks, ledger = self._begin(index, worker)
+        budget_reason = None
+        try:
+            atc = AsyncATC(pool, profile=task.get("profile") or self.profile,
+                           browsing=task.get("browsing") or self.browsing)
+            result, budget_reason = await run_task_async(atc, task, index, ledger, more_tasks, wait_mode=self.wait_mode,
+                                                         compiler=self.compiler, lookahead=self.lookahead,
+                                                         logins=self.profile_store)
+        except Exception as e:
+            result = self._task_error(index, e)
+        self._end(index, result, budget_reason, worker)
+
+    def run_sequential(self):
+        atc = ATC()
+        try:
+            while True:
+                ready = self.take_ready(1)
+                if not ready:
+                    break
+                self.run_one(atc, ready[0])
+        finally:
+            if atc.playwright:
+                atc.stop_session()
+        return self.results
+
+    def run_parallel(self, workers):
+        """
+        Runs independent tasks on `workers` threads. Each worker owns its ATC (Playwright's sync API is bound
+        to the thread that started it), so tasks never share a browser context.
+        """
+        ready_queue, done_queue = queue.Queue(), queue.Queue()
+
+        def worker_loop(worker):
+            atc = ATC()
+            try:
+                while True:
+                    index = ready_queue.get()
+                    if index is None:
+                        return
+                    try:
+                        self.run_one(atc, index, worker)
+                    finally:
+                        done_queue.put(index)
+            finally:
+                if atc.playwright:
+                    try:
+                        atc.stop_session()
+                    except Exception as e:
+                        print(f"   ⚠️ Session Close Error: {e}")
+
+        threads = [threading.Thread(target=worker_loop, args=(n + 1,), name=f"autopilot-{n + 1}", daemon=True)
+                   for n in range(workers)]
+        for thread in threads:
+            thread.start()
+        running = 0
         try:
-            for i, step in enumerate(task.get("steps", [])):
-                action = step.get("action")
-                print(f"  Step {i+1}: {action}")
-                
-                try:
-                    if action == "goto":
-                        atc.nav(step.get("url"))
-
-                    elif action == "click":
-                        atc.click(
-                            selector=step.get("selector"),
-                            mode=step.get("mode", "hybrid"),
-                            instruction=step.get("instruction")
-                        )
-                        
-                    elif action == "type":
-                        atc.type_text(
-                            selector=step.get("selector"),
-                            text=step.get("text")
-                        )
-                    
-                    elif action == "type_vision":
-                        atc.type_text_vision(
-                            instruction=step.get("instruction"),
-                            text=step.get("text")
-                        )
-                    
-                    elif action == "key":
-                        atc.press_key(step.get("key"))
-                    
-                    elif action == "read":
-                        atc.read_screen(step.get("instruction"))
-                        
-                    elif action == "wait":
-                        time.sleep(step.get("seconds", 1))
-
-                except Exception as e:
-                    print(f"    ❌ Step Failed: {e}")
-                    # Decide whether to break or continue based on config?
-                    # For now, we break the task.
+            while True:
+                for index in self.take_ready(workers - running):
+                    ready_queue.put(index)
+                    running += 1
+                if not running:
                     break
+                done_queue.get()
+                running -= 1
         finally:
-            atc.stop_session()
+            for _ in threads:
+                ready_queue.put(None)
+            for thread in threads:
+                thread.join()
+        return self.results
+
+    async def run_async(self, concurrency):
+        """
+        Runs up to `concurrency` tasks at once on the current event loop. All tasks share one browser
+        (AsyncBrowserPool), each in its own context, so a running task costs a context instead of a thread and a browser.
+        """
+        slots = list(range(concurrency, 0, -1))  # 空いている「ワーカー」番号（レポート用）
+        running = {}
+        async with AsyncBrowserPool() as pool:
+            while True:
+                for index in self.take_ready(len(slots)):
+                    slot = slots.pop()
+                    running[asyncio.ensure_future(self.run_one_async(pool, index, slot))] = slot
+                if not running:
+                    break
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    slots.append(running.pop(future))
+                    future.result()
+        return self.results
+
+def suite_report(results, wall_time, workers, session):
+    """Combined report of a flight plan run (the sum of task times vs. the suite's wall time)."""
+    durations = [r.get("duration", 0.0) for r in results]
+    started = min((r["started"] for r in results if r.get("started")), default=None)
+    task_time = sum(durations)
+    return {
+        "tasks": len(results),
+        "passed": sum(1 for r in results if r["success"]),
+        "failed": sum(1 for r in results if not r["success"] and not r.get("skipped")),
+        "skipped": sum(1 for r in results if r.get("skipped")),
+        "workers": workers,
+        "session": session,
+        "wall_time": round(wall_time, 3),
+        "task_time": round(task_time, 3),
+        "slowest_task": round(max(durations, default=0.0), 3),
+        "speedup": round(task_time / wall_time, 2) if wall_time > 0 else None,
+        "results": [{
+            "name": r["name"],
+            "success": r["success"],
+            "skipped": bool(r.get("skipped")),
+            "start": round(r["started"] - started, 3) if r.get("started") and started else None,
+            "duration": r.get("duration"),
+            "worker": r.get("worker"),
+            "error": r["error"],
+        } for r in results],
+    }
+
+def print_suite_report(report):
+    print(f"\n📋 Suite: {report['passed']}/{report['tasks']} passed in {report['wall_time']:.1f}s "
+          f"(task time {report['task_time']:.1f}s, slowest {report['slowest_task']:.1f}s, "
+          f"{report['workers']} workers, session={report['session']})")
+    for row in report["results"]:
+        icon = "⏭️" if row["skipped"] else ("✅" if row["success"] else "❌")
+        timing = "" if row["skipped"] else f" +{row['start'] or 0:.1f}s {row['duration'] or 0:.1f}s"
+        worker = f" [worker {row['worker']}]" if row["worker"] else ""
+        error = f" - {row['error']}" if row["error"] else ""
+        print(f"   {icon} {row['name']}{timing}{worker}{error}")
+    compiled = report.get("compiled_plan")
+    if compiled:
+        print(f"   🧩 Vision steps: {compiled['selector_hits']} by compiled selector, {compiled['vision']} by Vision "
+              f"({compiled['compiled']} compiled, {compiled['healed']} re-healed)")
+    network = report.get("network")
+    if network:
+        print(f"   🚫 Browsing profile blocked {network['blocked_requests']} requests "
+              f"(~{network['saved_bytes'] / 1_000_000:.1f} MB not downloaded, estimated)")
+    logins = report.get("logins")
+    if logins:
+        print(f"   🔑 Saved logins: {logins['reused']} reused ({logins['skipped_steps']} login steps skipped), "
+              f"{logins['saved']} saved, {logins['expired']} expired")
+    ahead = report.get("lookahead")
+    if ahead:
+        print(f"   ⏩ Look-ahead grounding: {ahead['batches']} requests for {ahead['steps']} steps, {ahead['used']} used, "
+              f"{ahead['discarded']} discarded, {ahead['hidden_seconds']:.1f}s of model time hidden")
+
+def emit_suite(report):
+    """Prints the suite report for run_process_wrapper to store in the flight metadata."""
+    print(SUITE_PREFIX + json.dumps(report, ensure_ascii=False), flush=True)
+
+def parse_suite_line(line):
+    line = line.strip()
+    if not line.startswith(SUITE_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(SUITE_PREFIX):])
+    except ValueError:
+        return None
+
+def run_workflow(yaml_path, workers=None, session=None, profile=None, engine=None, browsing=None):
+    """
+    Runs every task of a flight plan YAML.
+    Returns a list of per-task results (in plan order):
+        {"name", "success", "steps_total", "steps_completed", "error", "started", "duration",
+         "steps": [{"action", "duration", "phases", "usage", "network"?}]}
+    (+ "worker" when run in parallel, "skipped": True for tasks that were never started).
+    Each step's phase timing is also printed as a TIMING line (see metrics.emit_timing), the
+    mission's LLM usage as a USAGE line and the combined suite report as a SUITE line at the end.
+    When the AIRPORT_BUDGET_* budget is exceeded the remaining steps are skipped.
+
+    workers: tasks run concurrently on up to this many workers (argument > plan `workers:` > AIRPORT_AUTOPILOT_WORKERS).
+        A task's optional `depends_on` (task names) makes it wait for those tasks and skips it if one fails.
+    session: "task" (a fresh browser per task) or "worker" (the browser is reused, with a new context per task).
+    profile: ATC.click execution profile, fast / audit / debug (argument > plan `profile:` > AIRPORT_EXECUTION_PROFILE;
+        a task's or click step's own `profile:` wins).
+    engine: "sync" (ATC, one thread and browser per worker) or "async" (see run_workflow_async)
+        (argument > plan `engine:` > AIRPORT_AUTOPILOT_ENGINE).
+    browsing: browsing profile of the task contexts, full / lite / text (argument > plan `browsing:` >
+        AIRPORT_BROWSING_PROFILE; a task's own `browsing:` wins). Blocked requests are reported per step as "network".
+    With the profile store (plan `profile_store:` > AIRPORT_PROFILE_STORE) sessions share an HTTP cache and the login
+    steps of a task are skipped while a saved login of the same site and account is valid (see src.profile_store).
+    Plain `wait: seconds` steps sleep unless the plan's `waits:` (else AIRPORT_AUTOPILOT_WAITS) upgrades them
+    to "at most N seconds" until a condition such as "settle" holds (see execute_step / wait_until).
+    """
+    print(f"✈️ Loading Flight Plan: {yaml_path}")
+    
+    plan = load_plan(yaml_path)
+    engine = engine or plan.get("engine") or AUTOPILOT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown autopilot engine '{engine}' (expected one of {', '.join(ENGINES)})")
+    if engine == "async":
+        return asyncio.run(run_workflow_async(yaml_path, workers, profile, plan=plan, browsing=browsing))
+    session = session or plan.get("session") or AUTOPILOT_SESSION
+    if session not in SESSION_POLICIES:
+        raise ValueError(f"Unknown session policy '{session}' (expected one of {', '.join(SESSION_POLICIES)})")
+    suite, workers = _load_suite(yaml_path, plan, workers, session, profile, browsing)
+    started = time.time()
+    
+    if workers > 1:
+        print(f"🔀 Running {len(suite.tasks)} tasks on {workers} workers (session={session})")
+        stdout = sys.stdout
+        sys.stdout = _LineWriter(stdout)
+        try:
+            results = suite.run_parallel(workers)
+        finally:
+            sys.stdout = stdout
+    else:
+        results = suite.run_sequential()
+    
+    return _finish_suite(suite, results, started, workers, session)
+
+async def run_workflow_async(yaml_path, concurrency=None, profile=None, plan=None, browsing=None):
+    """
+    Runs a flight plan on the async engine: up to `concurrency` tasks at once on the running event loop,
+    sharing one browser with a context per task (argument > plan `workers:` > AIRPORT_AUTOPILOT_WORKERS).
+    Same results, reports and `depends_on` / budget / profile / browsing handling as run_workflow.
+    """
+    if plan is None:
+        print(f"✈️ Loading Flight Plan: {yaml_path}")
+        plan = load_plan(yaml_path)
+    suite, concurrency = _load_suite(yaml_path, plan, concurrency, "async", profile, browsing)
+    started = time.time()
+    print(f"🔀 Running {len(suite.tasks)} tasks on one event loop (concurrency={concurrency}, shared browser)")
+    stdout = sys.stdout
+    sys.stdout = _LineWriter(stdout)  # Vision 呼び出しなどはワーカースレッドから出力される
+    try:
+        results = await suite.run_async(concurrency)
+    finally:
+        sys.stdout = stdout
+    return _finish_suite(suite, results, started, concurrency, "async")
+
+def _load_suite(yaml_path, plan, workers, session, profile, browsing=None):
+    """Validates the plan's tasks and options and opens the mission ledger. Returns (suite, workers)."""
+    tasks = plan.get("tasks", [])
+    deps = task_dependencies(tasks)
+    workers = max(1, min(int(workers or plan.get("workers") or AUTOPILOT_WORKERS), len(tasks) or 1))
+    wait_mode = plan.get("waits") or AUTOPILOT_WAITS
+    if wait_mode != "fixed":
+        wait_conditions(wait_mode)  # 不正な指定は実行前にエラーにする
+    profile = profile or plan.get("profile") or EXECUTION_PROFILE
+    for name in [profile] + [t.get("profile") for t in tasks] + [s.get("profile") for t in tasks for s in t.get("steps", [])]:
+        if name and name not in EXECUTION_PROFILES:
+            raise ValueError(f"Unknown execution profile '{name}' (expected one of {', '.join(EXECUTION_PROFILES)})")
+    browsing = browsing or plan.get("browsing") or BROWSING_PROFILE
+    for name in [browsing] + [t.get("browsing") for t in tasks]:
+        if name and name not in BROWSING_PROFILES:
+            raise ValueError(f"Unknown browsing profile '{name}' (expected one of {', '.join(BROWSING_PROFILES)})")
+    ledger = activate_ledger(UsageLedger(
+        MissionBudget.from_config(),
+        goal=" / ".join(t.get("name") or "" for t in tasks) or os.path.basename(yaml_path),
+    ))
+    has_vision = any(is_vision_step(step) for task in tasks for step in task.get("steps", []))
+    compiler = PlanCompiler(tasks) if PLAN_COMPILER and has_vision else None
+    lookahead = has_vision and bool(plan.get("lookahead", LOOKAHEAD_GROUNDING))
+    profile_store = bool(plan.get("profile_store", PROFILE_STORE_ENABLED))
+    return _Suite(tasks, deps, ledger, session, wait_mode, profile, compiler, lookahead, browsing,
+                  profile_store), workers
+
+def _finish_suite(suite, results, started, workers, session):
+    activate_ledger(None)
+    report = suite_report(results, time.time() - started, workers, session)
+    if suite.compiler:
+        report["compiled_plan"] = suite.compiler.summary()
+    blocked = [row["network"]["blocked"] for r in results for row in r.get("steps", []) if row.get("network")]
+    if blocked:
+        report["network"] = {
+            "blocked_requests": sum(n for b in blocked for n, _ in b.values()),
+            "saved_bytes": sum(saved for b in blocked for _, saved in b.values()),
+        }
+    ahead = [r["lookahead"] for r in results if r.get("lookahead")]
+    if ahead:
+        report["lookahead"] = {name: round(sum(a[name] for a in ahead), 3) for name in ahead[0]}
+    logins = [r["login"] for r in results if r.get("login")]
+    if logins:
+        report["logins"] = {name: sum(l[name] for l in logins) for name in logins[0]}
+    print_suite_report(report)
+    emit_suite(report)
+    emit_usage({**suite.ledger.summary(), "stopped_by_budget": suite.budget_stop})
+    return results
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("plan", help="Path to flight_plan.yaml")
+    parser.add_argument("--workers", type=int, default=None, help="Run independent tasks concurrently")
+    parser.add_argument("--session", choices=SESSION_POLICIES, default=None, help="Browser reuse policy")
+    parser.add_argument("--profile", choices=list(EXECUTION_PROFILES), default=None, help="Click execution profile")
+    parser.add_argument("--engine", choices=ENGINES, default=None, help="sync (thread per worker) or async (one event loop)")
+    parser.add_argument("--browsing", choices=list(BROWSING_PROFILES), default=None,
+                        help="Browsing profile: full, lite (no media/fonts/trackers), text (lite + placeholder images)")
     args = parser.parse_args()
     
-    run_workflow(args.plan)
+    run_workflow(args.plan, workers=args.workers, session=args.session, profile=args.profile, engine=args.engine,
+                 browsing=args.browsing)
@@ -0,0 +1,183 @@
+"""
+Browsing profiles - ATC のコンテキストが読み込むリソースを絞る。
+
+ニュースやショップのページは広告・トラッカー・Web フォント・解析スクリプト・自動再生の動画を読み込むので、
+ページの読み込みと settle が遅くなり、Vision に渡す画面にもノイズが増える。ここではミッション（コンテキスト）ごとに:
+    full   - 何もしない（従来どおり）
+    lite   - 動画・音声・Web フォントと、広告・トラッカーのドメインへのリクエストを止め、アニメーションを CSS で止める
+    text   - lite に加えて画像を 1x1 のプレースホルダーに置き換える（テキストを読むだけのミッション向け）
+止めたリクエストは (理由, リソースの種類) ごとに数え、節約できたバイト数はリソースの種類ごとの典型的なサイズで見積もる
+（中断したリクエストの本当のサイズは分からない）。ATC.network_usage() がステップごとの差分を返し、ステップの timing の
+"network" として METRICS（/api/metrics）に集計される。
+
+Playwright はリクエストのルーティング中は HTTP キャッシュを使わないので、ルートは止めるものがあるプロファイルでだけ登録する。
+"""
+
+import base64
+import threading
+from urllib.parse import urlsplit
+
+from src.config import BROWSING_BLOCK_DOMAINS
+
+BROWSING_PROFILES = {
+    "full": {"block_types": (), "block_domains": False, "placeholder_images": False, "animations": True},
+    "lite": {"block_types": ("media", "font"), "block_domains": True, "placeholder_images": False, "animations": False},
+    "text": {"block_types": ("media", "font"), "block_domains": True, "placeholder_images": True, "animations": False},
+}
+
+# 広告・トラッカー・解析（サブドメインも含む）。AIRPORT_BROWSING_BLOCK_DOMAINS で追加できる
+AD_DOMAINS = (
+    "doubleclick.net", "googlesyndication.com", "googleadservices.com", "googletagmanager.com",
+    "googletagservices.com", "google-analytics.com", "adservice.google.com", "amazon-adsystem.com",
+    "adnxs.com", "criteo.com", "criteo.net", "taboola.com", "outbrain.com", "rubiconproject.com",
+    "pubmatic.com", "openx.net", "casalemedia.com", "scorecardresearch.com", "quantserve.com",
+    "chartbeat.com", "hotjar.com", "clarity.ms", "mixpanel.com", "segment.io", "nr-data.net",
+    "facebook.net", "ads-twitter.com", "bat.bing.com", "yahoo-ads.jp", "i-mobile.co.jp",
+)
+
+# 止めたリクエスト 1 件あたりの見積もりバイト数（リソースの種類ごとの典型的な転送量）
+ESTIMATED_BYTES = {
+    "media": 500_000, "font": 40_000, "image": 25_000, "script": 20_000, "stylesheet": 10_000,
+    "xhr": 2_000, "fetch": 2_000, "websocket": 0,
+}
+DEFAULT_ESTIMATED_BYTES = 5_000
+
+# 画像の代わりに返す 1x1 の灰色の PNG
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGM4AwAAzgDN1GaQsAAAAABJRU5ErkJggg=="
+)
+
+# アニメーション・トランジション・スムーズスクロールを止める（ページのスクリプトより先に実行される）
+DISABLE_ANIMATIONS_JS = """
+(() => {
+    const css = `*, *::before, *::after {
+        animation-duration: 0s !important; animation-delay: 0s !important; animation-iteration-count: 1 !important;
+        transition-duration: 0s !important; transition-delay: 0s !important; scroll-behavior: auto !important;
+    }`;
+    const add = () => {
+        const style = document.createElement('style');
+        style.textContent = css;
+        (document.head || document.documentElement).appendChild(style);
+    };
+    if (document.documentElement) add(); else document.addEventListener('DOMContentLoaded', add);
+})();
+"""
+
+
+def host_matches(host: str, domains) -> bool:
+    """Whether `host` is one of `domains` or a subdomain of one."""
+    host = (host or "").lower()
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+class BrowsingGuard:
+    """The browsing profile of one browser context: request routing, injected CSS and blocked-request counters."""
+
+    def __init__(self, profile: str, extra_domains=None):
+        if profile not in BROWSING_PROFILES:
+            raise ValueError(f"Unknown browsing profile '{profile}' (expected one of {', '.join(BROWSING_PROFILES)})")
+        self.name = profile
+        self.profile = BROWSING_PROFILES[profile]
+        extra = BROWSING_BLOCK_DOMAINS if extra_domains is None else extra_domains
+        self.domains = tuple(AD_DOMAINS) + tuple(d.lower() for d in extra) if self.profile["block_domains"] else ()
+        self._lock = threading.Lock()
+        self._blocked = {}  # "reason:type" -> [requests, estimated bytes]
+        self._taken = {}    # take() で返した分
+
+    @property
+    def routes(self) -> bool:
+        """Whether the profile needs request routing (which also bypasses the HTTP cache)."""
+        return bool(self.profile["block_types"] or self.domains or self.profile["placeholder_images"])
+
+    def context_options(self) -> dict:
+        """Extra browser.new_context options of the profile."""
+        return {} if self.profile["animations"] else {"reduced_motion": "reduce"}
+
+    # ---- installing ----
+    def install(self, context):
+        if not self.profile["animations"]:
+            context.add_init_script(DISABLE_ANIMATIONS_JS)
+        if self.routes:
+            context.route("**/*", self._handle)
+
+    async def install_async(self, context):
+        if not self.profile["animations"]:
+            await context.add_init_script(DISABLE_ANIMATIONS_JS)
+        if self.routes:
+            await context.route("**/*", self._handle_async)
+
+    # ---- routing ----
+    def verdict(self, resource_type: str, url: str):
+        """(action, reason) for a request: action None = load it, "abort" or "placeholder"."""
+        if resource_type == "document":
+            return None, None  # ページ自体（iframe も含む）は止めない
+        if self.domains and host_matches(urlsplit(url).hostname, self.domains):
+            return "abort", "domain"
+        if resource_type in self.profile["block_types"]:
+            return "abort", "type"
+        if resource_type == "image" and self.profile["placeholder_images"]:
+            return "placeholder", "placeholder"
+        return None, None
+
+    def _route(self, route):
+        request = route.request
+        action, reason = self.verdict(request.resource_type, request.url)
+        if action:
+            saved = ESTIMATED_BYTES.get(request.resource_type, DEFAULT_ESTIMATED_BYTES)
+            if action == "placeholder":
+                saved = max(0, saved - len(PLACEHOLDER_PNG))
+            self._count(reason, request.resource_type, saved)
+        return action
+
+    def _handle(self, route):
+        action = self._route(route)
+        try:
+            if action == "placeholder":
+                route.fulfill(status=200, content_type="image/png", body=PLACEHOLDER_PNG)
+            elif action == "abort":
+                route.abort("blockedbyclient")
+            else:
+                route.continue_()
+        except Exception:
+            pass  # ページが閉じられた後のリクエストなど
+
+    async def _handle_async(self, route):
+        action = self._route(route)
+        try:
+            if action == "placeholder":
+                await route.fulfill(status=200, content_type="image/png", body=PLACEHOLDER_PNG)
+            elif action == "abort":
+                await route.abort("blockedbyclient")
+            else:
+                await route.continue_()
+        except Exception:
+            pass
+
+    # ---- counters ----
+    def _count(self, reason: str, resource_type: str, saved: int):
+        with self._lock:
+            row = self._blocked.setdefault(f"{reason}:{resource_type}", [0, 0])
+            row[0] += 1
+            row[1] += saved
+
+    def take(self):
+        """
+        Requests blocked since the last call, for a step timing:
+        {"profile", "blocked": {"reason:type": [requests, estimated bytes]}}; None when nothing was blocked.
+        """
+        with self._lock:
+            delta = {}
+            for key, (requests, saved) in self._blocked.items():
+                taken = self._taken.get(key, (0, 0))
+                if requests > taken[0]:
+                    delta[key] = [requests - taken[0], saved - taken[1]]
+            self._taken = {key: tuple(row) for key, row in self._blocked.items()}
+        return {"profile": self.name, "blocked": delta} if delta else None
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "profile": self.name,
+                "requests": sum(row[0] for row in self._blocked.values()),
+                "saved_bytes": sum(row[1] for row in self._blocked.values()),
+            }
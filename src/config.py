@@ -15,4 +15,105 @@ DESKTOP_SCREENSHOTS_DIR = RESULTS_DIR / "desktop_screenshots"
 # UI / recording defaults
 VIEWPORT_SIZE = {"width": 1280, "height": 720}
 DISPLAY = os.getenv("DISPLAY", ":99")
+HEADLESS = os.getenv("AIRPORT_HEADLESS", "0") == "1"
 
+# Default Gemini model for all LLM calls
+GEMINI_MODEL = os.getenv("AIRPORT_GEMINI_MODEL", "gemini-3-flash-preview")
+
+# Alternative Gemini API endpoint (e.g. scripts/mock_gemini_server.py at http://127.0.0.1:8089)
+GEMINI_API_ENDPOINT = os.getenv("AIRPORT_GEMINI_ENDPOINT")
+
+# LLM structured output (Gemini constrained JSON). Set to 0 to fall back to prompt-only JSON.
+STRUCTURED_OUTPUT = os.getenv("AIRPORT_STRUCTURED_OUTPUT", "1") != "0"
+
+# ReAct streaming mode: dispatch the action as soon as action/params have been received
+REACT_STREAMING = os.getenv("AIRPORT_REACT_STREAMING", "0") == "1"
+
+# Per-mission LLM budgets (0 = unlimited). Missions over budget end with status BUDGET_EXCEEDED.
+BUDGET_MAX_TOKENS = int(os.getenv("AIRPORT_BUDGET_MAX_TOKENS", "0"))
+BUDGET_MAX_COST = float(os.getenv("AIRPORT_BUDGET_MAX_COST", "0"))  # USD (estimated)
+BUDGET_MAX_CALLS = int(os.getenv("AIRPORT_BUDGET_MAX_CALLS", "0"))
+
+# Sampling profiler rate (Hz) used when a flight is started with profiling enabled
+PROFILER_HZ = int(os.getenv("AIRPORT_PROFILER_HZ", "100"))
+
+# Compiled missions (opt-in): successful ReAct trajectories are compiled into replayable plans for identical goals
+COMPILED_MISSIONS = os.getenv("AIRPORT_COMPILED_MISSIONS", "0") == "1"
+COMPILED_MISSIONS_DIR = RESULTS_DIR / "compiled_missions"
+# Max dHash distance (of 64 bits) for a screen to still match a recorded checkpoint
+CHECKPOINT_DHASH_THRESHOLD = int(os.getenv("AIRPORT_CHECKPOINT_DHASH_THRESHOLD", "12"))
+# Compiled plans: vision steps of flight plans (click mode: llm / type_vision) get self-healing selectors of the
+# element they hit, so repeated plans stop calling Vision
+PLAN_COMPILER = os.getenv("AIRPORT_PLAN_COMPILER", "1") != "0"
+COMPILED_PLANS_DIR = RESULTS_DIR / "compiled_plans"
+# Look-ahead grounding of flight plan vision steps: one batched request per screen, started during fixed waits as soon
+# as the page is quiet, used only if the frame is unchanged (a plan's `lookahead:` overrides)
+LOOKAHEAD_GROUNDING = os.getenv("AIRPORT_LOOKAHEAD_GROUNDING", "1") != "0"
+
+# Past-flight retrieval: the ReAct prompt gets the top-k successful trajectories of similar goals
+FLIGHT_INDEX_DIR = RESULTS_DIR / "flight_index"
+FLIGHT_HINTS = os.getenv("AIRPORT_FLIGHT_HINTS", "1") != "0"
+FLIGHT_HINTS_K = int(os.getenv("AIRPORT_FLIGHT_HINTS_K", "3"))
+
+# Per-site navigation knowledge (search URL templates, element locators, settle times)
+SITE_KNOWLEDGE_ENABLED = os.getenv("AIRPORT_SITE_KNOWLEDGE", "1") != "0"
+SITE_KNOWLEDGE_DIR = RESULTS_DIR / "site_knowledge"
+
+# Loop / stagnation detection for ReAct (hint → re-ground clicks → ask_user → stop with status "stuck")
+LOOP_DETECTOR = os.getenv("AIRPORT_LOOP_DETECTOR", "1") != "0"
+
+# Tiered ReAct memory: the last N steps stay verbatim, older steps are folded into a summary + key facts
+# and their full records are spilled to disk (the flight's black box when run from the server)
+MEMORY_RECENT_STEPS = int(os.getenv("AIRPORT_MEMORY_RECENT_STEPS", "7"))
+MEMORY_MAX_FACTS = int(os.getenv("AIRPORT_MEMORY_MAX_FACTS", "20"))
+REACT_HISTORY_DIR = RESULTS_DIR / "react_history"
+# Bounds for server-side state: ReAct steps kept for the UI / chat turns kept by the Attendant
+REACT_STEPS_LIMIT = int(os.getenv("AIRPORT_REACT_STEPS_LIMIT", "100"))
+CHAT_HISTORY_TURNS = int(os.getenv("AIRPORT_CHAT_HISTORY_TURNS", "10"))
+
+# Model tiering: cheapest → strongest. The router picks a tier per call (ReAct think / grounding / read)
+# and escalates on low confidence or repeated misses, de-escalating again after successes
+MODEL_ROUTER = os.getenv("AIRPORT_MODEL_ROUTER", "0") == "1"
+MODEL_TIERS = [m.strip() for m in os.getenv(
+    "AIRPORT_MODEL_TIERS", f"gemini-2.5-flash-lite,{GEMINI_MODEL},gemini-3-pro-preview").split(",") if m.strip()]
+ROUTER_LOW_CONFIDENCE = float(os.getenv("AIRPORT_ROUTER_LOW_CONFIDENCE", "0.6"))
+
+# Hedged LLM requests: when a call is slower than the pXX of recent latencies, a duplicate is sent and the
+# first valid answer wins. Client-side rate limits (requests/minute, 0 = unlimited) also bound the hedges
+LLM_HEDGING = os.getenv("AIRPORT_LLM_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("AIRPORT_HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_DELAY = float(os.getenv("AIRPORT_HEDGE_MIN_DELAY", "2.0"))  # seconds; never hedge earlier than this
+LLM_MAX_RPM = int(os.getenv("AIRPORT_LLM_MAX_RPM", "0"))
+MISSION_MAX_RPM = int(os.getenv("AIRPORT_MISSION_MAX_RPM", "0"))
+
+# Speculative think: start the next ReAct think as soon as the page is quiet, used only if the frame is unchanged
+REACT_SPECULATIVE = os.getenv("AIRPORT_REACT_SPECULATIVE", "0") == "1"
+
+# Autopilot suites: independent tasks of a flight plan run concurrently (each worker has its own browser);
+# session policy "task" = a fresh browser per task, "worker" = the worker's browser is reused with a new context per task
+AUTOPILOT_WORKERS = int(os.getenv("AIRPORT_AUTOPILOT_WORKERS", "1"))
+AUTOPILOT_SESSION = os.getenv("AIRPORT_AUTOPILOT_SESSION", "task")
+# Plain `wait: seconds` plan steps: "fixed" sleeps, a shorthand (settle / stable / networkidle / load) waits at most N seconds
+AUTOPILOT_WAITS = os.getenv("AIRPORT_AUTOPILOT_WAITS", "fixed")
+
+# ATC.click execution profile: fast (no screenshots unless grounding needs them, no mouse animation, DOM-quiet settle),
+# audit (pre/post screenshots kept as artifacts, DOM-quiet settle), debug (also animates the mouse, fixed 1s settle)
+EXECUTION_PROFILE = os.getenv("AIRPORT_EXECUTION_PROFILE", "audit")
+
+# Visual click check (hybrid / gui clicks): element templates cached per (site, selector), LRU
+TEMPLATE_CACHE_SIZE = int(os.getenv("AIRPORT_TEMPLATE_CACHE_SIZE", "256"))
+
+# Autopilot engine: "sync" (ATC, a thread + browser per worker) or "async" (AsyncATC, one event loop and one shared
+# browser driving AIRPORT_AUTOPILOT_WORKERS tasks at once, each in its own context)
+AUTOPILOT_ENGINE = os.getenv("AIRPORT_AUTOPILOT_ENGINE", "sync")
+
+# Browsing profile of ATC contexts: "full" (load everything), "lite" (block media / web fonts / ad and tracker domains,
+# no animations) or "text" (lite + images replaced by placeholders). Plans, tasks and API requests can override it
+BROWSING_PROFILE = os.getenv("AIRPORT_BROWSING_PROFILE", "full")
+BROWSING_BLOCK_DOMAINS = [d.strip() for d in os.getenv("AIRPORT_BROWSING_BLOCK_DOMAINS", "").split(",") if d.strip()]
+
+# Persistent profile store (opt-in): sync ATC sessions share one HTTP disk cache, and autopilot tasks reuse saved logins
+# (per-site storage_state snapshots keyed by account). Kept outside RESULTS_DIR so secrets never reach flight logs
+PROFILE_STORE_ENABLED = os.getenv("AIRPORT_PROFILE_STORE", "0") == "1"
+PROFILE_STORE_DIR = Path(os.getenv("AIRPORT_PROFILE_STORE_DIR", str(WORKSPACE_ROOT / "profile_store")))
+AUTH_STATE_TTL_HOURS = float(os.getenv("AIRPORT_AUTH_STATE_TTL_HOURS", "12"))  # cookies may expire earlier
@@ -3,10 +3,27 @@ import time
 import os
 import subprocess
 from dotenv import load_dotenv
-from src.llm_core import VisionCore
+from src.config import CHECKPOINT_DHASH_THRESHOLD
+from src.llm_core import MAX_BATCH_TARGETS, VisionCore
+from src.mission_compiler import dhash, hamming
+from src.profile_store import masked
 
 load_dotenv()
 
+# run_steps でまとめてグラウンディングするアクション
+VISION_ACTIONS = ("click_vision", "type_vision")
+
+
+def vision_group(steps, start):
+    """Indices of the consecutive vision steps from `start` (grounded together on one screenshot)."""
+    group = []
+    for index in range(start, min(len(steps), start + MAX_BATCH_TARGETS)):
+        if steps[index].get("action") not in VISION_ACTIONS:
+            break
+        group.append(index)
+    return group
+
+
 class DesktopATC:
     def __init__(self):
         pyautogui.FAILSAFE = False
@@ -39,15 +56,21 @@ class DesktopATC:
             
         return path
 
-    def click_vision(self, instruction):
-        """Finds an element using Vision and clicks it."""
+    def click_vision(self, instruction, grounded=None):
+        """
+        Finds an element using Vision and clicks it.
+        grounded: (x, y, confidence) already found on the current screen (see ground_batch); skips the Vision call.
+        """
         print(f"👁️ Vision Click: '{instruction}'")
         
-        # 1. Capture Screen
-        img_path = self.capture_screen("pre")
-        
-        # 2. Analyze
-        x, y, conf = self.vision.analyze_image(img_path, instruction)
+        if grounded:
+            x, y, conf = grounded
+        else:
+            # 1. Capture Screen
+            img_path = self.capture_screen("pre")
+            
+            # 2. Analyze
+            x, y, conf = self.vision.analyze_image(img_path, instruction)
         
         if x is None:
             print("❌ Vision failed to find target.")
@@ -65,11 +88,11 @@ class DesktopATC:
         self.capture_screen("post")
         return True
 
-    def type_vision(self, instruction, text):
+    def type_vision(self, instruction, text, grounded=None):
         """Clicks a field and types text."""
-        print(f"👁️⌨️ Vision Type: '{text}' -> Target: '{instruction}'")
+        print(f"👁️⌨️ Vision Type: '{masked(instruction, text)}' -> Target: '{instruction}'")
         
-        if self.click_vision(instruction):
+        if self.click_vision(instruction, grounded):
             time.sleep(0.5)
             # Clear field? Ctrl+A -> Backspace is standard, but app dependent.
             # For now, just type.
@@ -77,6 +100,68 @@ class DesktopATC:
             return True
         return False
 
+    def ground_batch(self, instructions):
+        """
+        Finds several targets on one screenshot with a single Vision request.
+        Returns (screenshot path, [(x, y, confidence), ...]); (None, None, 0.0) for targets that were not found.
+        """
+        img_path = self.capture_screen("batch")
+        results = self.vision.analyze_image_batch(img_path, instructions)
+        found = sum(1 for r in results if r[0] is not None)
+        print(f"👁️ Batch Grounding: {found}/{len(instructions)} targets found")
+        return img_path, results
+
+    def run_steps(self, steps):
+        """
+        Runs desktop steps in order: {"action": "click_vision" | "type_vision", "instruction", "text"},
+        {"action": "key", "key"}, {"action": "hotkey", "keys"}, {"action": "launch_app", "command"}, {"action": "wait", "seconds"}.
+        Consecutive vision steps are grounded together (one screenshot, one request). A batched result is used only
+        while the screen still matches the frame it was found on (dHash); otherwise the remaining targets are
+        grounded again on the current screen. Targets the batch did not find fall back to a single Vision call.
+        Returns one result per step (True / False for vision steps, None otherwise).
+        """
+        results = []
+        pending, checkpoint = {}, None
+        for index, step in enumerate(steps):
+            action = step.get("action")
+            if action in VISION_ACTIONS:
+                grounded = None
+                if index in pending:
+                    # 同じ画面のまま（電卓の表示が変わった程度）なら、まとめて見つけた座標を使う
+                    distance = hamming(checkpoint, dhash(self.capture_screen("check")))
+                    if distance <= CHECKPOINT_DHASH_THRESHOLD:
+                        grounded = pending.pop(index)
+                    else:
+                        print(f"    ↳ Screen changed ({distance} bits), grounding the remaining targets again")
+                        pending = {}
+                if grounded is None:
+                    group = vision_group(steps, index)
+                    if len(group) > 1:
+                        img_path, batch = self.ground_batch([steps[i].get("instruction") for i in group])
+                        checkpoint = dhash(img_path)
+                        pending = dict(zip(group, batch))
+                        grounded = pending.pop(index)
+                if grounded and grounded[0] is None:
+                    grounded = None  # この要素だけ見つからなかった: 単独で探し直す
+                if action == "click_vision":
+                    results.append(self.click_vision(step.get("instruction"), grounded))
+                else:
+                    results.append(self.type_vision(step.get("instruction"), step.get("text", ""), grounded))
+                continue
+            pending = {}  # キー操作・アプリ起動・待機の後は画面が変わっているかもしれない
+            if action == "key":
+                self.press_key(step.get("key"))
+            elif action == "hotkey":
+                self.press_hotkey(*step.get("keys", []))
+            elif action == "launch_app":
+                self.launch_app(step.get("command"))
+            elif action == "wait":
+                time.sleep(step.get("seconds", 1))
+            else:
+                print(f"⚠️ Unknown desktop action: {action}")
+            results.append(None)
+        return results
+
     def press_key(self, key):
         print(f"🎹 Pressing Key: {key}")
         pyautogui.press(key)
@@ -92,11 +177,13 @@ def run_desktop_demo():
     print("\n=== 1. Calculator Demo ===")
     atc.launch_app("galculator &")
     
-    # 1 + 2 = 
-    atc.click_vision("Click the button labeled '1'")
-    atc.click_vision("Click the plus sign '+' button")
-    atc.click_vision("Click the button labeled '2'")
-    atc.click_vision("Click the equals '=' button")
+    # 1 + 2 = （同じ画面のボタンは 1 枚のスクリーンショット・1 回のリクエストでまとめて探す）
+    atc.run_steps([
+        {"action": "click_vision", "instruction": "Click the button labeled '1'"},
+        {"action": "click_vision", "instruction": "Click the plus sign '+' button"},
+        {"action": "click_vision", "instruction": "Click the button labeled '2'"},
+        {"action": "click_vision", "instruction": "Click the equals '=' button"},
+    ])
     
     time.sleep(2)
     
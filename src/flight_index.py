@@ -0,0 +1,282 @@
+"""
+Flight Index - local vector index over past ReAct flights, used as few-shot hints in the prompt.
+
+完了したフライトごとに「ゴール文の埋め込み・ゴール・サイト・うまくいった行動の列・結果」を保存し、
+新しいゴールに近い成功フライトを numpy の内積で検索する。
+
+- 埋め込みはモデルを呼ばない特徴ハッシュ（文字 n-gram + 単語 → 128 次元、L2 正規化）。
+  追加のAPI呼び出し・依存なしで、表記ゆれの少ない「同じ種類のミッション」をよく拾える
+- 保存: results/flight_index/vectors.f32（float32 の追記専用行列）と entries.jsonl（1行1フライト）
+- メモリ上の行列は「ゴール（正規化後）ごとに 1 行」。同じゴールのフライトは 1 行にまとめ、最新の成功を返す
+- 10万フライト（全て別ゴール）でも行列は約50MBで、検索は 1 回の行列ベクトル積 + argpartition（数ミリ秒）
+- ReActAgent はミッション開始時に 1 回だけ検索し、上位 k 件の手順を _think のプロンプトに添える
+
+フライトの内容は Black Box (REACT / TIMING イベント) から組み立てるので、
+`python -m src.flight_index rebuild` で既存のフライトからも索引を作り直せる。
+"""
+
+import json
+import os
+import sys
+import threading
+import unicodedata
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+from src.config import FLIGHT_INDEX_DIR
+from src.metrics import site_of
+
+EMBEDDING_DIM = 128
+NGRAM = 3
+MIN_SCORE = 0.35      # これ未満の類似度のフライトはヒントにしない
+MAX_TRACE_STEPS = 12  # ヒント 1 件あたりの最大ステップ数
+
+VECTORS_FILE = "vectors.f32"
+ENTRIES_FILE = "entries.jsonl"
+
+
+def normalize_goal(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text or "").lower().split())
+
+
+def _features(text: str):
+    text = normalize_goal(text)
+    for word in text.split():
+        yield "w:" + word
+    padded = f" {text} "
+    for i in range(len(padded) - NGRAM + 1):
+        yield padded[i:i + NGRAM]
+
+
+def embed(text: str) -> np.ndarray:
+    """Hashed n-gram embedding (unit length, float32)."""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature in _features(text):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % EMBEDDING_DIM] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _short(value, limit: int = 60) -> str:
+    text = " ".join(str(value).split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def compact_step(action: str, params: dict) -> str:
+    """One-line description of a ReAct step for the hint trace."""
+    params = params or {}
+    if action == "goto":
+        return f"goto {_short(params.get('url', ''), 80)}"
+    if action == "click":
+        return f"click '{_short(params.get('description') or (params.get('x'), params.get('y')))}'"
+    if action == "type":
+        return f"type \"{_short(params.get('text', ''))}\"" + (" ⏎" if params.get("submit") else "")
+    if action == "key":
+        return f"key {params.get('key', '')}"
+    if action == "scroll":
+        return f"scroll {params.get('direction', 'down')}"
+    if action == "read":
+        return f"read '{_short(params.get('target', ''))}'"
+    if action == "save_file":
+        return f"save_file {params.get('filename', '')}"
+    if action == "run_terminal":
+        return f"run_terminal `{_short(params.get('command', ''))}`"
+    if action == "done":
+        return "done"
+    return action
+
+
+class FlightIndex:
+    """Append-only on-disk index, loaded lazily and kept in memory (one matrix row per distinct goal)."""
+
+    def __init__(self, directory: str = None):
+        self.directory = str(directory or FLIGHT_INDEX_DIR)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)  # 容量は倍々で確保
+        self._success = np.zeros(0, dtype=bool)  # 行（ゴール）に成功フライトがあるか
+        self._rows = 0
+        self._goal_rows = {}   # 正規化したゴール -> 行
+        self._row_best = []    # 行 -> ヒントに使うエントリ（最新の成功、無ければ最新）
+        self._entries = 0
+        self._flight_ids = set()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        entries = []
+        if os.path.exists(self._path(ENTRIES_FILE)):
+            with open(self._path(ENTRIES_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        pass
+        vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        if os.path.exists(self._path(VECTORS_FILE)):
+            vectors = np.fromfile(self._path(VECTORS_FILE), dtype=np.float32)
+            vectors = vectors[:len(vectors) // EMBEDDING_DIM * EMBEDDING_DIM].reshape(-1, EMBEDDING_DIM)
+        # 書き込み途中で落ちた場合などに備え、両方揃っている分だけ使う
+        for entry, vector in zip(entries, vectors):
+            self._insert(entry, vector)
+
+    def _grow(self, needed: int):
+        capacity = len(self._vectors)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        vectors = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+        vectors[:self._rows] = self._vectors[:self._rows]
+        success = np.zeros(capacity, dtype=bool)
+        success[:self._rows] = self._success[:self._rows]
+        self._vectors, self._success = vectors, success
+
+    def _insert(self, entry: dict, vector: np.ndarray):
+        goal = normalize_goal(entry.get("goal"))
+        row = self._goal_rows.get(goal)
+        if row is None:
+            row = self._goal_rows[goal] = self._rows
+            self._grow(row + 1)
+            self._vectors[row] = vector
+            self._row_best.append(entry)
+            self._rows += 1
+        elif entry.get("success") or not self._success[row]:
+            self._row_best[row] = entry
+        self._success[row] |= bool(entry.get("success"))
+        self._entries += 1
+        self._flight_ids.add(entry.get("flight_id"))
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return self._entries
+
+    def contains(self, flight_id: str) -> bool:
+        with self._lock:
+            self._load()
+            return flight_id in self._flight_ids
+
+    def add(self, entry: dict) -> bool:
+        """
+        Adds one flight: {"flight_id", "goal", "sites", "success", "steps", "trace"} (see flight_entry).
+        Returns False when the flight is already indexed.
+        """
+        vector = embed(entry["goal"])
+        with self._lock:
+            self._load()
+            if entry.get("flight_id") in self._flight_ids:
+                return False
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.write(vector.tobytes())
+            with open(self._path(ENTRIES_FILE), "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._insert(entry, vector)
+        return True
+
+    def search(self, goal: str, k: int = 3, successful_only: bool = True, min_score: float = MIN_SCORE) -> list:
+        """Top-k distinct goals by similarity, each with its latest flight: [{"score", **entry}], best first."""
+        query = embed(goal)
+        with self._lock:
+            self._load()
+            if not self._rows or k <= 0:
+                return []
+            scores = self._vectors[:self._rows] @ query
+            if successful_only:
+                scores[~self._success[:self._rows]] = -1.0
+            k = min(k, self._rows)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [{"score": round(float(scores[i]), 3), **self._row_best[i]}
+                    for i in top if scores[i] >= min_score]
+
+
+# サーバー・エージェントで共有（索引の読み込みはプロセスで 1 回）
+FLIGHT_INDEX = FlightIndex()
+
+
+def flight_entry(history_mgr, flight_id: str):
+    """Builds an index entry from a ReAct flight's metadata and black box, or None."""
+    metadata = history_mgr._load_json(flight_id, "metadata.json") or {}
+    goal = metadata.get("mission")
+    if not goal or goal == "Unknown" or metadata.get("status") in (None, "IN_PROGRESS"):
+        return None
+
+    trace, sites = [], []
+    steps = 0
+    for event in history_mgr.get_flight_data(flight_id):
+        if event.get("type") not in ("REACT", "TIMING"):
+            continue
+        try:
+            details = json.loads(event["details"])
+        except (TypeError, ValueError):
+            continue
+        if event["type"] == "TIMING":
+            site = details.get("site")
+            if site and site not in ("unknown", "desktop") and site not in sites:
+                sites.append(site)
+            continue
+        steps += 1
+        action = details.get("action")
+        if action in (None, "", "wait", "ask_user"):
+            continue
+        step = compact_step(action, details.get("params"))
+        if not trace or trace[-1] != step:
+            trace.append(step)
+        if action == "goto":
+            site = site_of(details.get("params", {}).get("url"))
+            if site != "unknown" and site not in sites:
+                sites.append(site)
+    if not trace:
+        return None  # ReAct 以外のフライト
+
+    if len(trace) > MAX_TRACE_STEPS:
+        trace = trace[:MAX_TRACE_STEPS - 2] + ["…"] + trace[-1:]
+    return {
+        "flight_id": flight_id,
+        "goal": goal,
+        "sites": sites,
+        "success": metadata.get("status") == "COMPLETED",
+        "steps": steps,
+        "trace": trace,
+        "indexed_at": datetime.now().isoformat(),
+    }
+
+
+def index_flight(history_mgr, flight_id: str, index: FlightIndex = None) -> bool:
+    entry = flight_entry(history_mgr, flight_id)
+    if entry is None:
+        return False
+    return (index if index is not None else FLIGHT_INDEX).add(entry)
+
+
+def format_hints(matches: list) -> str:
+    """Prompt section text for the retrieved flights."""
+    lines = []
+    for match in matches:
+        sites = f", {', '.join(match['sites'])}" if match.get("sites") else ""
+        lines.append(f"- 「{match['goal']}」({match['steps']} steps{sites}): " + " → ".join(match["trace"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m src.flight_index rebuild   … 既存フライトの Black Box から索引を作る
+    # python -m src.flight_index search "ゴール"
+    from src.history_manager import HistoryManager
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command == "rebuild":
+        history = HistoryManager()
+        added = sum(index_flight(history, meta["flight_id"]) for meta in history.get_all_flights())
+        print(f"🗂️ Indexed {added} new flights ({len(FLIGHT_INDEX)} total) → {FLIGHT_INDEX.directory}")
+    elif command == "search":
+        for match in FLIGHT_INDEX.search(" ".join(sys.argv[2:]), k=5):
+            print(f"{match['score']:.3f}  {match['flight_id']}  {match['goal']}")
+            print(f"       {' → '.join(match['trace'])}")
@@ -11,9 +11,17 @@ class HistoryManager:
 
     def start_flight(self):
         """新しいフライトID（タイムスタンプベース）を生成し、ディレクトリを作成"""
-        flight_id = datetime.now().strftime("flight_%Y%m%d_%H%M%S")
-        flight_dir = os.path.join(self.base_dir, flight_id)
-        os.makedirs(flight_dir, exist_ok=True)
+        base_id = datetime.now().strftime("flight_%Y%m%d_%H%M%S")
+        flight_id = base_id
+        suffix = 1
+        # 同じ秒に複数のフライトが始まっても衝突しないように連番を付ける
+        while True:
+            try:
+                os.makedirs(os.path.join(self.base_dir, flight_id))
+                break
+            except FileExistsError:
+                suffix += 1
+                flight_id = f"{base_id}_{suffix}"
         
         # 初期メタデータ
         metadata = {
@@ -51,6 +59,33 @@ class HistoryManager:
             metadata["status"] = status
             self._save_json(flight_id, "metadata.json", metadata)
 
+    def update_metadata(self, flight_id, **fields):
+        """メタデータにフィールドを追加・更新（ミッション名・使用量など）"""
+        if not flight_id:
+            return
+        metadata = self._load_json(flight_id, "metadata.json")
+        if metadata is not None:
+            metadata.update(fields)
+            self._save_json(flight_id, "metadata.json", metadata)
+
+    def usage_by_goal(self):
+        """フライトの使用量 (metadata["usage"]) をミッション（ゴール）ごとに集計"""
+        goals = {}
+        for meta in self.get_all_flights():
+            usage = (meta.get("usage") or {}).get("totals")
+            if not usage:
+                continue
+            goal = meta.get("mission") or "Unknown"
+            entry = goals.setdefault(goal, {"flights": 0, "budget_exceeded": 0})
+            entry["flights"] += 1
+            entry["budget_exceeded"] += int(meta.get("status") == "BUDGET_EXCEEDED")
+            for key, value in usage.items():
+                entry[key] = entry.get(key, 0) + value
+        for entry in goals.values():
+            entry["cost"] = round(entry.get("cost", 0.0), 6)
+            entry["cost_per_flight"] = round(entry["cost"] / entry["flights"], 6)
+        return goals
+
     def get_all_flights(self):
         """全フライトのリストを取得"""
         flights = []
@@ -78,6 +113,10 @@ class HistoryManager:
                         pass
         return logs
 
+    def flight_path(self, flight_id, filename):
+        """フライトディレクトリ内のファイルパス（テープ・プロファイルなどの成果物用）"""
+        return os.path.join(self.base_dir, flight_id, filename)
+
     def _save_json(self, flight_id, filename, data):
         path = os.path.join(self.base_dir, flight_id, filename)
         with open(path, "w", encoding="utf-8") as f:
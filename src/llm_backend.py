@@ -0,0 +1,615 @@
+"""
+LLM Backend - pluggable model access for VisionCore / Attendant / ReActAgent.
+
+- GeminiBackend:    google.generativeai (本番)
+- RecordingBackend: 別のバックエンドをラップし、リクエスト/レスポンスをフライトのテープに記録
+- ReplayBackend:    テープから (prompt, image-hash) をキーにレスポンスを再生（API キー・ネットワーク不要）
+- HedgedBackend:    遅い呼び出しに重複リクエストを送り、先に返った有効な応答を使う（AIRPORT_LLM_HEDGING=1）
+
+Gemini への呼び出しはプロセス全体 (AIRPORT_LLM_MAX_RPM) とミッションごと (AIRPORT_MISSION_MAX_RPM) の
+毎分リクエスト数の上限を守る（重複リクエストも含む）。
+
+バックエンドは環境変数で選択できる:
+    AIRPORT_LLM_BACKEND=gemini|record|replay
+    AIRPORT_LLM_TAPE=/path/to/llm_tape.jsonl
+    AIRPORT_LLM_REPLAY_LATENCY=0 | 0.5 | recorded
+"""
+
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+
+from src.accounting import activate_ledger, current_ledger, record_usage
+from src.config import (
+    GEMINI_API_ENDPOINT, GEMINI_MODEL, HEDGE_MIN_DELAY, HEDGE_PERCENTILE, LLM_HEDGING, LLM_MAX_RPM, MISSION_MAX_RPM,
+)
+from src.metrics import phase
+
+
+class LLMResponse:
+    """Backend-independent model response."""
+
+    def __init__(self, text: str, usage: dict = None, model: str = None, latency: float = 0.0):
+        self.text = text
+        self.usage = usage or {}
+        self.model = model
+        self.latency = latency
+
+
+class ReplayMissError(KeyError):
+    """Raised by a strict ReplayBackend when no recorded response matches a request."""
+
+
+# ---- request fingerprinting ----
+def _as_list(contents):
+    return contents if isinstance(contents, (list, tuple)) else [contents]
+
+
+def image_hash(image) -> str:
+    """Content hash of a PIL image (pixels + size + mode), independent of the file name."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def image_bytes(image) -> int:
+    """Approximate upload size of an image part (file size when opened from disk)."""
+    path = getattr(image, "filename", None)
+    if path and os.path.exists(path):
+        return os.path.getsize(path)
+    return len(image.tobytes())
+
+
+_IMAGE_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def encode_image(image) -> dict:
+    """
+    PIL image -> inline blob part. Screenshots opened from disk are sent as their
+    file bytes (no decode / re-encode); other images are encoded to PNG.
+    """
+    path = getattr(image, "filename", None)
+    mime_type = _IMAGE_MIME_TYPES.get(image.format or "")
+    if path and mime_type and os.path.exists(path):
+        with open(path, "rb") as f:
+            return {"mime_type": mime_type, "data": f.read()}
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return {"mime_type": "image/png", "data": buffer.getvalue()}
+
+
+def encode_contents(contents) -> list:
+    return [encode_image(part) if hasattr(part, "tobytes") else part for part in _as_list(contents)]
+
+
+def request_fingerprint(contents) -> dict:
+    """Splits contents into prompt text and image hashes and derives the replay key."""
+    texts, images = [], []
+    for part in _as_list(contents):
+        if isinstance(part, str):
+            texts.append(part)
+        elif hasattr(part, "tobytes"):
+            images.append(image_hash(part))
+        else:
+            texts.append(str(part))
+    prompt = "\n".join(texts)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    return {
+        "key": f"{prompt_hash}:{','.join(images)}",
+        "prompt_hash": prompt_hash,
+        "image_hashes": images,
+        "prompt": prompt,
+    }
+
+
+# ---- call statistics (process-wide, all backends) ----
+class CallStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zero()
+
+    def _zero(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_uploaded = 0
+        self.latency_total = 0.0
+
+    def reset(self):
+        with self._lock:
+            self._zero()
+
+    def record(self, contents, latency: float, error: bool = False):
+        uploaded = 0
+        for part in _as_list(contents):
+            if isinstance(part, str):
+                uploaded += len(part.encode("utf-8"))
+            elif hasattr(part, "tobytes"):
+                uploaded += image_bytes(part)
+        with self._lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.bytes_uploaded += uploaded
+            self.latency_total += latency
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "bytes_uploaded": self.bytes_uploaded,
+                "latency_total": round(self.latency_total, 3),
+            }
+
+
+LLM_CALL_STATS = CallStats()
+
+
+# ---- client-side rate limits ----
+class RateLimiter:
+    """Requests per minute over a sliding 60 s window (0 = unlimited)."""
+
+    def __init__(self, rpm: int):
+        self.rpm = rpm
+        self._times = deque()
+
+    def wait_time(self, now: float) -> float:
+        if not self.rpm:
+            return 0.0
+        while self._times and now - self._times[0] >= 60:
+            self._times.popleft()
+        return 0.0 if len(self._times) < self.rpm else 60 - (now - self._times[0])
+
+    def take(self, now: float):
+        if self.rpm:
+            self._times.append(now)
+
+
+GLOBAL_RATE_LIMITER = RateLimiter(LLM_MAX_RPM)
+_MISSION_LIMITERS = weakref.WeakKeyDictionary()  # UsageLedger -> RateLimiter
+_RATE_LOCK = threading.Lock()
+
+
+def _limiters(ledger) -> list:
+    limiters = [GLOBAL_RATE_LIMITER]
+    while getattr(ledger, "parent", None) is not None:
+        ledger = ledger.parent  # 並列タスクの子 Ledger はミッションの上限を共有する
+    if ledger is not None and MISSION_MAX_RPM:
+        limiters.append(_MISSION_LIMITERS.setdefault(ledger, RateLimiter(MISSION_MAX_RPM)))
+    return limiters
+
+
+def call_slot_available(ledger=None) -> bool:
+    """Whether a call could start now without exceeding the global / mission rate limits."""
+    with _RATE_LOCK:
+        now = time.time()
+        return all(limiter.wait_time(now) <= 0 for limiter in _limiters(ledger))
+
+
+def acquire_call_slot(ledger=None):
+    """Blocks until both the global and the mission rate limit allow one more call, then takes it."""
+    while True:
+        with _RATE_LOCK:
+            now = time.time()
+            limiters = _limiters(ledger)
+            wait = max(limiter.wait_time(now) for limiter in limiters)
+            if wait <= 0:
+                for limiter in limiters:
+                    limiter.take(now)
+                return
+        time.sleep(min(wait, 1.0))
+
+
+class LLMBackend:
+    """
+    Interface: generate(contents, ...) -> LLMResponse, or an iterator of text chunks when stream=True.
+    contents is a prompt string or a list of strings and PIL images (same as generate_content).
+    """
+
+    name = "base"
+
+    def __init__(self, model_name: str = None):
+        self.model_name = model_name or GEMINI_MODEL
+
+    def generate(self, contents, generation_config=None, stream=False, model=None):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = None, endpoint: str = None):
+        super().__init__(model_name)
+        import google.generativeai as genai
+        endpoint = endpoint or GEMINI_API_ENDPOINT
+        if endpoint:
+            # REST transport lets us point at a plain-HTTP stand-in such as the mock server
+            genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=api_key)
+        self._genai = genai
+        self._models = {}
+
+    def _model(self, name):
+        if name not in self._models:
+            self._models[name] = self._genai.GenerativeModel(name)
+        return self._models[name]
+
+    def generate(self, contents, generation_config=None, stream=False, model=None):
+        name = model or self.model_name
+        kwargs = {"generation_config": generation_config} if generation_config else {}
+        with phase("queue"):
+            acquire_call_slot(current_ledger())
+        started = time.time()
+        with phase("encode"):
+            parts = encode_contents(contents)
+        try:
+            if stream:
+                # ストリーミングの推論時間は呼び出し側 (time-to-action) で計測する
+                response = self._model(name).generate_content(parts, stream=True, **kwargs)
+            else:
+                with phase("inference"):
+                    response = self._model(name).generate_content(parts, **kwargs)
+        except Exception:
+            LLM_CALL_STATS.record(contents, time.time() - started, error=True)
+            record_usage(contents, {}, name, error=True)
+            raise
+
+        if stream:
+            # 受信は別スレッドで進むので、呼び出し時点のミッション Ledger を渡しておく
+            return self._stream(response, contents, started, name, current_ledger())
+
+        text = response.text
+        usage = _usage_dict(response)
+        LLM_CALL_STATS.record(contents, time.time() - started)
+        record_usage(contents, usage, name, text)
+        return LLMResponse(text, usage, name, time.time() - started)
+
+    def _stream(self, response, contents, started, name, ledger):
+        texts, usage = [], {}
+        for chunk in response:
+            texts.append(chunk.text)
+            usage = _usage_dict(chunk) or usage  # usage_metadata は最後のチャンクに載る
+            yield chunk.text
+        LLM_CALL_STATS.record(contents, time.time() - started)
+        record_usage(contents, usage, name, "".join(texts), ledger=ledger)
+
+
+def _usage_dict(response) -> dict:
+    meta = getattr(response, "usage_metadata", None)
+    if not meta:
+        return {}
+    return {
+        "prompt_tokens": getattr(meta, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(meta, "candidates_token_count", 0) or 0,
+        "total_tokens": getattr(meta, "total_token_count", 0) or 0,
+    }
+
+
+# テープファイルへの書き込みはプロセス内で直列化する（VisionCore は呼び出しごとに生成されるため）
+_TAPE_LOCKS = {}
+_TAPE_LOCKS_GUARD = threading.Lock()
+
+
+def _tape_lock(path):
+    with _TAPE_LOCKS_GUARD:
+        return _TAPE_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class RecordingBackend(LLMBackend):
+    """Passes calls through to another backend and appends each request/response pair to a tape."""
+
+    name = "record"
+
+    def __init__(self, inner: LLMBackend, tape_path: str):
+        super().__init__(inner.model_name)
+        self.inner = inner
+        self.tape_path = tape_path
+        os.makedirs(os.path.dirname(os.path.abspath(tape_path)), exist_ok=True)
+
+    def generate(self, contents, generation_config=None, stream=False, model=None):
+        started = time.time()
+        if stream:
+            return self._record_stream(contents, generation_config, model, started)
+        response = self.inner.generate(contents, generation_config=generation_config, model=model)
+        with phase("persist"):
+            self._append(contents, response.text, response.usage, response.model, time.time() - started)
+        return response
+
+    def _record_stream(self, contents, generation_config, model, started):
+        chunks = []
+        for chunk in self.inner.generate(contents, generation_config=generation_config, stream=True, model=model):
+            chunks.append(chunk)
+            yield chunk
+        self._append(contents, "".join(chunks), {}, model or self.model_name, time.time() - started)
+
+    def _append(self, contents, text, usage, model, latency):
+        fingerprint = request_fingerprint(contents)
+        entry = {
+            "key": fingerprint["key"],
+            "prompt_hash": fingerprint["prompt_hash"],
+            "image_hashes": fingerprint["image_hashes"],
+            "prompt": fingerprint["prompt"],
+            "model": model,
+            "response": text,
+            "usage": usage,
+            "latency": round(latency, 3),
+            "timestamp": time.time(),
+        }
+        with _tape_lock(self.tape_path):
+            with open(self.tape_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Serves recorded responses by (prompt, image-hash).
+
+    - 同じキーが複数回記録されていれば記録順に返す
+    - strict=False ではキーが一致しない場合、未使用のエントリを記録順に返す
+      （プロンプトに時刻などが含まれていても再生できるように）
+    - latency: 秒数を指定すると毎回その分待つ。"recorded" なら記録時のレイテンシを再現する
+    """
+
+    name = "replay"
+
+    def __init__(self, tape_path: str, latency=0.0, strict: bool = False, chunk_size: int = 24):
+        super().__init__()
+        self.tape_path = tape_path
+        self.latency = latency
+        self.strict = strict
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._entries = []
+        self._by_key = {}
+        self._used = set()
+        self._cursor = 0
+
+        with open(tape_path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                index = len(self._entries)
+                self._entries.append(entry)
+                self._by_key.setdefault(entry.get("key"), []).append(index)
+
+    def _next_entry(self, contents) -> dict:
+        key = request_fingerprint(contents)["key"]
+        with self._lock:
+            for index in self._by_key.get(key, []):
+                if index not in self._used:
+                    self._used.add(index)
+                    return self._entries[index]
+            if self.strict:
+                raise ReplayMissError(f"No recorded response for request {key}")
+            while self._cursor < len(self._entries) and self._cursor in self._used:
+                self._cursor += 1
+            if self._cursor >= len(self._entries):
+                raise ReplayMissError(f"Replay tape exhausted ({len(self._entries)} entries): {self.tape_path}")
+            self._used.add(self._cursor)
+            return self._entries[self._cursor]
+
+    def _delay(self, entry):
+        if self.latency == "recorded":
+            return float(entry.get("latency", 0.0))
+        return float(self.latency or 0.0)
+
+    def generate(self, contents, generation_config=None, stream=False, model=None):
+        started = time.time()
+        with phase("encode"):
+            entry = self._next_entry(contents)
+        delay = self._delay(entry)
+        text = entry.get("response", "")
+
+        if stream:
+            return self._stream(entry, delay, contents, started, current_ledger())
+
+        if delay:
+            with phase("inference"):
+                time.sleep(delay)
+        LLM_CALL_STATS.record(contents, time.time() - started)
+        record_usage(contents, entry.get("usage", {}), entry.get("model") or self.model_name, text)
+        return LLMResponse(text, entry.get("usage", {}), entry.get("model"), time.time() - started)
+
+    def _stream(self, entry, delay, contents, started, ledger):
+        text = entry.get("response", "")
+        pieces = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+        for piece in pieces:
+            if delay:
+                time.sleep(delay / len(pieces))
+            yield piece
+        LLM_CALL_STATS.record(contents, time.time() - started)
+        record_usage(contents, entry.get("usage", {}), entry.get("model") or self.model_name, text, ledger=ledger)
+
+
+class LatencyTracker:
+    """Recent successful call latencies per model, for the hedging deadline."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies = {}
+
+    def observe(self, model: str, latency: float):
+        with self._lock:
+            self._latencies.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, model: str, percentile: float):
+        """pXX latency of `model`, or None until min_samples calls have been observed."""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+
+class HedgeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {"calls": 0, "hedged": 0, "hedge_won": 0, "primary_won": 0, "skipped": 0, "both_failed": 0}
+
+    def increment(self, name: str):
+        with self._lock:
+            self.counts[name] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+HEDGE_LATENCY = LatencyTracker()
+HEDGE_STATS = HedgeStats()
+
+
+class _HedgeCall:
+    """One attempt of a hedged request, run on its own thread."""
+
+    def __init__(self, backend, contents, generation_config, model, ledger, finished: queue.Queue, label: str,
+                 track: str = None):
+        self.backend = backend
+        self.track = track  # レイテンシを記録するモデル名（元のリクエストのみ。負けても最後まで記録する）
+        self.args = (contents, generation_config, model)
+        self.ledger = ledger
+        self.finished = finished
+        self.label = label
+        self.cancelled = False
+        self.response = None
+        self.error = None
+        self.latency = None
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"llm-hedge-{self.label}", daemon=True).start()
+        return self
+
+    def _run(self):
+        if self.cancelled:
+            return  # 開始前に相手が勝った
+        activate_ledger(self.ledger)  # 使用量はミッションに計上する（重複リクエストも課金される）
+        started = time.time()
+        try:
+            contents, generation_config, model = self.args
+            self.response = self.backend.generate(contents, generation_config=generation_config, model=model)
+            if not (self.response.text or "").strip():
+                raise ValueError("empty response")
+        except Exception as e:
+            self.error = e
+        self.latency = time.time() - started
+        if self.track and self.error is None:
+            HEDGE_LATENCY.observe(self.track, self.latency)
+        self.finished.put(self)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class HedgedBackend(LLMBackend):
+    """
+    Sends a duplicate request when a call is slower than the pXX latency of recent calls of its model,
+    and returns the first valid response. The losing request is cancelled if it has not started yet;
+    an in-flight HTTP request cannot be aborted by the SDK, so its response is discarded.
+    Hedges are skipped when the rate limits or the mission budget leave no room. Streaming calls pass through.
+    """
+
+    name = "hedged"
+
+    def __init__(self, inner: LLMBackend, percentile: float = None, min_delay: float = None):
+        super().__init__(inner.model_name)
+        self.inner = inner
+        self.percentile = HEDGE_PERCENTILE if percentile is None else percentile
+        self.min_delay = HEDGE_MIN_DELAY if min_delay is None else min_delay
+
+    def deadline(self, model: str):
+        latency = HEDGE_LATENCY.percentile(model, self.percentile)
+        return None if latency is None else max(self.min_delay, latency)
+
+    def generate(self, contents, generation_config=None, stream=False, model=None):
+        if stream:
+            return self.inner.generate(contents, generation_config=generation_config, stream=True, model=model)
+        name = model or self.model_name
+        ledger = current_ledger()
+        finished = queue.Queue()
+        HEDGE_STATS.increment("calls")
+        deadline = self.deadline(name)
+        primary = _HedgeCall(self.inner, contents, generation_config, model, ledger, finished, "primary", track=name).start()
+
+        with phase("inference"):
+            try:
+                first = finished.get(timeout=deadline)
+            except queue.Empty:
+                first = None
+            if first is None:
+                if not call_slot_available(ledger) or (ledger is not None and ledger.exceeded()):
+                    HEDGE_STATS.increment("skipped")
+                    first = finished.get()
+                else:
+                    HEDGE_STATS.increment("hedged")
+                    print(f"   ⏩ Hedging {name} call (slower than p{self.percentile:g} = {deadline:.1f}s)")
+                    hedge = _HedgeCall(self.inner, contents, generation_config, model, ledger, finished, "hedge").start()
+                    first = finished.get()
+                    if not first.ok:
+                        first = finished.get()  # 先に返った方が失敗なら、もう一方を待つ
+                    (hedge if first is primary else primary).cancelled = True
+                    if first.ok:
+                        HEDGE_STATS.increment("hedge_won" if first is hedge else "primary_won")
+                    else:
+                        HEDGE_STATS.increment("both_failed")
+
+        if not first.ok:
+            raise first.error
+        return first.response
+
+
+_REPLAY_BACKENDS = {}
+_REPLAY_BACKENDS_GUARD = threading.Lock()
+
+
+def create_backend(api_key: str = None, kind: str = None, tape_path: str = None):
+    """
+    Builds the backend selected by arguments or environment.
+    Returns None when no backend is usable (Gemini without API key) - callers then use mock mode.
+    """
+    kind = kind or os.getenv("AIRPORT_LLM_BACKEND", "gemini")
+    tape_path = tape_path or os.getenv("AIRPORT_LLM_TAPE")
+    api_key = api_key or os.getenv("GOOGLE_API_KEY")
+
+    if kind == "replay":
+        if not tape_path or not os.path.exists(tape_path):
+            raise FileNotFoundError(f"Replay tape not found: {tape_path}")
+        # VisionCore は呼び出しごとに生成されるので、再生位置を共有するためテープごとに1インスタンス
+        with _REPLAY_BACKENDS_GUARD:
+            key = os.path.abspath(tape_path)
+            if key not in _REPLAY_BACKENDS:
+                latency = os.getenv("AIRPORT_LLM_REPLAY_LATENCY", "0")
+                if latency != "recorded":
+                    latency = float(latency)
+                _REPLAY_BACKENDS[key] = ReplayBackend(
+                    tape_path, latency=latency,
+                    strict=os.getenv("AIRPORT_LLM_REPLAY_STRICT", "0") == "1",
+                )
+            return _REPLAY_BACKENDS[key]
+
+    if not api_key:
+        return None
+    backend = GeminiBackend(api_key)
+    if LLM_HEDGING:
+        backend = HedgedBackend(backend)
+
+    if kind == "record":
+        if not tape_path:
+            raise ValueError("AIRPORT_LLM_TAPE is required for the record backend")
+        return RecordingBackend(backend, tape_path)
+    return backend
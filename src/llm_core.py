@@ -1,18 +1,63 @@
-import google.generativeai as genai
 from PIL import Image
 import os
-import json
 import time
 
+from src.accounting import record_retry
+from src.config import CHAT_HISTORY_TURNS, STRUCTURED_OUTPUT
+from src.llm_backend import create_backend
+from src.llm_schemas import CLICK_BATCH_SCHEMA, CLICK_SCHEMA, CONDITION_SCHEMA, FLIGHT_PLAN_SCHEMA, ATTENDANT_INTENT_SCHEMA
+from src.metrics import phase
+from src.model_router import current_router, report_route, route
+from src.structured_output import parse_structured, PARSE_STATS
+
+# VisionCore.analyze_image_batch: 1 回のリクエストで探す要素の上限（超えた分は分けて送る）
+MAX_BATCH_TARGETS = 10
+
+# Constrained JSON output is turned off for the process once the SDK/model rejects it
+_constrained_output = STRUCTURED_OUTPUT
+
+_SCHEMA_ERROR_MARKERS = ("response_schema", "response_mime_type", "generation_config")
+
+
+def generate_json(backend, contents, schema: dict, schema_name: str, model: str = None) -> dict:
+    """
+    Calls the LLM backend and returns a schema-valid dict.
+    Uses Gemini constrained JSON output when available, otherwise falls back to
+    free text + tolerant parsing (see structured_output.parse_structured).
+    model: overrides the backend's default model (model_router の段)
+    """
+    global _constrained_output
+
+    if _constrained_output:
+        try:
+            config = {
+                "response_mime_type": "application/json",
+                "response_schema": schema,
+            }
+            response = backend.generate(contents, generation_config=config, model=model)
+            PARSE_STATS.increment(schema_name, "constrained")
+            with phase("parse"):
+                return parse_structured(response.text, schema, schema_name)
+        except (TypeError, AttributeError) as e:
+            print(f"⚠️ Constrained JSON output unavailable ({e}). Falling back to tolerant parsing.")
+            _constrained_output = False
+        except Exception as e:
+            if not any(marker in str(e) for marker in _SCHEMA_ERROR_MARKERS):
+                raise
+            print(f"⚠️ Constrained JSON output rejected ({e}). Falling back to tolerant parsing.")
+            _constrained_output = False
+
+    response = backend.generate(contents, model=model)
+    with phase("parse"):
+        return parse_structured(response.text, schema, schema_name)
+
+
 class VisionCore:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, backend=None):
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
-        if not self.api_key:
+        self.backend = backend or create_backend(self.api_key)
+        if not self.backend:
             print("⚠️ Warning: GOOGLE_API_KEY is not set. LLM mode will run in Mock mode.")
-            self.client = None
-        else:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-3-flash-preview')
 
     def _with_retries(self, func, max_retries=3, base_wait=5):
         """Simple retry helper for LLM calls."""
@@ -22,11 +67,14 @@ class VisionCore:
             except Exception as e:
                 wait_time = base_wait * (attempt + 1)
                 print(f"LLM Error (Attempt {attempt+1}/{max_retries}): {e}")
-                if "429" in str(e) or "Resource exhausted" in str(e):
-                    print(f"⚠️ Rate limit hit. Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                else:
-                    time.sleep(2)
+                if attempt + 1 < max_retries:
+                    record_retry()
+                with phase("queue"):
+                    if "429" in str(e) or "Resource exhausted" in str(e):
+                        print(f"⚠️ Rate limit hit. Waiting {wait_time}s...")
+                        time.sleep(wait_time)
+                    else:
+                        time.sleep(2)
         return None
 
     def analyze_image(self, image_path, instruction):
@@ -34,11 +82,11 @@ class VisionCore:
         Sends the image to Gemini 2.0 Flash to find the coordinates of the target element.
         Returns: (x, y, confidence)
         """
-        if not self.api_key:
+        if not self.backend:
             print("[LLM Mock] Pretending to see the image...")
             return 100, 100, 0.5
 
-        def _call():
+        def _call(model=None):
             img = Image.open(image_path)
 
             prompt = f"""
@@ -57,26 +105,104 @@ class VisionCore:
             }}
             """
 
-            response = self.model.generate_content([prompt, img])
-            text = response.text
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0].strip()
-
-            data = json.loads(text)
+            data = generate_json(self.backend, [prompt, img], CLICK_SCHEMA, "click", model=model)
             return data["x"], data["y"], data.get("confidence", 1.0)
 
-        result = self._with_retries(_call, max_retries=5)
+        decision = route("ground")
+        result = self._with_retries(lambda: _call(decision and decision.model), max_retries=5)
+        if decision:
+            x, y, confidence = result if result else (None, None, 0.0)
+            report_route(decision, ok=x is not None, confidence=confidence)
+            # 信頼度が低い・見つからなかった場合は、上の段のモデルで 1 回だけ取り直す
+            retry = route("ground")
+            if (x is None or confidence < current_router().low_confidence) and retry.tier > decision.tier:
+                print(f"   🧭 Escalating grounding to {retry.model} (confidence {confidence})")
+                escalated = self._with_retries(lambda: _call(retry.model), max_retries=2)
+                report_route(retry, ok=bool(escalated), confidence=escalated[2] if escalated else 0.0)
+                if escalated and (result is None or escalated[2] >= confidence):
+                    result = escalated
         return result if result else (None, None, 0.0)
 
+    def analyze_image_batch(self, image_path, instructions):
+        """
+        Finds several UI elements on one screenshot with a single request (one upload, one round-trip).
+        Returns one (x, y, confidence) per instruction, in order. Each target fails on its own:
+        (None, None, 0.0) for a target that was not found (the others are still usable).
+        More than MAX_BATCH_TARGETS instructions are split into several requests.
+        """
+        if not instructions:
+            return []
+        if len(instructions) > MAX_BATCH_TARGETS:
+            return (self.analyze_image_batch(image_path, instructions[:MAX_BATCH_TARGETS])
+                    + self.analyze_image_batch(image_path, instructions[MAX_BATCH_TARGETS:]))
+        if not self.backend:
+            print(f"[LLM Mock] Pretending to see {len(instructions)} targets...")
+            return [(100, 100, 0.5)] * len(instructions)
+
+        def _call(items, model=None):
+            img = Image.open(image_path)
+            targets = "\n".join(f"{index}. {instruction}" for index, instruction in enumerate(items))
+
+            prompt = f"""
+            You are an intelligent GUI automation agent.
+            Look at the attached screenshot of a web page/application.
+            Identify the UI element that matches each of these numbered user instructions:
+            {targets}
+            
+            For every instruction return its index and the center coordinates (x, y) of the element in the image,
+            as precise integers relative to the top-left image corner (0,0).
+            If an element is not visible, return it with "found": false.
+            
+            Output strictly valid JSON only:
+            {{
+                "targets": [
+                    {{"index": 0, "found": true, "x": 123, "y": 456, "confidence": 0.95}}
+                ]
+            }}
+            """
+
+            data = generate_json(self.backend, [prompt, img], CLICK_BATCH_SCHEMA, "click_batch", model=model)
+            results = [(None, None, 0.0)] * len(items)
+            for target in data["targets"]:
+                index = target["index"]
+                if 0 <= index < len(items) and target.get("found", True):
+                    results[index] = (target["x"], target["y"], target.get("confidence", 1.0))
+            return results
+
+        def _report(decision, results):
+            found = [r for r in results if r[0] is not None]
+            report_route(decision, ok=len(found) == len(results), confidence=min((r[2] for r in found), default=0.0))
+
+        decision = route("ground")
+        results = self._with_retries(lambda: _call(instructions, decision and decision.model)) or \
+            [(None, None, 0.0)] * len(instructions)
+        if decision:
+            _report(decision, results)
+            # 見つからなかった・信頼度の低い要素だけを、上の段のモデルで 1 回だけ取り直す
+            weak = [i for i, (x, _, confidence) in enumerate(results)
+                    if x is None or confidence < current_router().low_confidence]
+            retry = route("ground") if weak else None
+            if retry and retry.tier > decision.tier:
+                print(f"   🧭 Escalating grounding of {len(weak)}/{len(instructions)} targets to {retry.model}")
+                escalated = self._with_retries(lambda: _call([instructions[i] for i in weak], retry.model), max_retries=2)
+                if escalated:
+                    _report(retry, escalated)
+                    for i, better in zip(weak, escalated):
+                        if better[0] is not None and (results[i][0] is None or better[2] >= results[i][2]):
+                            results[i] = better
+                else:
+                    report_route(retry, ok=False, confidence=0.0)
+        return results
+
     def ask_about_image(self, image_path, question):
         """
         Asks a question about the image and returns the text answer.
         """
-        if not self.api_key:
+        if not self.backend:
             return "Mock Answer: 012-3456-7890"
 
+        decision = route("read")
+
         def _call():
             img = Image.open(image_path)
             prompt = f"""
@@ -85,18 +211,46 @@ class VisionCore:
             
             Return ONLY the answer text. Be concise.
             """
-            response = self.model.generate_content([prompt, img])
+            response = self.backend.generate([prompt, img], model=decision and decision.model)
             return response.text.strip()
 
         result = self._with_retries(_call, max_retries=3, base_wait=3)
+        report_route(decision, ok=bool(result))
         return result if result else "Failed to extract"
 
+    def check_condition(self, image_path, condition):
+        """
+        Asks whether `condition` holds for the screenshot (ATC.wait_for の vision 条件).
+        Returns: (met, confidence)
+        """
+        if not self.backend:
+            return True, 0.5
+
+        decision = route("read")
+
+        def _call():
+            img = Image.open(image_path)
+            prompt = f"""
+            Look at the screenshot of a web page.
+            Does the following condition hold right now? "{condition}"
+            Answer false if the page is still loading or the condition is only partly met.
+            
+            Output strictly valid JSON only:
+            {{"met": true, "confidence": 0.9}}
+            """
+            data = generate_json(self.backend, [prompt, img], CONDITION_SCHEMA, "condition", model=decision and decision.model)
+            return bool(data["met"]), data.get("confidence", 1.0)
+
+        result = self._with_retries(_call, max_retries=2, base_wait=3)
+        report_route(decision, ok=result is not None, confidence=result[1] if result else None)
+        return result if result else (False, 0.0)
+
     def generate_plan(self, user_instruction: str) -> dict:
         """
         Generates a flight plan from a natural language instruction.
         Returns a dictionary with 'plan' (list of steps) and 'summary'.
         """
-        if not self.api_key:
+        if not self.backend:
             # Mock mode for testing
             return {
                 "summary": f"Mock plan for: {user_instruction}",
@@ -167,16 +321,7 @@ class VisionCore:
 """
 
         def _call():
-            response = self.model.generate_content(prompt)
-            text = response.text.strip()
-
-            # Extract JSON from response
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0].strip()
-
-            return json.loads(text)
+            return generate_json(self.backend, prompt, FLIGHT_PLAN_SCHEMA, "flight_plan")
 
         plan_data = self._with_retries(_call, max_retries=3)
         if plan_data:
@@ -199,16 +344,12 @@ class Attendant:
     - 雑談 → 自然に応答
     """
     
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, backend=None):
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         self.conversation_history = []
+        self.earlier_requests = []  # 履歴から外れた古いターンのユーザー発言（要約用、上限あり）
         self.pending_plan = None
-        
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-3-flash-preview')
-        else:
-            self.model = None
+        self.backend = backend or create_backend(self.api_key)
     
     def chat(self, user_message: str) -> dict:
         """
@@ -224,9 +365,9 @@ class Attendant:
         import time
         
         # Add to history
-        self.conversation_history.append({"role": "user", "content": user_message})
+        self._remember("user", user_message)
         
-        if not self.api_key:
+        if not self.backend:
             # Mock mode
             return self._mock_response(user_message)
         
@@ -269,26 +410,14 @@ class Attendant:
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                response = self.model.generate_content(prompt)
-                text = response.text.strip()
-                
-                # Extract JSON
-                if "```json" in text:
-                    text = text.split("```json")[1].split("```")[0].strip()
-                elif "```" in text:
-                    text = text.split("```")[1].split("```")[0].strip()
-                
-                result = json.loads(text)
+                result = generate_json(self.backend, prompt, ATTENDANT_INTENT_SCHEMA, "attendant_intent")
                 
                 # Add assistant response to history
-                self.conversation_history.append({
-                    "role": "assistant", 
-                    "content": result.get("response", "")
-                })
+                self._remember("assistant", result.get("response", ""))
                 
                 # If it's a task, generate the flight plan
                 if result.get("intent") == "task" and result.get("task_description"):
-                    vision = VisionCore(self.api_key)
+                    vision = VisionCore(self.api_key, backend=self.backend)
                     plan = vision.generate_plan(result["task_description"])
                     result["plan"] = plan
                     self.pending_plan = plan
@@ -301,6 +430,8 @@ class Attendant:
                 
             except Exception as e:
                 print(f"Attendant Error (Attempt {attempt+1}/{max_retries}): {e}")
+                if attempt + 1 < max_retries:
+                    record_retry()
                 if "429" in str(e) or "Resource exhausted" in str(e):
                     time.sleep((attempt + 1) * 5)
                 else:
@@ -314,10 +445,24 @@ class Attendant:
             "needs_confirmation": False
         }
     
-    def _format_history(self, max_turns=10) -> str:
+    def _remember(self, role: str, content: str):
+        """履歴に追加し、直近 CHAT_HISTORY_TURNS ターンを超えた分は古いユーザー発言の要約だけ残す"""
+        self.conversation_history.append({"role": role, "content": content})
+        overflow = len(self.conversation_history) - CHAT_HISTORY_TURNS * 2
+        if overflow > 0:
+            for msg in self.conversation_history[:overflow]:
+                if msg["role"] == "user":
+                    text = " ".join(msg["content"].split())
+                    self.earlier_requests.append(text if len(text) <= 60 else text[:59] + "…")
+            del self.conversation_history[:overflow]
+            del self.earlier_requests[:-CHAT_HISTORY_TURNS]
+    
+    def _format_history(self, max_turns=CHAT_HISTORY_TURNS) -> str:
         """会話履歴をフォーマット"""
         recent = self.conversation_history[-max_turns*2:]
         lines = []
+        if self.earlier_requests:
+            lines.append("(それ以前のパイロットの発言: " + " / ".join(f"「{text}」" for text in self.earlier_requests) + ")")
         for msg in recent:
             role = "パイロット" if msg["role"] == "user" else "Attendant"
             lines.append(f"{role}: {msg['content']}")
@@ -371,4 +516,5 @@ class Attendant:
     def clear_history(self):
         """会話履歴をクリア"""
         self.conversation_history = []
+        self.earlier_requests = []
         self.pending_plan = None
@@ -0,0 +1,145 @@
+"""
+Response schemas for every structured LLM call in Airport.
+
+Gemini の response_schema (OpenAPI subset) 形式で定義しているので、
+constrained JSON output にそのまま渡せる。フォールバック時は
+structured_output.validate_schema で同じスキーマを検証に使う。
+"""
+
+# ReActAgent._act が理解できるアクション
+REACT_ACTIONS = [
+    "goto", "click", "type", "key", "scroll", "wait", "read", "get_url",
+    "save_file", "ask_user", "run_terminal", "done", "fail",
+    "launch_app", "click_desktop", "type_desktop", "press_hotkey",
+    "print_document", "switch_to_web",
+]
+
+# VisionCore.generate_plan が出力できるアクション
+PLAN_ACTIONS = [
+    "goto", "click", "click_vision", "type", "type_vision",
+    "key", "read", "wait", "launch_app",
+]
+
+ATTENDANT_INTENTS = ["task", "question", "confirmation", "chat", "clarification"]
+
+
+CLICK_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "x": {"type": "NUMBER"},
+        "y": {"type": "NUMBER"},
+        "confidence": {"type": "NUMBER"},
+    },
+    "required": ["x", "y"],
+}
+
+# VisionCore.analyze_image_batch: 1 枚の画面で複数の要素を探す（index は指示の番号）
+CLICK_BATCH_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "targets": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "index": {"type": "INTEGER"},
+                    "found": {"type": "BOOLEAN"},
+                    "x": {"type": "NUMBER"},
+                    "y": {"type": "NUMBER"},
+                    "confidence": {"type": "NUMBER"},
+                },
+                "required": ["index", "x", "y"],
+            },
+        },
+    },
+    "required": ["targets"],
+}
+
+# ATC.wait_for(vision=...): 画面について条件が満たされているか
+CONDITION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "met": {"type": "BOOLEAN"},
+        "confidence": {"type": "NUMBER"},
+    },
+    "required": ["met"],
+}
+
+# params はアクションごとに中身が違うので、全アクションのパラメータを optional で列挙する
+REACT_PARAMS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "url": {"type": "STRING"},
+        "x": {"type": "NUMBER"},
+        "y": {"type": "NUMBER"},
+        "description": {"type": "STRING"},
+        "click_count": {"type": "INTEGER"},
+        "text": {"type": "STRING"},
+        "submit": {"type": "BOOLEAN"},
+        "key": {"type": "STRING"},
+        "direction": {"type": "STRING", "enum": ["up", "down"]},
+        "amount": {"type": "INTEGER"},
+        "seconds": {"type": "NUMBER"},
+        "target": {"type": "STRING"},
+        "result": {"type": "STRING"},
+        "label": {"type": "STRING"},
+        "filename": {"type": "STRING"},
+        "content": {"type": "STRING"},
+        "append": {"type": "BOOLEAN"},
+        "question": {"type": "STRING"},
+        "command": {"type": "STRING"},
+        "reason": {"type": "STRING"},
+        "instruction": {"type": "STRING"},
+        "keys": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "filepath": {"type": "STRING"},
+    },
+}
+
+REACT_THOUGHT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "observation": {"type": "STRING"},
+        "reasoning": {"type": "STRING"},
+        "action": {"type": "STRING", "enum": REACT_ACTIONS},
+        "params": REACT_PARAMS_SCHEMA,
+    },
+    "required": ["action", "params"],
+}
+
+FLIGHT_PLAN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "plan": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "step": {"type": "INTEGER"},
+                    "action": {"type": "STRING", "enum": PLAN_ACTIONS},
+                    "url": {"type": "STRING"},
+                    "selector": {"type": "STRING"},
+                    "mode": {"type": "STRING"},
+                    "instruction": {"type": "STRING"},
+                    "text": {"type": "STRING"},
+                    "key": {"type": "STRING"},
+                    "seconds": {"type": "NUMBER"},
+                    "command": {"type": "STRING"},
+                },
+                "required": ["action"],
+            },
+        },
+    },
+    "required": ["summary", "plan"],
+}
+
+ATTENDANT_INTENT_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "response": {"type": "STRING"},
+        "intent": {"type": "STRING", "enum": ATTENDANT_INTENTS},
+        "needs_confirmation": {"type": "BOOLEAN"},
+        "task_description": {"type": "STRING", "nullable": True},
+    },
+    "required": ["response", "intent"],
+}
@@ -0,0 +1,177 @@
+"""
+Look-ahead grounding - 自動操縦のビジョンステップを先回りしてグラウンディングする。
+
+test_scenarios_vision_only.yaml のような mode: llm のクリックと type_vision が続くプランは、これまで 1 ステップずつ
+Vision の応答を待っていた。ここでは:
+    バッチ   - 同じ画面で続くビジョンステップ（type_vision の並びと、その後の最初のクリックまで）は
+               1 枚のスクリーンショットと 1 回の VisionCore.analyze_image_batch でまとめてグラウンディングする
+    先回り   - `wait: N` の固定待ちの間に画面が落ち着いたら（ATC.wait_for_settle）、その画面で次のグループの
+               グラウンディングを始め、待機の残りと並行してモデルを待つ
+    検証     - 予測した座標は、そのステップの直前の実際の画面が予測に使った画面と同じ（同じページで dHash の差が
+               CHECKPOINT_DHASH_THRESHOLD 以下）ときだけ使う。違えば捨ててその画面でグラウンディングし直す
+予測を使ったステップは ATC.click(grounded=...) で Vision を呼ばずに実行される（コンパイル済みのセレクタと
+サイト知識が優先）。ページに触る処理（スクリーンショット）は呼び出し側のスレッドで済ませ、モデル呼び出しだけを
+バックグラウンドのスレッドで行う。
+"""
+
+import os
+import threading
+import time
+
+from src.accounting import activate_ledger, current_ledger
+from src.config import CHECKPOINT_DHASH_THRESHOLD
+from src.mission_compiler import dhash, hamming, page_key
+from src.plan_compiler import is_vision_step
+
+# 画面を変えないビジョンステップ（この後のステップも同じ画面でグラウンディングできる）
+SCREEN_PRESERVING = ("type_vision",)
+MAX_GROUP = 8  # 1 回のバッチで探す要素の上限
+
+
+def screen_group(steps: list, start: int) -> list:
+    """
+    Indices of the vision steps from `start` that should see the same screen: consecutive type_vision steps up to
+    and including the first click (or step with a `wait_for:` post-condition). Steps with compiled selectors end it.
+    """
+    group = []
+    for index in range(start, min(len(steps), start + MAX_GROUP)):
+        step = steps[index]
+        if not is_vision_step(step) or step.get("selectors"):
+            break
+        group.append(index)
+        if step.get("action") not in SCREEN_PRESERVING or step.get("wait_for"):
+            break
+    return group
+
+
+class LookAhead:
+    """Look-ahead grounding of one running task's vision steps (see the module docstring)."""
+
+    def __init__(self, steps: list, shot_dir: str, prepare=None):
+        """
+        steps: the task's plan steps.
+        shot_dir: where the frames used for grounding are saved (the ATC's screenshot directory).
+        prepare: index -> the step as it will run (e.g. with compiled selectors); defaults to steps[index].
+        """
+        self.steps = steps
+        self.shot_dir = shot_dir
+        self.prepare = prepare or (lambda index: steps[index])
+        self.threshold = CHECKPOINT_DHASH_THRESHOLD
+        self._pending = {}  # step index -> {"batch", "position"}
+        # hidden_seconds: モデルの時間のうち、ステップが待たずに済んだ分
+        self.stats = {"batches": 0, "steps": 0, "used": 0, "discarded": 0, "hidden_seconds": 0.0}
+
+    # ---- scheduling ----
+    def group(self, start: int) -> list:
+        upcoming = [self.prepare(i) for i in range(start, min(len(self.steps), start + MAX_GROUP))]
+        return [start + i for i in screen_group(upcoming, 0)]
+
+    def shot_path(self, index: int, tag: str = "lookahead") -> str:
+        os.makedirs(self.shot_dir, exist_ok=True)
+        return os.path.join(self.shot_dir, f"{tag}_{int(time.time() * 1000)}_{index + 1}.png")
+
+    def pending(self, index: int) -> bool:
+        return index in self._pending
+
+    def start(self, start: int, shot_path: str, url: str, minimum: int = 1) -> list:
+        """
+        Starts grounding the screen group at `start` on the frame `shot_path` (already saved) in the background.
+        minimum: smallest group worth a request (a lone step is left to ATC.click, which tries site knowledge first).
+        Returns the step indices covered.
+        """
+        indices = [i for i in self.group(start) if i not in self._pending]
+        if len(indices) < minimum:
+            return []
+        try:
+            checkpoint = {"url": url, "dhash": dhash(shot_path)}
+        except Exception as e:
+            print(f"   ⚠️ Look-ahead Error: {e}")
+            return []
+        instructions = [self.prepare(i).get("instruction") for i in indices]
+        batch = {"checkpoint": checkpoint, "results": None, "started": time.time(), "finished": None}
+        ledger = current_ledger()
+
+        def _run():
+            activate_ledger(ledger)
+            try:
+                from src.llm_core import VisionCore
+                vision = VisionCore()
+                if len(instructions) == 1:
+                    batch["results"] = [vision.analyze_image(shot_path, instructions[0])]
+                else:
+                    batch["results"] = vision.analyze_image_batch(shot_path, instructions)
+            except Exception as e:
+                print(f"   ⚠️ Look-ahead Error: {e}")
+            finally:
+                batch["finished"] = time.time()
+                activate_ledger(None)
+
+        batch["thread"] = threading.Thread(target=_run, daemon=True)
+        batch["thread"].start()
+        for position, index in enumerate(indices):
+            self._pending[index] = {"batch": batch, "position": position}
+        self.stats["batches"] += 1
+        self.stats["steps"] += len(indices)
+        print(f"   ⏩ Look-ahead grounding of step(s) {', '.join(str(i + 1) for i in indices)} started")
+        return indices
+
+    # ---- using predictions ----
+    def take(self, index: int, shot_path: str, url: str):
+        """
+        The pending prediction of step `index` if the current frame (`shot_path`, `url`) is still the screen it was
+        grounded on; None otherwise (the prediction is discarded). Wait for it with `join` / `join_async`.
+        """
+        entry = self._pending.pop(index, None)
+        if not entry:
+            return None
+        expected = entry["batch"]["checkpoint"]
+        if page_key(expected["url"]) != page_key(url):
+            return self._discard(index, entry, "page changed")
+        try:
+            distance = hamming(expected["dhash"], dhash(shot_path))
+        except Exception as e:
+            return self._discard(index, entry, f"checkpoint error: {e}")
+        if distance > self.threshold:
+            return self._discard(index, entry, f"frame changed ({distance} bits)")
+        return entry
+
+    def join(self, entry):
+        """Waits for the prediction of `entry` (from take) and returns (x, y, confidence), or None if it failed."""
+        waited = time.time()
+        entry["batch"]["thread"].join()
+        return self._result(entry, time.time() - waited)
+
+    async def join_async(self, entry):
+        import asyncio
+        waited = time.time()
+        await asyncio.to_thread(entry["batch"]["thread"].join)
+        return self._result(entry, time.time() - waited)
+
+    def _result(self, entry, waited: float):
+        batch = entry["batch"]
+        results = batch["results"] or []
+        result = results[entry["position"]] if entry["position"] < len(results) else None
+        if not result or result[0] is None:
+            self.stats["discarded"] += 1
+            print("   ⏩ Look-ahead grounding failed, grounding again")
+            return None
+        self.stats["used"] += 1
+        if not batch.get("counted"):
+            # バッチのモデル時間はグループの最初のステップで数える
+            batch["counted"] = True
+            self.stats["hidden_seconds"] += max(0.0, batch["finished"] - batch["started"] - waited)
+        print(f"   ⏩ Using look-ahead grounding (waited {waited:.2f}s)")
+        return tuple(result)
+
+    def _discard(self, index: int, entry: dict, reason: str):
+        """予測を捨てる（実行中の呼び出しは止められないので、結果を使わないだけ）"""
+        self.stats["discarded"] += 1
+        print(f"   ⏩ Look-ahead grounding of step {index + 1} discarded ({reason})")
+        # 同じ画面を前提にしたバッチの残りも使えない
+        for other in [i for i, e in self._pending.items() if e["batch"] is entry["batch"]]:
+            self._pending.pop(other)
+            self.stats["discarded"] += 1
+        return None
+
+    def summary(self) -> dict:
+        return {**self.stats, "hidden_seconds": round(self.stats["hidden_seconds"], 3)}
@@ -0,0 +1,140 @@
+"""
+Loop Detector - notices ReAct runs that stopped making progress and escalates.
+
+新しい画面を観察するたびに、直前のアクションが効いたかを判定する:
+    - 画面が変わらなかった (dHash がほぼ同じ・同じページ)
+    - 同じアクションの繰り返し（同じ座標付近のクリック・同じ入力・同じURL）
+    - URL の往復 (A → B → A → B)
+いずれかに当たるステップが続いた数 (streak) に応じて段階的に対処する:
+    HINT      - 思考プロンプトに「何が効いていないか」を添える
+    REGROUND  - click の座標をモデルの思考ではなく Vision のグラウンディングで取り直す
+    ASK_USER  - 人間に助けを求める（人間がいない実行ではスキップ）
+    STOP      - モデルを呼ばずに診断付きで終了する（ステータス "stuck"）
+
+履歴とは別に直近のステップだけを保持するので、履歴の長さに関係なく一定のメモリで動く。
+"""
+
+from collections import deque
+
+from src.mission_compiler import hamming, page_key
+
+NONE, HINT, REGROUND, ASK_USER, STOP = range(5)
+LEVEL_NAMES = ("none", "hint", "reground", "ask_user", "stop")
+
+# streak（効いていないステップの連続数）がこの値以上でその段階に入る
+THRESHOLDS = {HINT: 2, REGROUND: 3, ASK_USER: 5, STOP: 7}
+
+# 画面が変わるはずのアクション
+VISIBLE_ACTIONS = ("click", "type", "key", "scroll", "goto")
+FRAME_TOLERANCE = 3   # dHash の差がこのビット数以下なら「画面は変わっていない」
+CLICK_RADIUS = 15     # この距離以内のクリックは同じ場所とみなす
+REPEAT_WINDOW = 4     # 繰り返しを探す直近のステップ数
+
+
+def same_action(a: dict, b: dict) -> bool:
+    if a["action"] != b["action"]:
+        return False
+    pa, pb = a.get("params") or {}, b.get("params") or {}
+    if a["action"] == "click":
+        try:
+            return abs(pa.get("x", 0) - pb.get("x", 0)) <= CLICK_RADIUS and abs(pa.get("y", 0) - pb.get("y", 0)) <= CLICK_RADIUS
+        except TypeError:
+            return False
+    if a["action"] in ("wait", "read", "done", "fail"):
+        return False  # 待機・読み取りの繰り返しは停滞とはみなさない
+    return pa == pb
+
+
+class Assessment:
+    def __init__(self, level: int, streak: int, reasons: list):
+        self.level = level
+        self.streak = streak
+        self.reasons = reasons
+
+    @property
+    def name(self) -> str:
+        return LEVEL_NAMES[self.level]
+
+    def as_dict(self) -> dict:
+        return {"level": self.name, "streak": self.streak, "reasons": self.reasons}
+
+
+class LoopDetector:
+    def __init__(self, window: int = 12, can_ask_user: bool = True):
+        self.records = deque(maxlen=window)  # {"action", "params", "url", "frame"}
+        self.can_ask_user = can_ask_user
+        self.asked_user = False
+        self.streak = 0
+        self.reasons = []
+        self._pending = None
+
+    def reset(self):
+        """Forgets the recent steps (e.g. after the user intervened)."""
+        self.records.clear()
+        self.streak = 0
+        self.reasons = []
+
+    def observe(self, url: str, frame: str) -> Assessment:
+        """Called with each new observation, before thinking. Judges whether the previous action had any effect."""
+        reasons = []
+        if self.records:
+            last = self.records[-1]
+            unchanged = (
+                last["action"] in VISIBLE_ACTIONS and frame and last["frame"]
+                and page_key(url) == page_key(last["url"]) and hamming(frame, last["frame"]) <= FRAME_TOLERANCE
+            )
+            if unchanged:
+                reasons.append(f"'{last['action']}' {self._describe(last)} did not change the screen")
+            earlier = list(self.records)[-REPEAT_WINDOW - 1:-1]
+            repeats = sum(1 for record in earlier if same_action(record, last))
+            if repeats:
+                reasons.append(f"'{last['action']}' {self._describe(last)} repeated {repeats + 1} times")
+            urls = [page_key(r["url"]) for r in list(self.records)[-3:]] + [page_key(url)]
+            if len(urls) == 4 and urls[0] == urls[2] and urls[1] == urls[3] and urls[0] != urls[1]:
+                reasons.append(f"navigating back and forth between {urls[0]} and {urls[1]}")
+        self.streak = self.streak + 1 if reasons else 0
+        self.reasons = reasons
+        self._pending = {"url": url, "frame": frame}
+        return Assessment(self._level(), self.streak, reasons)
+
+    def record(self, action: str, params: dict):
+        """Records the action chosen for the last observation."""
+        pending = self._pending or {"url": None, "frame": None}
+        self.records.append({**pending, "action": action, "params": dict(params or {})})
+        self._pending = None
+
+    def _level(self) -> int:
+        level = NONE
+        for candidate, threshold in sorted(THRESHOLDS.items()):
+            if self.streak >= threshold:
+                level = candidate
+        if level == ASK_USER and (self.asked_user or not self.can_ask_user):
+            level = REGROUND
+        return level
+
+    @staticmethod
+    def _describe(record: dict) -> str:
+        params = record.get("params") or {}
+        if record["action"] == "click":
+            return f"at ({params.get('x')}, {params.get('y')})"
+        if record["action"] == "type":
+            return f"\"{str(params.get('text', ''))[:30]}\""
+        if record["action"] == "goto":
+            return str(params.get("url", ""))[:60]
+        if record["action"] == "key":
+            return str(params.get("key", ""))
+        return ""
+
+    def hint(self) -> str:
+        """Corrective text for the think prompt."""
+        lines = [f"- {reason}" for reason in self.reasons]
+        return (
+            f"⚠️ 直近 {self.streak} ステップ進展がありません:\n" + "\n".join(lines) +
+            "\n同じ操作を繰り返さず、別の要素・別の座標・スクロール・キー操作・URL直接指定など、違う方法を試してください。"
+        )
+
+    def question(self) -> str:
+        return (
+            f"エージェントが {self.streak} ステップ進めずにいます（" + "; ".join(self.reasons) +
+            "）。画面を操作して状況を直すか、次に何をすべきか教えてください。"
+        )
@@ -1,330 +1,917 @@
-import os
-import time
-import subprocess
-import json
-from dotenv import load_dotenv
-
-from src.config import DISPLAY, LOGS_DIR, SCREENSHOTS_DIR, VIDEOS_DIR, VIEWPORT_SIZE
-
-load_dotenv()
-
-# --- Airport 自律起動フェーズ ---
-def ensure_display():
-    display = DISPLAY
-    try:
-        subprocess.run(["xdpyinfo", "-display", display], 
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-    except Exception:
-        print(f"Display {display} not found. Starting Xvfb...")
-        subprocess.Popen(["Xvfb", display, "-ac", "-screen", "0", "1280x720x24"])
-        time.sleep(2)
-
-ensure_display()
-
-from playwright.sync_api import sync_playwright
-import pyautogui
-import cv2
-import numpy as np
-
-class ATC:
-    def __init__(self):
-        pyautogui.FAILSAFE = False
-        self.log_base = str(LOGS_DIR)
-        self.img_base = str(SCREENSHOTS_DIR)
-        os.makedirs(self.log_base, exist_ok=True)
-        os.makedirs(self.img_base, exist_ok=True)
-        
-        # State persistence
-        self.playwright = None
-        self.browser = None
-        self.context = None
-        self.page = None
-
-    def start_session(self):
-        """Starts a persistent browser session with video recording."""
-        print("🛫 Starting Browser Session with Video Recording...")
-        self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(headless=False)
-        
-        # 動画保存ディレクトリ
-        video_dir = str(VIDEOS_DIR)
-        os.makedirs(video_dir, exist_ok=True)
-        
-        # Contextを作成して動画記録を設定
-        self.context = self.browser.new_context(
-            viewport=VIEWPORT_SIZE,
-            record_video_dir=video_dir,
-            record_video_size=VIEWPORT_SIZE
-        )
-        self.page = self.context.new_page()
-        return self.page
-
-    def stop_session(self):
-        """Ends the browser session and returns video path if available."""
-        print("🛬 Ending Session...")
-        video_path = None
-        
-        # 動画パスはcontext.close()の前に取得する必要がある
-        if self.page and hasattr(self.page, 'video') and self.page.video:
-            try:
-                video_path = self.page.video.path()
-            except Exception:
-                pass
-        
-        if self.context: 
-            self.context.close()  # これで動画ファイルが確定される
-            
-        if video_path:
-            print(f"🎥 Video saved to: {video_path}")
-            
-        if self.page: 
-            try:
-                self.page.close()
-            except Exception:
-                pass
-        if self.browser: self.browser.close()
-        if self.playwright: self.playwright.stop()
-        
-        self.page = None
-        self.context = None
-        self.browser = None
-        self.playwright = None
-        
-        return video_path
-
-    def nav(self, url):
-        """Navigates to a URL."""
-        if not self.page: self.start_session()
-        print(f"🧭 Navigating to: {url}")
-        self.page.goto(url)
-        # self.page.wait_for_load_state("networkidle") # Optional
-
-    def type_text(self, selector, text):
-        """Types text into an element."""
-        if not self.page: raise Exception("No active session")
-        print(f"⌨️ Typing '{text}' into {selector}")
-        self.page.fill(selector, text)
-
-    def press_key(self, key):
-        """Presses a specific key (e.g., 'Enter', 'Tab')."""
-        if not self.page: raise Exception("No active session")
-        print(f"🎹 Pressing Key: '{key}'")
-        self.page.keyboard.press(key)
-
-    def read_screen(self, instruction):
-        """Reads information from the screen using Vision."""
-        if not self.page: raise Exception("No active session")
-        print(f"👁️📄 Vision Reading: '{instruction}'")
-        
-        # Snapshot
-        timestamp = int(time.time())
-        img_path = f"{self.img_base}/read_{timestamp}.png"
-        self.page.screenshot(path=img_path)
-        
-        # LLM
-        from src.llm_core import VisionCore
-        vision = VisionCore()
-        answer = vision.ask_about_image(img_path, instruction)
-        
-        print(f"    📝 Answer: {answer}")
-        
-        # Save to a file for the user to see
-        with open("/workspaces/Airport/results/extracted_info.txt", "a") as f:
-            f.write(f"[{time.ctime()}] Q: {instruction} -> A: {answer}\n")
-            
-        return answer
-
-    def type_text_vision(self, instruction, text):
-        """Types text using Vision to find the field."""
-        if not self.page: raise Exception("No active session")
-        
-        print(f"👁️⌨️ Vision Typing: '{text}' -> Target: '{instruction}'")
-        
-        # Reuse click logic to focus the element
-        result = self.click(mode="llm", instruction=instruction)
-        
-        if result["result"] == "Executed":
-            # Once clicked/focused, type the text
-            time.sleep(0.5)
-            # Use insert_text for reliability in headless/no-ime envs
-            self.page.keyboard.insert_text(text)
-            print(f"    ↳ Typed (Inserted): {text}")
-
-    def click(self, selector=None, mode="hybrid", instruction=None):
-        """Clicks an element using the specified mode."""
-        if not self.page: raise Exception("No active session")
-        
-        page = self.page
-        log_entry = {"task": "click", "mode": mode, "timestamp": int(time.time())}
-        
-        # Snapshot name
-        timestamp = int(time.time())
-        pre_shot = f"{self.img_base}/pre_{timestamp}.png"
-        page.screenshot(path=pre_shot)
-
-        target_x, target_y = 0, 0
-        
-        # LLM Mode
-        if mode == "llm":
-            from src.llm_core import VisionCore
-            print(f"Mode: LLM Vision -> Instruction: '{instruction}'")
-            vision = VisionCore()
-            vx, vy, vconf = vision.analyze_image(pre_shot, instruction)
-            if vx is None: raise Exception("LLM failed")
-            target_x, target_y = vx, vy
-
-        # DOM / GUI / Hybrid
-        else:
-            if not selector: raise Exception("Selector required for non-LLM modes")
-            try:
-                page.wait_for_selector(selector, timeout=5000)
-                element = page.query_selector(selector)
-                box = element.bounding_box()
-                dom_x = box['x'] + box['width'] / 2
-                dom_y = box['y'] + box['height'] / 2
-                target_x, target_y = dom_x, dom_y
-                
-                if mode in ["gui", "hybrid"]:
-                    # Visual check logic (Simplified for brevity)
-                    gui_x, gui_y, conf = self.find_element_visually(page, element)
-                    if conf > 0.8: target_x, target_y = gui_x, gui_y
-            except Exception as e:
-                print(f"DOM/Wait Error: {e}")
-                if mode == "hybrid": raise # Hybrid implies DOM dependency currently
-                # In future: Fallback to full screen search if DOM fails?
-
-        # Execute Click
-        print(f"🖱️ Clicking at ({target_x}, {target_y})")
-        # Visual feedback with mouse move
-        page.mouse.move(target_x, target_y, steps=5) 
-        time.sleep(0.2)
-        
-        # Use page.mouse.click which is lower level and usually works better for coords
-        page.mouse.click(target_x, target_y)
-        
-        # Consider adding a second click if the first one might have missed focus?
-        # frame.click() might be safer if we had the element handle, but here we use coords.
-        
-        # Post-action snapshot
-        time.sleep(1)
-        post_shot = f"{self.img_base}/post_{timestamp}.png"
-        page.screenshot(path=post_shot)
-        
-        return {"result": "Executed", "coords": (target_x, target_y)}
-
-    # --- CLI互換性のためのラッパー ---
-    def execute_task(self, url, selector=None, mode="hybrid", instruction=None):
-        try:
-            self.start_session()
-            self.nav(url)
-            result = self.click(selector, mode, instruction)
-            
-            # Simple success check for CLI
-            verify_selector = selector if mode != "llm" else "body"
-            # start_url handling is tricky in split methods, simplified here
-            is_success = True # Assume success if no error raised
-            
-            final_result = {
-                "result": "Success" if is_success else "Failed",
-                "screenshot_pre": f"{self.img_base}/pre_{int(time.time())}.png", # Approximate
-                "screenshot_post": f"{self.img_base}/post_{int(time.time())}.png"
-            }
-            return final_result
-            
-        except Exception as e:
-            return {"result": "Error", "error_message": str(e)}
-        finally:
-            self.stop_session()
-
-    def verify_action(self, page, old_selector, start_url):
-        # URLが遷移していれば成功とみなす
-        if page.url != start_url:
-            return True
-        # URLが変わっていない場合は、要素が消えたかどうかで判定
-        return not page.is_visible(old_selector, timeout=2000)
-
-    def find_element_visually(self, page, element):
-        """
-        DOM要素のスクリーンショットを撮り、画面全体の中からその位置をOpenCVで特定する
-        """
-        # 1. ターゲット要素の画像をメモリ上に取得 (テンプレート)
-        element_bytes = element.screenshot()
-        element_arr = np.frombuffer(element_bytes, np.uint8)
-        template = cv2.imdecode(element_arr, cv2.IMREAD_COLOR)
-
-        # 2. 現在の画面全体の画像をメモリ上に取得
-        screen_bytes = page.screenshot()
-        screen_arr = np.frombuffer(screen_bytes, np.uint8)
-        screen = cv2.imdecode(screen_arr, cv2.IMREAD_COLOR)
-
-        # 3. テンプレートマッチング実行
-        result = cv2.matchTemplate(screen, template, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
-
-        # 4. 中心座標を計算
-        top_left = max_loc
-        h, w, _ = template.shape
-        center_x = top_left[0] + w / 2
-        center_y = top_left[1] + h / 2
-
-        return center_x, center_y, max_val
-
-    def record_black_box(self, data, timestamp):
-        filename = f"{self.log_base}/flight_record_{timestamp}.json"
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=4)
-        print(f"Black Box updated: {filename}")
-
-import argparse
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Airport ATC: Autonomous Flight Controller")
-    parser.add_argument("--url", default="https://example.com", help="Target URL")
-    parser.add_argument("--selector", default=None, help="Target CSS selector")
-    parser.add_argument("--mode", choices=["dom", "gui", "hybrid", "llm"], default="hybrid", help="Operation mode: dom, gui, hybrid, or llm")
-    parser.add_argument("--instruction", help="Instruction for LLM mode (e.g. 'Click the login button')")
-    
-    args = parser.parse_args()
-    
-    # LLMモード以外ではselectorが必須（またはデフォルト値）
-    if args.mode != "llm" and not args.selector:
-        args.selector = "a" # Legacy default
-
-    print(f"--- Mission Start ---")
-    print(f"Target: {args.url}")
-    print(f"Selector: {args.selector}")
-    print(f"Mode: {args.mode}")
-    if args.instruction:
-        print(f"Instruction: {args.instruction}")
-    print(f"---------------------")
-
-    atc = ATC()
-    result = atc.execute_task(args.url, args.selector, args.mode, args.instruction)
-    
-    print("\n" + "="*30)
-    print("      MISSION REPORT      ")
-    print("="*30)
-    
-    status = result.get('result')
-    
-    # ANSI Colors
-    GREEN = '\033[92m'
-    RED = '\033[91m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
-
-    if status == "Success":
-        print(f"{GREEN}{BOLD}    [ SUCCESS ]{RESET}")
-        print(f"    Target acquired and executed.")
-    else:
-        print(f"{RED}{BOLD}    [ FAILED ]{RESET}")
-        if status == "Error":
-             print(f"    Error: {result.get('error_message')}")
-        else:
-             print(f"    Action verification failed.")
-
-    print("-"*30)
-    print(f"Log File : {atc.log_base}/flight_record_{int(time.time())}.json")
-    print(f"Pre-Shot : {result.get('screenshot_pre')}")
-    print(f"Post-Shot: {result.get('screenshot_post')}")
+import io
+import os
+import re
+import time
+import shutil
+import tempfile
+import fnmatch
+import subprocess
+import json
+from dotenv import load_dotenv
+
+from src.browsing import BROWSING_PROFILES, BrowsingGuard
+from src.config import (
+    BROWSING_PROFILE, DISPLAY, EXECUTION_PROFILE, HEADLESS, LOGS_DIR, PROFILE_STORE_ENABLED, RESULTS_DIR,
+    SCREENSHOTS_DIR, SITE_KNOWLEDGE_ENABLED, VIDEOS_DIR, VIEWPORT_SIZE,
+)
+from src.metrics import phase, site_of
+from src.mission_compiler import dhash, hamming
+from src.profile_store import PROFILE_STORE, masked
+from src.site_knowledge import SITE_KNOWLEDGE
+
+load_dotenv()
+
+# --- Airport 自律起動フェーズ ---
+def ensure_display():
+    display = DISPLAY
+    try:
+        subprocess.run(["xdpyinfo", "-display", display], 
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    except Exception:
+        print(f"Display {display} not found. Starting Xvfb...")
+        subprocess.Popen(["Xvfb", display, "-ac", "-screen", "0", "1280x720x24"])
+        time.sleep(2)
+
+ensure_display()
+
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+import pyautogui
+from src.template_matcher import TEMPLATE_MATCHER
+
+# 要素の意味的な記述子（タグ・テキスト・属性・CSSパス）。座標が変わっても同じ要素を再特定するために使う
+_DESCRIBE_ELEMENT_JS = """
+([x, y, focused]) => {
+    let el = focused ? document.activeElement : document.elementFromPoint(x, y);
+    if (!el || el === document.body || el === document.documentElement) return null;
+    el = el.closest('a,button,input,textarea,select,label,summary,[role],[onclick],[tabindex]') || el;
+    const cssPath = (node) => {
+        const parts = [];
+        while (node && node.nodeType === 1 && node !== document.body) {
+            if (node.id) { parts.unshift('#' + CSS.escape(node.id)); break; }
+            let index = 1, sibling = node;
+            while ((sibling = sibling.previousElementSibling)) if (sibling.tagName === node.tagName) index++;
+            parts.unshift(node.tagName.toLowerCase() + ':nth-of-type(' + index + ')');
+            node = node.parentElement;
+        }
+        return parts.join(' > ');
+    };
+    const box = el.getBoundingClientRect();
+    return {
+        tag: el.tagName.toLowerCase(),
+        id: el.id || null,
+        name: el.getAttribute('name'),
+        type: el.getAttribute('type'),
+        role: el.getAttribute('role'),
+        text: (el.innerText || el.value || '').trim().replace(/\\s+/g, ' ').slice(0, 80),
+        aria_label: el.getAttribute('aria-label'),
+        placeholder: el.getAttribute('placeholder'),
+        href: el.getAttribute('href'),
+        css: cssPath(el),
+        box: {x: box.x, y: box.y, width: box.width, height: box.height},
+    };
+}
+"""
+
+# 記述子から要素を探し、表示中なら中心座標を返す（id → CSSパス → 属性/テキストの順）
+_LOCATE_ELEMENT_JS = """
+(d) => {
+    const visible = (el) => {
+        if (!el) return null;
+        const box = el.getBoundingClientRect();
+        if (box.width <= 0 || box.height <= 0) return null;
+        return {x: box.x + box.width / 2, y: box.y + box.height / 2};
+    };
+    const text = (el) => (el.innerText || el.value || '').trim().replace(/\\s+/g, ' ').slice(0, 80);
+    const same = (el) => el && el.tagName.toLowerCase() === d.tag && (!d.text || text(el) === d.text);
+    if (d.id) {
+        const el = document.getElementById(d.id);
+        const point = same(el) && visible(el);
+        if (point) return {...point, strategy: 'id'};
+    }
+    if (d.css) {
+        try {
+            const el = document.querySelector(d.css);
+            const point = same(el) && visible(el);
+            if (point) return {...point, strategy: 'css'};
+        } catch (e) {}
+    }
+    for (const el of document.querySelectorAll(d.tag)) {
+        const matches =
+            (d.aria_label && el.getAttribute('aria-label') === d.aria_label) ||
+            (d.name && el.getAttribute('name') === d.name) ||
+            (d.placeholder && el.getAttribute('placeholder') === d.placeholder) ||
+            (d.text && text(el) === d.text && (!d.href || el.getAttribute('href') === d.href));
+        const point = matches && visible(el);
+        if (point) return {...point, strategy: 'attributes'};
+    }
+    return null;
+}
+"""
+
+# DOM の変化が quietMs 続けて止まり、読み込みが完了するまで待つ（timeoutMs で打ち切り）
+_WAIT_FOR_SETTLE_JS = """
+([quietMs, timeoutMs]) => new Promise((resolve) => {
+    const start = performance.now();
+    let last = start;
+    const observer = new MutationObserver(() => { last = performance.now(); });
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    const tick = () => {
+        const now = performance.now();
+        const settled = document.readyState === 'complete' && now - last >= quietMs;
+        if (settled || now - start >= timeoutMs) {
+            observer.disconnect();
+            resolve(settled);
+        } else {
+            setTimeout(tick, 50);
+        }
+    };
+    tick();
+})
+"""
+
+# ページのテキストに text が含まれるか
+_HAS_TEXT_JS = "(text) => !!document.body && document.body.innerText.includes(text)"
+
+# ATC.wait_for の条件（この順に確かめる）
+WAIT_CONDITIONS = ("load_state", "network_idle", "url", "selector", "text", "settle", "stable", "vision")
+DEFAULT_WAIT_TIMEOUT = 10.0
+SELECTOR_WAIT = 1.5      # コンパイル済みセレクタが要素に当たるのを待つ最大秒数（外れたら Vision に戻る）
+STABLE_FRAMES = 3        # この枚数続けて画面が同じなら「安定」
+STABLE_TOLERANCE = 2     # dHash の差がこのビット数以下なら同じ画面
+
+# ATC.click の実行プロファイル
+#   pre_shot / post_shot - クリック前後のスクリーンショットを証跡として残すか
+#                          （前の画面はグラウンディング・見た目の確認に必要なときだけ撮り、撮った 1 枚を共有する）
+#   animate              - マウスを動かして見せてからクリックするか（ライブで見るとき用）
+#   settle               - クリック後の待ち: "dom" = DOM が落ち着いたら進む（サイト知識があればその学習値まで）、
+#                          "knowledge" = サイト知識があれば "dom"、無ければ固定の 1 秒
+EXECUTION_PROFILES = {
+    "fast": {"pre_shot": False, "post_shot": False, "animate": False, "settle": "dom"},
+    "audit": {"pre_shot": True, "post_shot": True, "animate": False, "settle": "dom"},
+    "debug": {"pre_shot": True, "post_shot": True, "animate": True, "settle": "knowledge"},
+}
+
+class WaitTimeout(TimeoutError):
+    """A wait_for condition did not hold within its timeout."""
+
+def _poll_intervals(poll):
+    """Sleep intervals of a poll strategy: a number = every N seconds, "backoff" = 0.1s growing ×1.5 up to 2s."""
+    if poll == "backoff":
+        interval = 0.1
+        while True:
+            yield interval
+            interval = min(2.0, interval * 1.5)
+    while True:
+        yield float(poll)
+
+def _url_matcher(pattern):
+    """"re:<regex>" / glob (contains "*") / substring → a predicate for page.wait_for_url."""
+    if pattern.startswith("re:"):
+        regex = re.compile(pattern[3:])
+        return lambda url: bool(regex.search(url))
+    if "*" in pattern:
+        return lambda url: fnmatch.fnmatch(url, pattern)
+    return lambda url: pattern in url
+
+def _wanted_conditions(conditions):
+    """The wait_for conditions to check, in WAIT_CONDITIONS order: [(name, value)]. ValueError for bad conditions."""
+    unknown = set(conditions) - set(WAIT_CONDITIONS)
+    if unknown:
+        raise ValueError(f"Unknown wait condition(s): {', '.join(sorted(unknown))}")
+    wanted = [(name, conditions[name]) for name in WAIT_CONDITIONS if conditions.get(name) not in (None, False)]
+    if not wanted:
+        raise ValueError("wait_for needs at least one condition")
+    return wanted
+
+def _load_state(name, value):
+    """The Playwright load state of a load_state / network_idle condition."""
+    return "networkidle" if name == "network_idle" else value
+
+# 条件ごとのポーリング間隔の既定値（text はブラウザ側の待機が遷移で中断されたときだけポーリングする）
+CONDITION_POLL = {"text": 0.1, "stable": 0.25, "vision": 2.0}
+
+def _stable_frame(frames, frame):
+    """Adds a dHash to the frames of a `stable` wait; True once STABLE_FRAMES in a row are (nearly) the same."""
+    if frames and hamming(frames[-1], frame) > STABLE_TOLERANCE:
+        frames.clear()
+    frames.append(frame)
+    return len(frames) >= STABLE_FRAMES
+
+def _box_center(box):
+    return box["x"] + box["width"] / 2, box["y"] + box["height"] / 2
+
+def _visual_target(target, candidates):
+    """The click point of a DOM element: its best visual match when confident, else the DOM centre `target`."""
+    if candidates and candidates[0]["confidence"] > 0.8:
+        return candidates[0]["x"], candidates[0]["y"]
+    return target
+
+class _ATCCommon:
+    """
+    The engine-independent part of ATC and AsyncATC (src.async_atc): the session settings and the decisions of
+    click / wait_for / settle. The engines only differ in the Playwright calls (direct or awaited).
+    """
+
+    def set_profile(self, profile):
+        """Selects the execution profile (fast / audit / debug) of click()."""
+        if profile not in EXECUTION_PROFILES:
+            raise ValueError(f"Unknown execution profile '{profile}' (expected one of {', '.join(EXECUTION_PROFILES)})")
+        self.profile = profile
+
+    def set_browsing(self, browsing):
+        """Selects the browsing profile (full / lite / text) of the next start_session()."""
+        if browsing not in BROWSING_PROFILES:
+            raise ValueError(f"Unknown browsing profile '{browsing}' (expected one of {', '.join(BROWSING_PROFILES)})")
+        self.browsing = browsing
+
+    def network_usage(self):
+        """Requests blocked by the browsing profile since the last call (see BrowsingGuard.take), or None."""
+        return self.guard.take() if self.guard else None
+
+    def _shot_path(self, prefix, timestamp=None):
+        return f"{self.img_base}/{prefix}_{timestamp or int(time.time() * 1000)}.png"
+
+    def _record_answer(self, instruction, answer):
+        """read_screen の答えをユーザーが見られるファイルに残す"""
+        print(f"    📝 Answer: {answer}")
+        with open(str(RESULTS_DIR / "extracted_info.txt"), "a") as f:
+            f.write(f"[{time.ctime()}] Q: {instruction} -> A: {answer}\n")
+
+    # ---- click ----
+    def _click_options(self, profile):
+        return EXECUTION_PROFILES[profile or self.profile]
+
+    @staticmethod
+    def _keeps_pre_shot(options, for_vision):
+        """Whether the pre-click frame is written to a file (as evidence, or for Vision which reads files)."""
+        return bool(options["pre_shot"] or for_vision)
+
+    @staticmethod
+    def _resolved_without_vision(instruction, located, known):
+        """The resolved fields of a click target found by a compiled selector or (known=True) by site knowledge."""
+        if known:
+            print(f"Mode: Site Knowledge -> '{instruction}' ({located['strategy']})")
+            return {"resolved": "knowledge"}
+        print(f"Mode: Compiled Selector -> '{instruction}' ({located['selector']})")
+        return {"resolved": "selector", "selector": located["selector"]}
+
+    @staticmethod
+    def _vision_mode(instruction, grounded):
+        label = "LLM Vision (look-ahead)" if grounded else "LLM Vision"
+        print(f"Mode: {label} -> Instruction: '{instruction}'")
+
+    @staticmethod
+    def _vision_target(point):
+        vx, vy, _ = point
+        if vx is None: raise Exception("LLM failed")
+        return vx, vy
+
+    def _resolved_by_vision(self, site, instruction, element):
+        """The resolved fields of a Vision click; the element it hit is learned as site knowledge."""
+        if SITE_KNOWLEDGE_ENABLED and element:
+            self._learn_element(site, instruction, element)
+        return {"resolved": "vision", "element": element}
+
+    @staticmethod
+    def _click_result(target, frame, post_shot, resolved):
+        return {"result": "Executed", "coords": target, "pre_shot": frame.get("path"), "post_shot": post_shot,
+                **resolved}
+
+    # ---- site knowledge ----
+    def _known_element(self, site, instruction):
+        return SITE_KNOWLEDGE.locator(site, instruction) if SITE_KNOWLEDGE_ENABLED else None
+
+    def _report_known(self, site, instruction, located):
+        """既知の要素が見つかったかをサイト知識に返す（見つからなければ失敗として報告）"""
+        SITE_KNOWLEDGE.report(site, "locator", instruction, bool(located))
+        if located:
+            self.used_knowledge.add(site)
+        return located
+
+    def _learn_element(self, site, instruction, element):
+        try:
+            SITE_KNOWLEDGE.learn_locator(site, instruction, element)
+        except Exception as e:
+            print(f"⚠️ Site Knowledge Error: {e}")
+
+    # ---- settle / wait_for ----
+    def _settle_mode(self, use_knowledge, on_settled, fixed):
+        """
+        How settle() waits: "knowledge" (up to the site's learned settle time), "dom" (until the DOM is quiet,
+        at most `default`; then the rest of a fixed wait) or "sleep" (a fixed `default` second sleep).
+        """
+        use_knowledge = SITE_KNOWLEDGE_ENABLED if use_knowledge is None else use_knowledge
+        if self.page and use_knowledge:
+            return "knowledge"
+        if self.page and (on_settled or not fixed):
+            return "dom"
+        return "sleep"
+
+    def _settle_budget(self, action, default):
+        site = site_of(self.page.url)
+        return site, SITE_KNOWLEDGE.settle_time(site, action, default)
+
+    @staticmethod
+    def _ready(started, wanted):
+        elapsed = time.time() - started
+        print(f"    ⏳ Ready after {elapsed:.2f}s ({', '.join(name for name, _ in wanted)})")
+        return elapsed
+
+class ATC(_ATCCommon):
+    def __init__(self, profile=None, browsing=None):
+        pyautogui.FAILSAFE = False
+        self.profile = None
+        self.set_profile(profile or EXECUTION_PROFILE)
+        self.browsing = None
+        self.set_browsing(browsing or BROWSING_PROFILE)
+        self.guard = None  # 現在のコンテキストの BrowsingGuard
+        # 共有の HTTP キャッシュ（src.profile_store）を使えるときは永続コンテキストでセッションを開く
+        self.shared_cache = PROFILE_STORE_ENABLED
+        self._user_data_dir = None
+        self.log_base = str(LOGS_DIR)
+        self.img_base = str(SCREENSHOTS_DIR)
+        os.makedirs(self.log_base, exist_ok=True)
+        os.makedirs(self.img_base, exist_ok=True)
+        
+        # State persistence
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.page = None
+        
+        # このセッションでサイト知識（既知の要素）を使ったサイト
+        self.used_knowledge = set()
+
+    def start_session(self):
+        """
+        Starts a persistent browser session with video recording.
+        If the browser was kept by stop_session(keep_browser=True), only a fresh context is opened.
+        With shared_cache (AIRPORT_PROFILE_STORE) the context is a persistent one on a throwaway user data directory
+        whose HTTP disk cache is shared between sessions, when no other session holds it.
+        """
+        print("🛫 Starting Browser Session with Video Recording...")
+        if not self.playwright:
+            self.playwright = sync_playwright().start()
+        
+        # 動画保存ディレクトリ
+        video_dir = str(VIDEOS_DIR)
+        os.makedirs(video_dir, exist_ok=True)
+        
+        # Contextを作成して動画記録を設定
+        guard = BrowsingGuard(self.browsing)
+        options = dict(viewport=VIEWPORT_SIZE, record_video_dir=video_dir, record_video_size=VIEWPORT_SIZE,
+                       **guard.context_options())
+        # リクエストをルーティングするプロファイルでは HTTP キャッシュが使われないので共有しない
+        cache_dir = PROFILE_STORE.acquire_cache() if self.shared_cache and not guard.routes else None
+        if cache_dir:
+            self._user_data_dir = tempfile.mkdtemp(prefix="airport-profile-")
+            try:
+                self.context = self.playwright.chromium.launch_persistent_context(
+                    self._user_data_dir, headless=HEADLESS, args=[f"--disk-cache-dir={cache_dir}"], **options
+                )
+            except Exception:
+                self._release_profile()
+                raise
+            print("   🗄️ Using the shared HTTP cache")
+        else:
+            if not self.browser:
+                self.browser = self.playwright.chromium.launch(headless=HEADLESS)
+            self.context = self.browser.new_context(**options)
+        guard.install(self.context)
+        self.guard = guard
+        self.page = self.context.pages[0] if cache_dir and self.context.pages else self.context.new_page()
+        return self.page
+
+    def _release_profile(self):
+        """Releases the shared HTTP cache and removes the session's throwaway user data directory."""
+        if self._user_data_dir:
+            PROFILE_STORE.release_cache()
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
+            self._user_data_dir = None
+
+    def stop_session(self, keep_browser=False):
+        """
+        Ends the browser session and returns video path if available.
+        keep_browser: closes only the context (cookies, storage, video) and keeps the browser for the next session.
+        """
+        print("🛬 Ending Session...")
+        video_path = None
+        
+        # 動画パスはcontext.close()の前に取得する必要がある
+        if self.page and hasattr(self.page, 'video') and self.page.video:
+            try:
+                video_path = self.page.video.path()
+            except Exception:
+                pass
+        
+        if self.context: 
+            self.context.close()  # これで動画ファイルが確定される
+        self._release_profile()
+        SITE_KNOWLEDGE.flush_settle()
+            
+        if video_path:
+            print(f"🎥 Video saved to: {video_path}")
+            
+        if self.page: 
+            try:
+                self.page.close()
+            except Exception:
+                pass
+        self.page = None
+        self.context = None
+        if keep_browser:
+            return video_path
+        
+        if self.browser: self.browser.close()
+        if self.playwright: self.playwright.stop()
+        
+        self.browser = None
+        self.playwright = None
+        
+        return video_path
+
+    def nav(self, url, wait_until=None):
+        """Navigates to a URL. wait_until: load state to wait for (load / domcontentloaded / networkidle / commit)."""
+        if not self.page: self.start_session()
+        print(f"🧭 Navigating to: {url}")
+        if wait_until:
+            self.page.goto(url, wait_until=wait_until)
+        else:
+            self.page.goto(url)
+
+    def type_text(self, selector, text):
+        """Types text into an element."""
+        if not self.page: raise Exception("No active session")
+        print(f"⌨️ Typing '{masked(selector, text)}' into {selector}")
+        self.page.fill(selector, text)
+
+    def press_key(self, key):
+        """Presses a specific key (e.g., 'Enter', 'Tab')."""
+        if not self.page: raise Exception("No active session")
+        print(f"🎹 Pressing Key: '{key}'")
+        self.page.keyboard.press(key)
+
+    def read_screen(self, instruction):
+        """Reads information from the screen using Vision."""
+        if not self.page: raise Exception("No active session")
+        print(f"👁️📄 Vision Reading: '{instruction}'")
+        
+        # Snapshot
+        img_path = self._shot_path("read")
+        with phase("capture"):
+            self.page.screenshot(path=img_path)
+        
+        # LLM
+        from src.llm_core import VisionCore
+        vision = VisionCore()
+        answer = vision.ask_about_image(img_path, instruction)
+        
+        # Save to a file for the user to see
+        self._record_answer(instruction, answer)
+        return answer
+
+    def type_text_vision(self, instruction, text, selectors=None, grounded=None):
+        """
+        Types text using Vision to find the field (or one of `selectors` / the `grounded` point, see click).
+        Returns the click result (None if the click was not executed).
+        """
+        if not self.page: raise Exception("No active session")
+        
+        print(f"👁️⌨️ Vision Typing: '{masked(instruction, text)}' -> Target: '{instruction}'")
+        
+        # Reuse click logic to focus the element
+        result = self.click(mode="llm", instruction=instruction, selectors=selectors, grounded=grounded)
+        
+        if result["result"] == "Executed":
+            # Once clicked/focused, type the text
+            with phase("settle"):
+                time.sleep(0.5)
+            # Use insert_text for reliability in headless/no-ime envs
+            self.page.keyboard.insert_text(text)
+            print(f"    ↳ Typed (Inserted): {masked(instruction, text)}")
+            return result
+
+    def click(self, selector=None, mode="hybrid", instruction=None, profile=None, selectors=None, grounded=None):
+        """
+        Clicks an element using the specified mode.
+        profile: execution profile for this click (default: the ATC's, see EXECUTION_PROFILES).
+        selectors: llm mode - compiled selectors (src.plan_compiler) tried before site knowledge and Vision.
+        grounded: llm mode - (x, y, confidence) already grounded on the current screen (src.lookahead), used instead of Vision.
+        Returns {"result", "coords", "pre_shot", "post_shot"} (screenshot paths are None when not kept),
+        in llm mode also "resolved" ("selector" / "knowledge" / "vision"), "selector" (the one that hit)
+        and "element" (descriptor of the element Vision hit, for re-healing the selectors).
+        """
+        if not self.page: raise Exception("No active session")
+        
+        page = self.page
+        options = self._click_options(profile)
+        
+        # Snapshot name
+        timestamp = int(time.time() * 1000)
+        pre_shot = self._shot_path("pre", timestamp)
+        frame = {}
+
+        def capture_pre(for_vision=False):
+            """クリック前の画面を 1 回だけ撮り、グラウンディング・見た目の確認・証跡で共有する"""
+            if "png" not in frame:
+                keep = self._keeps_pre_shot(options, for_vision)
+                with phase("capture"):
+                    frame["png"] = page.screenshot(path=pre_shot if keep else None)
+                frame["path"] = pre_shot if keep else None
+            return frame["png"]
+
+        target_x, target_y = 0, 0
+        resolved = {}
+        
+        # LLM Mode
+        if mode == "llm":
+            site = site_of(page.url)
+            located = self.locate_selectors(selectors) if selectors else None
+            known = not located
+            if known:
+                located = self._locate_known(site, instruction)
+            if located:
+                target_x, target_y = located["x"], located["y"]
+                resolved = self._resolved_without_vision(instruction, located, known)
+            else:
+                self._vision_mode(instruction, grounded)
+                if grounded:
+                    point = grounded
+                else:
+                    from src.llm_core import VisionCore
+                    vision = VisionCore()
+                    capture_pre(for_vision=True)
+                    point = vision.analyze_image(pre_shot, instruction)
+                target_x, target_y = self._vision_target(point)
+                # 当たった要素（クリックで遷移する前に記述する）: サイト知識とプランのセレクタの学習に使う
+                element = self._describe_safely(target_x, target_y)
+                resolved = self._resolved_by_vision(site, instruction, element)
+
+        # DOM / GUI / Hybrid
+        else:
+            if not selector: raise Exception("Selector required for non-LLM modes")
+            try:
+                page.wait_for_selector(selector, timeout=5000)
+                element = page.query_selector(selector)
+                box = element.bounding_box()
+                target_x, target_y = _box_center(box)
+                
+                if mode in ["gui", "hybrid"]:
+                    # Visual check logic (Simplified for brevity)
+                    candidates = self.match_element(
+                        page, element, screen_png=capture_pre(), key=(site_of(page.url), selector), box=box)
+                    target_x, target_y = _visual_target((target_x, target_y), candidates)
+            except Exception as e:
+                print(f"DOM/Wait Error: {e}")
+                if mode == "hybrid": raise # Hybrid implies DOM dependency currently
+                # In future: Fallback to full screen search if DOM fails?
+
+        if options["pre_shot"]:
+            capture_pre()
+
+        # Execute Click
+        print(f"🖱️ Clicking at ({target_x}, {target_y})")
+        if options["animate"]:
+            # Visual feedback with mouse move
+            page.mouse.move(target_x, target_y, steps=5) 
+            with phase("settle"):
+                time.sleep(0.2)
+        
+        # Use page.mouse.click which is lower level and usually works better for coords
+        page.mouse.click(target_x, target_y)
+        
+        # Consider adding a second click if the first one might have missed focus?
+        # frame.click() might be safer if we had the element handle, but here we use coords.
+        
+        # Post-action snapshot
+        self.settle("click", 1.0, fixed=options["settle"] != "dom")
+        post_shot = None
+        if options["post_shot"]:
+            post_shot = self._shot_path("post", timestamp)
+            with phase("capture"):
+                page.screenshot(path=post_shot)
+        
+        return self._click_result((target_x, target_y), frame, post_shot, resolved)
+
+    def locate_selectors(self, selectors, timeout=SELECTOR_WAIT):
+        """
+        The first of `selectors` that matches exactly one visible element → {"x", "y", "selector"} (its centre).
+        Polls for up to `timeout` seconds (the element may still be rendering); None if every selector misses.
+        """
+        if not self.page or not selectors: return None
+        deadline = time.time() + timeout
+        while True:
+            for selector in selectors:
+                try:
+                    locator = self.page.locator(selector)
+                    if locator.count() != 1:
+                        continue
+                    box = locator.bounding_box(timeout=500)
+                except Exception:
+                    continue  # 不正なセレクタ・遷移中など
+                if box and box["width"] > 0 and box["height"] > 0:
+                    x, y = _box_center(box)
+                    return {"x": x, "y": y, "selector": selector}
+            if time.time() >= deadline:
+                print(f"    🩹 No compiled selector matched ({len(selectors)} tried)")
+                return None
+            time.sleep(0.1)
+
+    def _describe_safely(self, x, y):
+        try:
+            return self.describe_element_at(x, y)
+        except Exception as e:
+            print(f"⚠️ Describe Element Error: {e}")
+            return None
+
+    def _locate_known(self, site, instruction):
+        """サイト知識に安定した要素があれば、その現在の中心座標を返す（見つからなければ失敗として報告）"""
+        element = self._known_element(site, instruction)
+        if not element:
+            return None
+        return self._report_known(site, instruction, self.locate_element(element))
+
+    def wait_for_settle(self, timeout, quiet=0.5):
+        """
+        Waits until the DOM has been quiet for `quiet` seconds and the page is loaded, at most `timeout`.
+        Returns (elapsed_seconds, settled).
+        """
+        started = time.time()
+        while True:
+            remaining = timeout - (time.time() - started)
+            if remaining <= 0:
+                return time.time() - started, False
+            try:
+                settled = self.page.evaluate(_WAIT_FOR_SETTLE_JS, [quiet * 1000, remaining * 1000])
+                return time.time() - started, bool(settled)
+            except Exception:
+                # 待機中にページ遷移するとコンテキストが破棄されるので、読み込みを待ってやり直す
+                try:
+                    self.page.wait_for_load_state("load", timeout=max(1, remaining * 1000))
+                except Exception:
+                    return time.time() - started, False
+
+    def wait_for(self, timeout=DEFAULT_WAIT_TIMEOUT, poll=None, state=None, **conditions):
+        """
+        Waits until every given condition holds (checked in order, sharing `timeout` seconds) and returns the elapsed seconds.
+        Conditions:
+            load_state="load"     読み込み状態 (load / domcontentloaded / networkidle)
+            network_idle=True     通信が 500ms 止まる
+            url="..."             URL が一致する ("re:<regex>"、"*" を含めば glob、それ以外は部分一致)
+            selector="css"        要素が表示される (state="attached" / "hidden" / "detached" も可)
+            text="..."            ページのテキストに含まれる
+            settle=True           DOM の変化が止まり読み込みが完了する (wait_for_settle)
+            stable=True           画面（スクリーンショット）が変わらなくなる
+            vision="..."          Vision モデルが画面について「はい」と答える
+        poll: None = the browser waits for load_state / network_idle / url / selector itself and checks text on
+              every animation frame; a number = check every N seconds; "backoff" = 0.1s growing ×1.5 up to 2s.
+              stable / vision always poll (default every 0.25s / 2s).
+        Raises WaitTimeout naming the first condition that did not hold.
+        """
+        if not self.page: raise Exception("No active session")
+        wanted = _wanted_conditions(conditions)
+        
+        started = time.time()
+        deadline = started + timeout
+        with phase("settle"):
+            for name, value in wanted:
+                if not self._wait_condition(name, value, deadline, poll, state):
+                    raise WaitTimeout(f"Timed out after {timeout}s waiting for {name}={value!r}")
+        return self._ready(started, wanted)
+
+    def _wait_condition(self, name, value, deadline, poll, state=None):
+        page = self.page
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        ms = max(1, remaining * 1000)
+        try:
+            if name in ("load_state", "network_idle"):
+                page.wait_for_load_state(_load_state(name, value), timeout=ms)
+                return True
+            if name == "url":
+                matches = _url_matcher(value)
+                if poll is None:
+                    page.wait_for_url(matches, timeout=ms)
+                    return True
+                return self._poll(lambda: matches(page.url), deadline, poll)
+            if name == "selector":
+                page.wait_for_selector(value, state=state or "visible", timeout=ms)
+                return True
+            if name == "text":
+                if poll is None:
+                    try:
+                        page.wait_for_function(_HAS_TEXT_JS, arg=value, timeout=ms, polling="raf")
+                        return True
+                    except PlaywrightTimeoutError:
+                        return False
+                    except Exception:
+                        pass  # 待機中のページ遷移でコンテキストが破棄された → 残り時間はポーリングで
+                return self._poll(lambda: page.evaluate(_HAS_TEXT_JS, value), deadline, poll or CONDITION_POLL[name])
+            if name == "settle":
+                return self.wait_for_settle(remaining)[1]
+            if name == "stable":
+                return self._wait_stable(deadline, poll or CONDITION_POLL[name])
+            if name == "vision":
+                return self._wait_vision(value, deadline, poll or CONDITION_POLL[name])
+        except PlaywrightTimeoutError:
+            return False
+        return False
+
+    def _poll(self, check, deadline, poll):
+        """Calls check() with the poll strategy's intervals until it returns True or the deadline passes."""
+        for interval in _poll_intervals(poll):
+            try:
+                if check():
+                    return True
+            except Exception:
+                pass  # 遷移中などで確かめられなければ次の回に
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+
+    def _wait_stable(self, deadline, poll):
+        """Screenshots until STABLE_FRAMES consecutive frames have (nearly) the same dHash."""
+        frames = []
+
+        def _check():
+            with phase("capture"):
+                frame = dhash(io.BytesIO(self.page.screenshot()))
+            return _stable_frame(frames, frame)
+
+        return self._poll(_check, deadline, poll)
+
+    def _wait_vision(self, question, deadline, poll):
+        """Asks the Vision model whether `question` holds for the current screen until it says yes."""
+        from src.llm_core import VisionCore
+        vision = VisionCore()
+
+        def _check():
+            img_path = self._shot_path("wait")
+            with phase("capture"):
+                self.page.screenshot(path=img_path)
+            met, confidence = vision.check_condition(img_path, question)
+            print(f"    👁️ '{question}' → {met} ({confidence})")
+            return met
+
+        return self._poll(_check, deadline, poll)
+
+    def settle(self, action, default, use_knowledge=None, on_settled=None, fixed=True):
+        """
+        Waits for the page to settle after `action`, at most the site's learned settle time (else `default`).
+        Without site knowledge this is a fixed `default` second sleep (fixed=False: at most `default`,
+        returning as soon as the DOM is quiet).
+        on_settled: called as soon as the DOM is quiet (e.g. to start the next think early).
+            Without site knowledge the rest of the fixed sleep is still waited afterwards.
+        """
+        mode = self._settle_mode(use_knowledge, on_settled, fixed)
+        if mode == "sleep":
+            with phase("settle"):
+                time.sleep(default)
+            return
+        if mode == "dom":
+            started = time.time()
+            with phase("settle"):
+                _, settled = self.wait_for_settle(default)
+            if settled and on_settled:
+                on_settled()
+            if fixed:
+                with phase("settle"):
+                    time.sleep(max(0.0, default - (time.time() - started)))
+            return
+        site, budget = self._settle_budget(action, default)
+        with phase("settle"):
+            elapsed, settled = self.wait_for_settle(budget)
+        SITE_KNOWLEDGE.observe_settle(site, action, elapsed, settled)
+        if settled and on_settled:
+            on_settled()
+
+    def describe_element_at(self, x, y):
+        """Semantic descriptor of the element at viewport (x, y), or None."""
+        if not self.page: return None
+        return self.page.evaluate(_DESCRIBE_ELEMENT_JS, [x, y, False])
+
+    def describe_focused_element(self):
+        """Semantic descriptor of the focused element, or None."""
+        if not self.page: return None
+        return self.page.evaluate(_DESCRIBE_ELEMENT_JS, [0, 0, True])
+
+    def locate_element(self, descriptor):
+        """Finds the element of a descriptor on the current page. Returns {"x", "y", "strategy"} or None."""
+        if not self.page or not descriptor: return None
+        return self.page.evaluate(_LOCATE_ELEMENT_JS, descriptor)
+
+    # --- CLI互換性のためのラッパー ---
+    def execute_task(self, url, selector=None, mode="hybrid", instruction=None):
+        try:
+            self.start_session()
+            self.nav(url)
+            result = self.click(selector, mode, instruction)
+            
+            # Simple success check for CLI
+            verify_selector = selector if mode != "llm" else "body"
+            # start_url handling is tricky in split methods, simplified here
+            is_success = True # Assume success if no error raised
+            
+            final_result = {
+                "result": "Success" if is_success else "Failed",
+                "screenshot_pre": result["pre_shot"],
+                "screenshot_post": result["post_shot"]
+            }
+            return final_result
+            
+        except Exception as e:
+            return {"result": "Error", "error_message": str(e)}
+        finally:
+            self.stop_session()
+
+    def verify_action(self, page, old_selector, start_url):
+        # URLが遷移していれば成功とみなす
+        if page.url != start_url:
+            return True
+        # URLが変わっていない場合は、要素が消えたかどうかで判定
+        return not page.is_visible(old_selector, timeout=2000)
+
+    def find_element_visually(self, page, element, screen_png=None, key=None, box=None):
+        """
+        DOM要素の見た目を画面の中からOpenCVで特定する。(x, y, confidence) を返す（見つからなければ (None, None, 0.0)）
+        screen_png: 撮影済みの画面全体 (PNG bytes)。無ければここで撮る
+        key: テンプレートのキャッシュキー（例: (サイト, セレクタ)）。キャッシュがあれば要素のスクリーンショットは撮らない
+        """
+        candidates = self.match_element(page, element, screen_png=screen_png, key=key, box=box)
+        if not candidates:
+            return None, None, 0.0
+        best = candidates[0]
+        return best["x"], best["y"], best["confidence"]
+
+    def match_element(self, page, element, screen_png=None, key=None, box=None):
+        """Ranked visual candidates for a DOM element (see src.template_matcher): the ROI around its box first, then the whole screen."""
+        if screen_png is None:
+            with phase("capture"):
+                screen_png = page.screenshot()
+        viewport = page.viewport_size or {}
+        return TEMPLATE_MATCHER.match(
+            screen_png, capture=element.screenshot, key=key,
+            box=box or element.bounding_box(), viewport_width=viewport.get("width"),
+        )
+
+    def record_black_box(self, data, timestamp):
+        filename = f"{self.log_base}/flight_record_{timestamp}.json"
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=4)
+        print(f"Black Box updated: {filename}")
+
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Airport ATC: Autonomous Flight Controller")
+    parser.add_argument("--url", default="https://example.com", help="Target URL")
+    parser.add_argument("--selector", default=None, help="Target CSS selector")
+    parser.add_argument("--mode", choices=["dom", "gui", "hybrid", "llm"], default="hybrid", help="Operation mode: dom, gui, hybrid, or llm")
+    parser.add_argument("--instruction", help="Instruction for LLM mode (e.g. 'Click the login button')")
+    
+    args = parser.parse_args()
+    
+    # LLMモード以外ではselectorが必須（またはデフォルト値）
+    if args.mode != "llm" and not args.selector:
+        args.selector = "a" # Legacy default
+
+    print(f"--- Mission Start ---")
+    print(f"Target: {args.url}")
+    print(f"Selector: {args.selector}")
+    print(f"Mode: {args.mode}")
+    if args.instruction:
+        print(f"Instruction: {args.instruction}")
+    print(f"---------------------")
+
+    atc = ATC()
+    result = atc.execute_task(args.url, args.selector, args.mode, args.instruction)
+    
+    print("\n" + "="*30)
+    print("      MISSION REPORT      ")
+    print("="*30)
+    
+    status = result.get('result')
+    
+    # ANSI Colors
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+
+    if status == "Success":
+        print(f"{GREEN}{BOLD}    [ SUCCESS ]{RESET}")
+        print(f"    Target acquired and executed.")
+    else:
+        print(f"{RED}{BOLD}    [ FAILED ]{RESET}")
+        if status == "Error":
+             print(f"    Error: {result.get('error_message')}")
+        else:
+             print(f"    Action verification failed.")
+
+    print("-"*30)
+    print(f"Log File : {atc.log_base}/flight_record_{int(time.time())}.json")
+    print(f"Pre-Shot : {result.get('screenshot_pre')}")
+    print(f"Post-Shot: {result.get('screenshot_post')}")
     print("="*30 + "\n")
\ No newline at end of file
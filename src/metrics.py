@@ -0,0 +1,258 @@
+"""
+Step Metrics - per-phase timing for ReAct / autopilot steps.
+
+各ステップを以下のフェーズに分けて計測する:
+    capture   - スクリーンショット取得
+    encode    - 画像のデコード / アップロード用エンコード
+    queue     - モデル呼び出し前の待ち（リトライ待機・前ステップのストリーム待ちなど）
+    inference - モデル推論（ストリーミング時は action が揃うまで）
+    parse     - LLM 出力の JSON パース・検証
+    act       - アクション実行
+    settle    - アクション後の待機（ページ遷移・描画待ち）
+    persist   - 履歴・Black Box への記録
+
+計測中のステップはコンテキスト変数（スレッド・asyncio タスクごと）に保持されるので、LLM バックエンドや ATC のような
+深い層からも `phase("encode")` のように引数を通さず記録できる（計測中でなければ何もしない）。
+フェーズは入れ子にでき、親フェーズの時間には子フェーズの時間を含めない（排他時間）。
+
+集計は METRICS (action 別 / サイト別のヒストグラム) に溜め、/api/metrics から Prometheus 形式で公開する。
+"""
+
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+PHASES = ("capture", "encode", "queue", "inference", "parse", "act", "settle", "persist")
+
+# 秒。ReAct の 1 ステップは数秒〜数十秒になるので上限を広めに取る
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# サブプロセス (run_airport.py) からサーバーへ計測値を渡すための stdout 行のプレフィックス
+TIMING_PREFIX = "⏱️ TIMING "
+
+_current_timer = contextvars.ContextVar("airport_step_timer", default=None)
+
+
+def site_of(url: str) -> str:
+    """Metric label for a page URL (host name)."""
+    if not url:
+        return "unknown"
+    return urlparse(url).hostname or "unknown"
+
+
+class StepTimer:
+    """Collects exclusive per-phase durations and a span list (for the waterfall) for one step."""
+
+    def __init__(self, step: int, action: str = None, site: str = None):
+        self.step = step
+        self.action = action
+        self.site = site
+        self.phases = {name: 0.0 for name in PHASES}
+        self.spans = []
+        self.started = time.time()
+        self.duration = None
+        self._stack = []  # [phase, started, child_time]
+
+    @contextmanager
+    def phase(self, name: str):
+        frame = [name, time.time(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.time() - frame[1]
+            self._add(name, elapsed - frame[2], frame[1], elapsed)
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def add(self, name: str, seconds: float):
+        """Records a phase measured elsewhere (e.g. streaming time-to-action)."""
+        started = time.time() - seconds
+        self._add(name, seconds, started, seconds)
+        if self._stack:
+            self._stack[-1][2] += seconds
+
+    def _add(self, name, exclusive, started, elapsed):
+        self.phases[name] = self.phases.get(name, 0.0) + max(0.0, exclusive)
+        self.spans.append({
+            "phase": name,
+            "start": round(started - self.started, 3),
+            "duration": round(elapsed, 3),
+            "depth": len(self._stack),
+        })
+
+    def finish(self) -> dict:
+        if self.duration is None:
+            self.duration = time.time() - self.started
+        return self.as_dict()
+
+    def as_dict(self) -> dict:
+        duration = self.duration if self.duration is not None else time.time() - self.started
+        return {
+            "step": self.step,
+            "action": self.action or "unknown",
+            "site": self.site or "unknown",
+            "duration": round(duration, 3),
+            "phases": {name: round(value, 3) for name, value in self.phases.items()},
+            "spans": sorted(self.spans, key=lambda s: (s["start"], s["depth"])),
+        }
+
+
+# ---- current step (per thread / asyncio task) ----
+def current_timer():
+    return _current_timer.get()
+
+
+def activate(timer):
+    """Makes `timer` the current step of this thread or asyncio task (None to clear)."""
+    _current_timer.set(timer)
+    return timer
+
+
+@contextmanager
+def phase(name: str):
+    """Times a phase of the current step; a no-op when no step is being timed."""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+
+def record_phase(name: str, seconds: float):
+    timer = current_timer()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+# ---- aggregation ----
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(labels: dict) -> str:
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsRegistry:
+    """Process-wide step timing histograms (per phase × action × site)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._phase = {}   # (phase, action, site) -> Histogram
+            self._step = {}    # (kind, action, site) -> Histogram
+            self._network = {}  # (profile, reason, resource type) -> [blocked requests, estimated bytes saved]
+
+    def observe_step(self, timing: dict, kind: str = "react"):
+        action = timing.get("action") or "unknown"
+        site = timing.get("site") or "unknown"
+        with self._lock:
+            self._step.setdefault((kind, action, site), Histogram()).observe(timing.get("duration", 0.0))
+            for name, seconds in timing.get("phases", {}).items():
+                if seconds:
+                    self._phase.setdefault((name, action, site), Histogram()).observe(seconds)
+            # ブラウジングプロファイルが止めたリクエスト（ATC.network_usage）
+            network = timing.get("network") or {}
+            for key, (requests, saved) in network.get("blocked", {}).items():
+                reason, _, resource_type = key.partition(":")
+                row = self._network.setdefault((network.get("profile") or "unknown", reason, resource_type), [0, 0])
+                row[0] += requests
+                row[1] += saved
+
+    def snapshot(self) -> dict:
+        """Per-action / per-site totals (for JSON consumers such as the benchmark)."""
+        with self._lock:
+            by_action, by_site = {}, {}
+            for (name, action, site), hist in self._phase.items():
+                for table, key in ((by_action, action), (by_site, site)):
+                    bucket = table.setdefault(key, {})
+                    bucket[name] = round(bucket.get(name, 0.0) + hist.sum, 3)
+            steps = sum(h.count for h in self._step.values())
+            network = {"blocked_requests": sum(r[0] for r in self._network.values()),
+                       "saved_bytes": sum(r[1] for r in self._network.values())}
+        return {"steps": steps, "by_action": by_action, "by_site": by_site, "network": network}
+
+    def render_prometheus(self, extra: list = None) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            for metric, help_text, series, label_names in (
+                ("airport_step_duration_seconds", "Wall time of one agent step.",
+                 self._step, ("kind", "action", "site")),
+                ("airport_step_phase_seconds", "Exclusive time spent in each phase of a step.",
+                 self._phase, ("phase", "action", "site")),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for key in sorted(series):
+                    hist = series[key]
+                    labels = dict(zip(label_names, key))
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        lines.append(f"{metric}_bucket{_labels({**labels, 'le': bound})} {count}")
+                    lines.append(f"{metric}_bucket{_labels({**labels, 'le': '+Inf'})} {hist.count}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {hist.sum:.6f}")
+                    lines.append(f"{metric}_count{_labels(labels)} {hist.count}")
+            for metric, help_text, column in (
+                ("airport_browser_blocked_requests_total", "Requests blocked by the browsing profile.", 0),
+                ("airport_browser_saved_bytes_total", "Estimated bytes not downloaded thanks to blocked requests.", 1),
+            ):
+                if not self._network:
+                    break
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for key in sorted(self._network):
+                    labels = dict(zip(("profile", "reason", "type"), key))
+                    lines.append(f"{metric}{_labels(labels)} {self._network[key][column]}")
+
+        # 追加のカウンタ/ゲージ: [(name, type, help, value, labels)]
+        seen = set()
+        for name, metric_type, help_text, value, labels in extra or []:
+            if name not in seen:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                seen.add(name)
+            lines.append(f"{name}{_labels(labels) if labels else ''} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+def emit_timing(timing: dict):
+    """Prints a step timing line that run_process_wrapper turns into a TIMING black box event."""
+    print(TIMING_PREFIX + json.dumps(timing, ensure_ascii=False), flush=True)
+
+
+def parse_timing_line(line: str):
+    """Returns the timing dict of an emit_timing() line, or None."""
+    line = line.strip()
+    if not line.startswith(TIMING_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(TIMING_PREFIX):])
+    except ValueError:
+        return None
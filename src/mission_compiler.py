@@ -0,0 +1,195 @@
+"""
+Mission Compiler - turns a successful ReAct trajectory into a replayable "compiled mission".
+
+成功した ReActAgent.run の history をコンパイルし、同じゴールが来たらモデルを呼ばずに再生する。
+
+- 各ステップは autopilot のプランと同じく action / params を持ち、加えて
+    checkpoint: 行動前の画面（URL + dHash）。再生時に安価に「同じ画面か」を確かめる
+    element:    click / type の対象要素の意味的な記述子 (ATC.describe_element_at)。
+                再生時は座標ではなく記述子で要素を探し直す（レイアウトのずれに強い）
+    verify:     チェックポイントの確かめ方 ("none" / "url" / "screen")
+- read は画面ごとに結果が変わるので、再生時にその画面についてだけモデルに聞き直す
+- ask_user・ユーザー介入・失敗したアクション・思考エラーの wait はコンパイルしない
+
+再生は ReActAgent が行い、チェックポイントが合わなくなった最初のステップから通常の ReAct に戻る。
+ゴールは正規化した文字列の完全一致で引く（大文字小文字・空白・全角半角の違いは無視）。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from datetime import datetime
+from urllib.parse import urlparse
+
+from PIL import Image
+
+from src.config import COMPILED_MISSIONS_DIR
+
+COMPILED_VERSION = 1
+
+# コンパイルしないアクション
+SKIPPED_ACTIONS = ("ask_user", "fail")
+# 画面に依存しないアクション（チェックポイントを確かめない）
+UNCHECKED_ACTIONS = ("goto", "wait", "run_terminal", "save_file", "switch_to_web", "launch_app")
+# ReActAgent._think がモデル呼び出しに失敗したときのフォールバック
+THINK_ERROR_OBSERVATION = "Error analyzing screen"
+
+
+def dhash(image_path: str, size: int = 8) -> str:
+    """64-bit difference hash of a screenshot (16 hex chars)."""
+    with Image.open(image_path) as img:
+        small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            offset = row * (size + 1) + col
+            bits = (bits << 1) | int(pixels[offset] > pixels[offset + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def page_key(url: str) -> str:
+    """URL without query / fragment (session ids and tracking params differ between runs)."""
+    if not url or url == "desktop":
+        return url or ""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}{parsed.path.rstrip('/')}"
+
+
+def normalize_goal(goal: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", goal or "").lower().split())
+
+
+def goal_key(goal: str) -> str:
+    return hashlib.sha1(normalize_goal(goal).encode("utf-8")).hexdigest()[:16]
+
+
+def _verify_mode(action: str, element: dict) -> str:
+    if action in UNCHECKED_ACTIONS:
+        return "none"
+    if element or action in ("read", "get_url"):
+        # 要素の再特定（または再読み取り）で確かめられるので、画面はページが同じかだけ見る
+        return "url"
+    return "screen"
+
+
+def compile_trajectory(goal: str, history: list) -> dict:
+    """
+    Compiles ReActAgent.history into a compiled mission.
+    Returns None when the trajectory did not end with `done`.
+    """
+    steps = []
+    for entry in history:
+        if entry.get("role") == "user_intervention":
+            continue
+        thought = entry.get("thought") or {}
+        action = thought.get("action")
+        if not action or action in SKIPPED_ACTIONS:
+            continue
+        if thought.get("observation") == THINK_ERROR_OBSERVATION:
+            continue
+        if str(entry.get("action_result", "")).startswith("Error executing"):
+            continue
+
+        step = {
+            "action": action,
+            "params": dict(thought.get("params") or {}),
+            "checkpoint": entry.get("checkpoint"),
+            "verify": _verify_mode(action, entry.get("element")),
+        }
+        if entry.get("element"):
+            step["element"] = entry["element"]
+        if not step["checkpoint"] and step["verify"] != "none":
+            return None  # チェックポイント無しで記録された履歴は再生できない
+        steps.append(step)
+
+    if not steps or steps[-1]["action"] != "done":
+        return None
+    return {
+        "version": COMPILED_VERSION,
+        "goal": goal,
+        "goal_key": goal_key(goal),
+        "compiled_at": datetime.now().isoformat(),
+        "source_steps": len(history),
+        "steps": steps,
+        "stats": {"replays": 0, "completed": 0, "diverged": 0},
+    }
+
+
+class MissionLibrary:
+    """Compiled missions stored as results/compiled_missions/<goal_key>.json."""
+
+    def __init__(self, directory: str = None):
+        self.directory = str(directory or COMPILED_MISSIONS_DIR)
+        self._lock = threading.Lock()
+
+    def _path(self, goal: str) -> str:
+        return os.path.join(self.directory, f"{goal_key(goal)}.json")
+
+    def _load(self, path: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, mission: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(mission["goal"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(mission, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def find(self, goal: str):
+        """The compiled mission for `goal`, or None."""
+        mission = self._load(self._path(goal))
+        if not mission or mission.get("version") != COMPILED_VERSION:
+            return None
+        if normalize_goal(mission.get("goal")) != normalize_goal(goal):
+            return None
+        return mission
+
+    def save(self, mission: dict):
+        """Stores a freshly compiled mission, keeping the replay statistics of the previous version."""
+        with self._lock:
+            previous = self.find(mission["goal"])
+            if previous:
+                mission["stats"] = previous.get("stats", mission["stats"])
+            self._write(mission)
+        print(f"📦 Compiled mission saved: {len(mission['steps'])} steps → {self._path(mission['goal'])}")
+
+    def record_replay(self, goal: str, completed: bool):
+        with self._lock:
+            mission = self.find(goal)
+            if not mission:
+                return
+            stats = mission.setdefault("stats", {"replays": 0, "completed": 0, "diverged": 0})
+            stats["replays"] += 1
+            stats["completed" if completed else "diverged"] += 1
+            stats["last_replayed"] = datetime.now().isoformat()
+            self._write(mission)
+
+    def list(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        missions = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            mission = self._load(os.path.join(self.directory, name))
+            if mission:
+                missions.append({
+                    "goal": mission.get("goal"),
+                    "goal_key": mission.get("goal_key"),
+                    "compiled_at": mission.get("compiled_at"),
+                    "steps": len(mission.get("steps", [])),
+                    "stats": mission.get("stats", {}),
+                })
+        return missions
@@ -0,0 +1,234 @@
+"""
+Model Router - picks a model tier per LLM call and escalates / de-escalates from the outcomes.
+
+MODEL_TIERS (安い → 強い) のどれを使うかを呼び出しごとに決める:
+    基本の段   - 呼び出しの種類 (kind: think / ground / read) と文脈 (think なら直前のアクション) から。
+                 既定モデル (GEMINI_MODEL) の段を基準に、簡単な呼び出し（入力直後の think など）は 1 段下げる
+    昇格       - 信頼度が低い (ROUTER_LOW_CONFIDENCE 未満) 結果は 1 回で、失敗は MISSES_TO_ESCALATE 回続いたら 1 段上げる
+    降格       - SUCCESSES_TO_DEESCALATE 回続けて成功したら 1 段下げる
+段の上げ下げは kind ごとにミッション（ルーターのインスタンス）単位で持つ。
+
+結果を報告した時点で「決定 + 結果」を 1 件の記録として残す:
+    - ROUTER_STATS（プロセス全体、kind × model ごとの呼び出し・失敗・信頼度）→ /api/model_router, /api/metrics
+    - on_record コールバック（ReAct: Black Box の ROUTE イベント）、無ければ stdout の ROUTE 行
+      （autopilot のワーカープロセス → run_process_wrapper が Black Box に記録）
+実行中のルーターは metrics.StepTimer と同じくコンテキスト変数で引き回す（VisionCore は呼び出しごとに作られるため）。
+"""
+
+import contextvars
+import json
+import threading
+import time
+
+from src.config import GEMINI_MODEL, MODEL_ROUTER, MODEL_TIERS, ROUTER_LOW_CONFIDENCE
+from src.metrics import current_timer
+
+# サブプロセス (run_airport.py) からサーバーへ記録を渡すための stdout 行のプレフィックス
+ROUTE_PREFIX = "🧭 ROUTE "
+
+MISSES_TO_ESCALATE = 2
+SUCCESSES_TO_DEESCALATE = 3
+
+# (kind, context) → 既定モデルの段からの差。無ければ (kind, None)、それも無ければ 0
+BASE_OFFSETS = {
+    ("think", "type"): -1,    # 入力の直後（多くは Enter を押すだけ）
+    ("think", "wait"): -1,    # 待機の直後（同じ画面の続き）
+    ("read", None): 0,
+    ("ground", None): 0,
+}
+
+_current_router = contextvars.ContextVar("airport_router", default=None)
+
+
+class RouteDecision:
+    def __init__(self, kind: str, context, tier: int, model: str, reason: str):
+        self.kind = kind
+        self.context = context
+        self.tier = tier
+        self.model = model
+        self.reason = reason
+        self.started = time.time()
+        self.finished = None
+
+    def done(self):
+        """Marks the end of the model call (the outcome may be reported later)."""
+        self.finished = self.finished or time.time()
+
+    def as_dict(self) -> dict:
+        return {"kind": self.kind, "context": self.context, "tier": self.tier, "model": self.model, "reason": self.reason}
+
+
+class RouteStats:
+    """Process-wide outcomes per (kind, model), for tuning the policy."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def observe(self, record: dict):
+        key = (record.get("kind"), record.get("model"))
+        with self._lock:
+            stats = self._stats.setdefault(key, {"calls": 0, "misses": 0, "escalated": 0, "confidence_sum": 0.0, "confidence_n": 0})
+            stats["calls"] += 1
+            stats["misses"] += int(record.get("miss", not record.get("ok")))
+            stats["escalated"] += int(str(record.get("reason", "")).startswith("escalated"))
+            if record.get("confidence") is not None:
+                stats["confidence_sum"] += float(record["confidence"])
+                stats["confidence_n"] += 1
+
+    def snapshot(self) -> list:
+        with self._lock:
+            rows = []
+            for (kind, model), stats in sorted(self._stats.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))):
+                n = stats["confidence_n"]
+                rows.append({
+                    "kind": kind, "model": model, "calls": stats["calls"], "misses": stats["misses"],
+                    "escalated": stats["escalated"],
+                    "miss_rate": round(stats["misses"] / stats["calls"], 3) if stats["calls"] else 0.0,
+                    "avg_confidence": round(stats["confidence_sum"] / n, 3) if n else None,
+                })
+            return rows
+
+
+ROUTER_STATS = RouteStats()
+
+
+class ModelRouter:
+    def __init__(self, tiers: list = None, on_record=None, low_confidence: float = None):
+        self.tiers = list(tiers or MODEL_TIERS) or [GEMINI_MODEL]
+        self.default_tier = self.tiers.index(GEMINI_MODEL) if GEMINI_MODEL in self.tiers else 0
+        self.on_record = on_record
+        self.low_confidence = ROUTER_LOW_CONFIDENCE if low_confidence is None else low_confidence
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.offsets = {}     # kind -> 段の上げ下げ
+            self.misses = {}      # kind -> 連続失敗数
+            self.successes = {}   # kind -> 連続成功数
+            self.records = 0
+
+    @property
+    def top_tier(self) -> int:
+        return len(self.tiers) - 1
+
+    def _clamp(self, tier: int) -> int:
+        return max(0, min(self.top_tier, tier))
+
+    def choose(self, kind: str, context: str = None) -> RouteDecision:
+        base = self.default_tier + BASE_OFFSETS.get((kind, context), BASE_OFFSETS.get((kind, None), 0))
+        with self._lock:
+            offset = self.offsets.get(kind, 0)
+        tier = self._clamp(base + offset)
+        if offset > 0:
+            reason = f"escalated +{offset}"
+        elif offset < 0:
+            reason = f"de-escalated {offset}"
+        else:
+            reason = "base" if base == self.default_tier else f"base ({context})"
+        return RouteDecision(kind, context, tier, self.tiers[tier], reason)
+
+    def report(self, decision: RouteDecision, ok: bool, confidence: float = None, **extra) -> dict:
+        """Outcome of a routed call. Updates the escalation state and logs decision + outcome."""
+        if decision is None:
+            return None
+        low = confidence is not None and confidence < self.low_confidence
+        miss = not ok or low
+        kind = decision.kind
+        span = self.top_tier
+        with self._lock:
+            offset = self.offsets.get(kind, 0)
+            if miss:
+                self.successes[kind] = 0
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                if low or self.misses[kind] >= MISSES_TO_ESCALATE:
+                    offset = min(span, offset + 1)
+                    self.misses[kind] = 0
+            else:
+                self.misses[kind] = 0
+                self.successes[kind] = self.successes.get(kind, 0) + 1
+                if self.successes[kind] >= SUCCESSES_TO_DEESCALATE:
+                    offset = max(-span, offset - 1)
+                    self.successes[kind] = 0
+            self.offsets[kind] = offset
+            self.records += 1
+
+        timer = current_timer()
+        record = {
+            **decision.as_dict(),
+            "ok": bool(ok),
+            "miss": miss,
+            "confidence": None if confidence is None else round(float(confidence), 3),
+            "latency": round((decision.finished or time.time()) - decision.started, 3),
+            "step": timer.step if timer else None,
+            "next_offset": offset,
+            **extra,
+        }
+        ROUTER_STATS.observe(record)
+        if self.on_record:
+            try:
+                self.on_record(record)
+            except Exception as e:
+                print(f"   ⚠️ Route Log Error: {e}")
+        else:
+            emit_route(record)
+        return record
+
+
+# ---- current router (per thread / asyncio task) ----
+_process_router = None
+_process_router_guard = threading.Lock()
+
+
+def activate_router(router):
+    """
+    Makes `router` the router of this thread's (or asyncio task's) calls.
+    False disables routing there; None falls back to the process router.
+    """
+    _current_router.set(router)
+    return router
+
+
+def current_router():
+    """This thread's router; otherwise the process-wide one when AIRPORT_MODEL_ROUTER=1 (autopilot workers), else None."""
+    router = _current_router.get()
+    if router is False:
+        return None
+    if router is not None or not MODEL_ROUTER:
+        return router
+    global _process_router
+    with _process_router_guard:
+        if _process_router is None:
+            _process_router = ModelRouter()
+        return _process_router
+
+
+def route(kind: str, context: str = None):
+    """Decision for a call of `kind`, or None when no router is active (the backend's default model is used)."""
+    router = current_router()
+    return router.choose(kind, context) if router else None
+
+
+def report_route(decision, ok: bool, confidence: float = None, **extra):
+    router = current_router()
+    if router and decision:
+        router.report(decision, ok, confidence, **extra)
+
+
+def emit_route(record: dict):
+    print(ROUTE_PREFIX + json.dumps(record, ensure_ascii=False), flush=True)
+
+
+def parse_route_line(line: str):
+    line = line.strip()
+    if not line.startswith(ROUTE_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(ROUTE_PREFIX):])
+    except ValueError:
+        return None
@@ -0,0 +1,191 @@
+"""
+Plan Compiler - self-healing selectors for the vision steps of flight plans.
+
+VisionCore.generate_plan のプランは click_vision / type_vision（/api/execute で mode: llm のクリックと type_vision になる）を
+使うので、実行するたびに Vision を呼んでいた。ここではプランごとに、Vision で成功したステップが実際に当たった要素
+(elementFromPoint → ATC.describe_element_at) を堅牢な順に並べたセレクタの組にして保存する:
+    id         [id="..."]
+    属性       tag[name="..."] / tag[aria-label="..."] / tag[placeholder="..."]
+    ロール     role=button[name="..."]（明示の role か、タグから推定した暗黙のロール）
+    テキスト   tag:text-is("...")
+    構造       CSS パス（id を持つ祖先からの nth-of-type）
+次回からはステップに `selectors:` を付けて実行し、ATC がどれかで表示中の要素を 1 つだけ見つけられればそこを操作する（Vision を呼ばない）。
+すべて外れたときだけ Vision に戻り、当たった要素からセレクタを作り直す（自己修復）。
+同じプランを繰り返し実行すると Vision の呼び出しが無くなり、DOM 操作と同じ速さに収束する。
+
+プランは手順（タスク名・アクション・URL・セレクタ・instruction・mode）のハッシュで識別するので、入力テキストだけが違うプランは
+同じコンパイル結果を使う。results/compiled_plans/<fingerprint>.json に保存する。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+from src.config import COMPILED_PLANS_DIR
+
+COMPILED_PLAN_VERSION = 1
+
+# プランの同一性に使うステップのキー（入力テキストなどの値は含めない）
+FINGERPRINT_KEYS = ("action", "url", "selector", "instruction", "mode")
+
+# タグから推定する暗黙の ARIA ロール
+IMPLICIT_ROLES = {"a": "link", "button": "button", "select": "combobox", "textarea": "textbox", "summary": "button"}
+INPUT_ROLES = {"submit": "button", "button": "button", "reset": "button", "image": "button",
+               "checkbox": "checkbox", "radio": "radio", "range": "slider", "search": "searchbox"}
+FIELD_TAGS = ("input", "textarea", "select")
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def is_vision_step(step: dict) -> bool:
+    """Whether a plan step locates its element with the Vision model."""
+    action = step.get("action")
+    return action == "type_vision" or (action == "click" and step.get("mode") == "llm")
+
+
+def plan_fingerprint(tasks: list) -> str:
+    shape = [[task.get("name"), [{k: step.get(k) for k in FINGERPRINT_KEYS if step.get(k) is not None}
+                                 for step in task.get("steps", [])]] for task in tasks]
+    return hashlib.sha1(json.dumps(shape, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _quote(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def implicit_role(element: dict):
+    if element.get("role"):
+        return element["role"]
+    tag = element.get("tag")
+    if tag == "input":
+        return INPUT_ROLES.get((element.get("type") or "text").lower(), "textbox")
+    if tag == "a" and not element.get("href"):
+        return None
+    return IMPLICIT_ROLES.get(tag)
+
+
+def selectors_for(element: dict) -> list:
+    """Selectors (Playwright syntax, most robust first) for an element descriptor of ATC.describe_element_at."""
+    if not element:
+        return []
+    tag = element.get("tag") or "*"
+    selectors = []
+    if element.get("id"):
+        selectors.append(f"[id={_quote(element['id'])}]")
+    for attribute, key in (("name", "name"), ("aria-label", "aria_label"), ("placeholder", "placeholder")):
+        if element.get(key):
+            selectors.append(f"{tag}[{attribute}={_quote(element[key])}]")
+    # フォーム部品の text は入力済みの値なので名前・テキストには使わない
+    text = None if tag in FIELD_TAGS else element.get("text")
+    role = implicit_role(element)
+    name = element.get("aria_label") or text
+    if role and name:
+        selectors.append(f"role={role}[name={_quote(name)}]")
+    if text:
+        selectors.append(f"{tag}:text-is({_quote(text)})")
+    if element.get("css"):
+        selectors.append(f"css={element['css']}")
+    seen = set()
+    return [s for s in selectors if not (s in seen or seen.add(s))]
+
+
+class PlanCompiler:
+    """Compiled selectors of one flight plan, stored as results/compiled_plans/<fingerprint>.json."""
+
+    def __init__(self, tasks: list, directory: str = None):
+        self.directory = str(directory or COMPILED_PLANS_DIR)
+        self.fingerprint = plan_fingerprint(tasks)
+        self.path = os.path.join(self.directory, f"{self.fingerprint}.json")
+        self._lock = threading.Lock()
+        self.data = self._load() or {
+            "version": COMPILED_PLAN_VERSION,
+            "fingerprint": self.fingerprint,
+            "steps": {},
+            "created_at": _now(),
+        }
+        # この実行での結果
+        self.stats = {"selector_hits": 0, "vision": 0, "compiled": 0, "healed": 0}
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if data.get("version") == COMPILED_PLAN_VERSION else None
+
+    def _write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.data["updated_at"] = _now()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def step_key(task_index: int, step_index: int) -> str:
+        return f"{task_index + 1}.{step_index + 1}"
+
+    def prepare(self, key: str, step: dict, site: str = None) -> dict:
+        """The step to execute: a vision step gets its compiled `selectors:` (if any were learned on the same site)."""
+        if not is_vision_step(step) or step.get("selectors"):
+            return step
+        with self._lock:
+            entry = self.data["steps"].get(key)
+        if not entry or entry.get("instruction") != step.get("instruction") or not entry.get("selectors"):
+            return step
+        if site and entry.get("site") and entry["site"] != site:
+            return step
+        return {**step, "selectors": entry["selectors"]}
+
+    def record(self, key: str, step: dict, site: str, result):
+        """
+        Records the outcome of a successful vision step (the dict returned by ATC.click / type_text_vision).
+        A Vision-located element (re)compiles the step's selectors; a selector hit is counted.
+        """
+        if not is_vision_step(step) or not isinstance(result, dict):
+            return
+        resolved = result.get("resolved")
+        with self._lock:
+            entry = self.data["steps"].get(key)
+            if resolved == "selector":
+                self.stats["selector_hits"] += 1
+                if entry:
+                    entry["hits"] = entry.get("hits", 0) + 1
+                    entry["last_selector"] = result.get("selector")
+                    entry["last_hit"] = _now()
+            elif resolved == "vision":
+                self.stats["vision"] += 1
+                selectors = selectors_for(result.get("element"))
+                if not selectors:
+                    return
+                healed = bool(entry and entry.get("selectors"))
+                self.stats["healed" if healed else "compiled"] += 1
+                self.data["steps"][key] = {
+                    "action": step.get("action"),
+                    "instruction": step.get("instruction"),
+                    "site": site,
+                    "selectors": selectors,
+                    "element": result.get("element"),
+                    "hits": entry.get("hits", 0) if entry else 0,
+                    "heals": (entry.get("heals", 0) + 1) if healed else 0,
+                    "compiled_at": _now(),
+                }
+                if healed:
+                    print(f"    🩹 Re-healed selectors for step {key}: {selectors[0]}")
+                else:
+                    print(f"    🧩 Compiled selectors for step {key}: {selectors[0]}")
+            else:
+                return
+            try:
+                self._write()
+            except OSError as e:
+                print(f"⚠️ Plan Compiler Error: {e}")
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"fingerprint": self.fingerprint, "compiled_steps": len(self.data["steps"]), **self.stats}
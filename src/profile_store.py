@@ -0,0 +1,298 @@
+"""
+Profile Store - ミッションをまたいで共有するブラウザの HTTP キャッシュとログイン状態（opt-in, AIRPORT_PROFILE_STORE=1）。
+
+ATC.start_session は毎回まっさらなコンテキストを作るので、どのミッションも静的アセットをダウンロードし直し、
+サイトに最初からログインしていた（test_scenarios.yaml は実行のたびに SauceDemo の認証情報を入力する）。ここでは:
+    HTTP キャッシュ - 同期の ATC は永続コンテキスト（一時的なユーザーデータ + 共有の --disk-cache-dir）でセッションを開く。
+                      Chromium のディスクキャッシュは複数のプロセスから同時に使えないので、ロックを取れたセッションだけが使う
+                      （並列のワーカーの残りと、共有ブラウザの AsyncATC は従来どおりのコンテキスト）
+    ログイン状態   - 自動操縦のタスクのログイン手順（ユーザー名とパスワードの入力と送信）を見つけ、成功後の storage_state
+                      （サイトの cookie と localStorage）を (サイト, アカウント) ごとに保存する。次回はそれを読み込んでログイン後の
+                      ページを開き、ログイン手順を飛ばす。有効期限（AIRPORT_AUTH_STATE_TTL_HOURS と cookie の期限の早い方）を
+                      過ぎたもの、開いたページにログインフォームが出たもの（セッション切れ）は捨てて、ログインし直して保存し直す
+秘密情報はフライトの記録に出さない: ストアは /static/results で配信される results/ の外（AIRPORT_PROFILE_STORE_DIR）に
+所有者だけが読めるファイルとして置き、ログにはサイトとアカウントのハッシュだけを出す。パスワード欄への入力も伏せ字で出力する。
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from src.config import AUTH_STATE_TTL_HOURS, PROFILE_STORE_DIR
+from src.metrics import site_of
+from src.mission_compiler import page_key
+
+AUTH_STATE_VERSION = 1
+
+# パスワードなどの秘密の入力欄（セレクタ / Vision の instruction）
+SECRET_FIELD = re.compile(r"pass|pwd|secret|\botp\b|\bpin\b", re.IGNORECASE)
+MASK = "********"
+# ログインフォームが表示されているか（保存した状態が使えなかった・ログインに失敗した）
+LOGIN_FORM_SELECTOR = "input[type=password]:visible"
+TYPE_ACTIONS = ("type", "type_vision")
+SUBMIT_ACTIONS = ("click", "key")
+
+_SEED_LOCAL_STORAGE_JS = "(items) => { for (const item of items) localStorage.setItem(item.name, item.value); }"
+
+
+def is_secret_field(target: str) -> bool:
+    return bool(target and SECRET_FIELD.search(target))
+
+
+def masked(target: str, text: str) -> str:
+    """The text to print for an input into `target` (a selector or an instruction)."""
+    return MASK if is_secret_field(target) else text
+
+
+def _host_matches(host: str, site: str) -> bool:
+    host = (host or "").lstrip(".").lower()
+    return host == site or host.endswith("." + site) or site.endswith("." + host)
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url or "")
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def login_span(steps: list):
+    """
+    The login steps of a task: {"start", "password", "end", "account"}, or None.
+    The password is the first input into a secret field; the account is the input just before it on the same page
+    (the user name); the login ends with the next click / key (the submit) and the waits right after it.
+    """
+    for p, step in enumerate(steps):
+        if step.get("action") in TYPE_ACTIONS and is_secret_field(step.get("selector") or step.get("instruction")):
+            break
+    else:
+        return None
+    start, account = p, None
+    for u in range(p - 1, -1, -1):
+        action = steps[u].get("action")
+        if action == "goto":
+            break
+        if action in TYPE_ACTIONS:
+            start, account = u, steps[u].get("text")
+            break
+    end = next((e for e in range(p + 1, len(steps)) if steps[e].get("action") in SUBMIT_ACTIONS), None)
+    if end is None:
+        return None
+    while end + 1 < len(steps) and steps[end + 1].get("action") in ("wait", "wait_for"):
+        end += 1
+    return {"start": start, "password": p, "end": end, "account": account or "default"}
+
+
+class ProfileStore:
+    """The shared HTTP cache and the per-(site, account) storage_state snapshots (see the module docstring)."""
+
+    def __init__(self, directory: str = None, ttl_hours: float = None):
+        self.directory = str(directory or PROFILE_STORE_DIR)
+        self.ttl = (AUTH_STATE_TTL_HOURS if ttl_hours is None else ttl_hours) * 3600
+        self._lock = threading.Lock()
+        self._cache_lock = None  # ロックを保持しているファイル（このプロセスで共有キャッシュを使っているセッション）
+
+    def _makedirs(self, *parts) -> str:
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return path
+
+    # ---- shared HTTP cache ----
+    def acquire_cache(self):
+        """The shared disk cache directory if no other session is using it (it is then held until release_cache)."""
+        with self._lock:
+            if self._cache_lock:
+                return None
+            lock_file = open(os.path.join(self._makedirs(), "http_cache.lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return None
+            self._cache_lock = lock_file
+        return self._makedirs("http_cache")
+
+    def release_cache(self):
+        with self._lock:
+            if self._cache_lock:
+                fcntl.flock(self._cache_lock, fcntl.LOCK_UN)
+                self._cache_lock.close()
+                self._cache_lock = None
+
+    # ---- login snapshots ----
+    @staticmethod
+    def account_key(site: str, account: str) -> str:
+        return hashlib.sha1(f"{site}\n{account}".encode("utf-8")).hexdigest()[:16]
+
+    def _auth_path(self, site: str, account: str) -> str:
+        return os.path.join(self.directory, "auth", site, f"{self.account_key(site, account)}.json")
+
+    def load(self, site: str, account: str):
+        """The saved login of `account` on `site` if it has not expired, else None (an expired one is deleted)."""
+        path = self._auth_path(site, account)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != AUTH_STATE_VERSION or entry.get("expires_at", 0) <= time.time():
+            self.forget(site, account)
+            return None
+        return entry
+
+    def save(self, site: str, account: str, storage_state: dict, landing_url: str):
+        """Saves the site's part of a context's storage_state (its cookies and localStorage) as the account's login."""
+        cookies = [c for c in storage_state.get("cookies", []) if _host_matches(c.get("domain"), site)]
+        origins = [o for o in storage_state.get("origins", [])
+                   if _host_matches(urlsplit(o.get("origin")).hostname, site)]
+        if not cookies and not origins:
+            return None
+        now = time.time()
+        expiry = [c["expires"] for c in cookies if c.get("expires", -1) > 0]
+        entry = {
+            "version": AUTH_STATE_VERSION,
+            "site": site,
+            "account": self.account_key(site, account),
+            "landing_url": landing_url,
+            "saved_at": now,
+            "expires_at": min([now + self.ttl] + expiry),
+            "storage_state": {"cookies": cookies, "origins": origins},
+        }
+        path = self._auth_path(site, account)
+        self._makedirs("auth", site)
+        tmp_path = path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        return entry
+
+    def forget(self, site: str, account: str):
+        try:
+            os.remove(self._auth_path(site, account))
+        except OSError:
+            pass
+
+
+PROFILE_STORE = ProfileStore()
+
+
+class LoginReuse:
+    """Reuses and refreshes the saved login of one autopilot task (see the module docstring)."""
+
+    def __init__(self, steps: list, store: ProfileStore = None):
+        self.span = login_span(steps)
+        self.store = store or PROFILE_STORE
+        self.site = None
+        self.restored = False
+        self.stats = {"reused": 0, "saved": 0, "expired": 0, "skipped_steps": 0}
+
+    def _label(self) -> str:
+        return f"{self.site} (account #{self.store.account_key(self.site, self.span['account'])[:6]})"
+
+    # ---- before a step ----
+    def covers(self, index: int, atc) -> bool:
+        """Whether step `index` is part of a login replaced by the saved state (restored at the first login step)."""
+        if not self.span or not self.span["start"] <= index <= self.span["end"]:
+            return False
+        if index == self.span["start"]:
+            self.restored = self._restore(atc)
+        return self.restored
+
+    async def covers_async(self, index: int, atc) -> bool:
+        if not self.span or not self.span["start"] <= index <= self.span["end"]:
+            return False
+        if index == self.span["start"]:
+            self.restored = await self._restore_async(atc)
+        return self.restored
+
+    def _entry(self, page):
+        self.site = site_of(page.url) if page else None
+        return self.store.load(self.site, self.span["account"]) if self.site else None
+
+    def _seed(self, entry, url):
+        state = entry["storage_state"]
+        origin = _origin(url)
+        items = [item for o in state.get("origins", []) if o.get("origin") == origin
+                 for item in o.get("localStorage", [])]
+        return state.get("cookies", []), items
+
+    def _restore(self, atc) -> bool:
+        entry = self._entry(atc.page)
+        if not entry:
+            return False
+        login_url = atc.page.url
+        cookies, items = self._seed(entry, login_url)
+        try:
+            if cookies:
+                atc.context.add_cookies(cookies)
+            if items:
+                atc.page.evaluate(_SEED_LOCAL_STORAGE_JS, items)
+            atc.page.goto(entry["landing_url"])
+            logged_in = self._logged_in(atc.page.url, entry, atc.page.locator(LOGIN_FORM_SELECTOR).count())
+            if not logged_in:
+                atc.page.goto(login_url)
+        except Exception as e:
+            print(f"    ⚠️ Login State Error: {e}")
+            return False
+        return logged_in
+
+    async def _restore_async(self, atc) -> bool:
+        entry = self._entry(atc.page)
+        if not entry:
+            return False
+        login_url = atc.page.url
+        cookies, items = self._seed(entry, login_url)
+        try:
+            if cookies:
+                await atc.context.add_cookies(cookies)
+            if items:
+                await atc.page.evaluate(_SEED_LOCAL_STORAGE_JS, items)
+            await atc.page.goto(entry["landing_url"])
+            logged_in = self._logged_in(atc.page.url, entry, await atc.page.locator(LOGIN_FORM_SELECTOR).count())
+            if not logged_in:
+                await atc.page.goto(login_url)
+        except Exception as e:
+            print(f"    ⚠️ Login State Error: {e}")
+            return False
+        return logged_in
+
+    def _logged_in(self, url: str, entry: dict, login_forms: int) -> bool:
+        if page_key(url) == page_key(entry["landing_url"]) and not login_forms:
+            skipped = self.span["end"] - self.span["start"] + 1
+            self.stats["reused"] += 1
+            self.stats["skipped_steps"] += skipped
+            print(f"    🔑 Reused the saved login for {self._label()}, skipping {skipped} login steps")
+            return True
+        # ログインフォームに戻された: セッション切れ。ログインし直して保存し直す
+        self.stats["expired"] += 1
+        self.store.forget(self.site, self.span["account"])
+        print(f"    🔑 Saved login for {self._label()} is no longer valid, logging in again")
+        return False
+
+    # ---- after a step ----
+    def after_step(self, index: int, atc):
+        """Saves the login state once the login steps ran (and the login form is gone)."""
+        if self._should_save(index) and not atc.page.locator(LOGIN_FORM_SELECTOR).count():
+            self._save(atc.context.storage_state(), atc.page.url)
+
+    async def after_step_async(self, index: int, atc):
+        if self._should_save(index) and not await atc.page.locator(LOGIN_FORM_SELECTOR).count():
+            self._save(await atc.context.storage_state(), atc.page.url)
+
+    def _should_save(self, index: int) -> bool:
+        return bool(self.span and index == self.span["end"] and not self.restored and self.site)
+
+    def _save(self, storage_state: dict, landing_url: str):
+        try:
+            if self.store.save(self.site, self.span["account"], storage_state, landing_url):
+                self.stats["saved"] += 1
+                print(f"    🔑 Saved the login state for {self._label()}")
+        except OSError as e:
+            print(f"    ⚠️ Login State Error: {e}")
+
+    def summary(self) -> dict:
+        return dict(self.stats)
@@ -0,0 +1,117 @@
+"""
+Sampling Profiler - opt-in per flight, writes collapsed stacks next to blackbox.jsonl.
+
+バックグラウンドスレッドが一定間隔で sys._current_frames() を読み、スタックごとのサンプル数を数える。
+出力は collapsed-stack 形式（1行 = "スレッド名;関数;関数... 回数"）で、
+speedscope (https://www.speedscope.app) や flamegraph.pl にそのまま読み込める。
+
+- 有効にしない限りスレッドも計測コードも一切動かない（無効時のオーバーヘッドはゼロ）
+- ReAct (サーバー内スレッド): SamplingProfiler を直接開始・停止
+- autopilot など run_airport.py のワーカープロセス: AIRPORT_PROFILE_OUT / AIRPORT_PROFILE_HZ 環境変数で
+  start_from_env() が起動し、プロセス終了時に書き出す
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from src.config import PROFILER_HZ
+
+PROFILE_FILE = "profile.collapsed"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread in the process (or only `thread_ids`) at `hz`."""
+
+    def __init__(self, output_path: str, hz: int = None, thread_ids=None):
+        self.output_path = output_path
+        self.hz = max(1, int(hz or PROFILER_HZ))
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.samples = Counter()
+        self.sample_count = 0
+        self.overruns = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run, name="airport-profiler", daemon=True)
+        self._thread.start()
+        print(f"🔬 Profiler started ({self.hz} Hz) → {self.output_path}")
+        return self
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        own_id = threading.get_ident()
+        next_tick = time.perf_counter()
+        while not self._stop.is_set():
+            self._sample(own_id)
+            next_tick += interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # サンプリングが間に合わない場合は追いつこうとせず、次の周期から再開する
+                self.overruns += 1
+                next_tick = time.perf_counter()
+
+    def _sample(self, own_id):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (self.thread_ids and thread_id not in self.thread_ids):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.samples[";".join(reversed(stack))] += 1
+        self.sample_count += 1
+
+    def stop(self) -> str:
+        """Stops sampling and writes the collapsed stacks. Returns the output path."""
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        with open(self.output_path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        duration = time.time() - self._started
+        print(f"🔬 Profiler stopped: {self.sample_count} samples in {duration:.1f}s "
+              f"({self.overruns} overruns) → {self.output_path}")
+        return self.output_path
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def profiler_env(output_path: str, hz: int = None) -> dict:
+    """Environment that makes a run_airport.py worker profile itself into `output_path`."""
+    return {"AIRPORT_PROFILE_OUT": output_path, "AIRPORT_PROFILE_HZ": str(hz or PROFILER_HZ)}
+
+
+def start_from_env():
+    """Starts a process-wide profiler when AIRPORT_PROFILE_OUT is set (worker processes)."""
+    output_path = os.getenv("AIRPORT_PROFILE_OUT")
+    if not output_path:
+        return None
+    profiler = SamplingProfiler(output_path, hz=int(os.getenv("AIRPORT_PROFILE_HZ", PROFILER_HZ)))
+    profiler.start()
+    atexit.register(profiler.stop)
+    return profiler
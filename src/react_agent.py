@@ -3,22 +3,42 @@ ReAct Agent - Observe → Think → Act Loop
 自律型エージェント：画面を見て、考えて、行動する
 """
 
+import asyncio
 import os
 import subprocess
 import time
 import json
 import re
+import threading
 from datetime import datetime
 from typing import Optional, Callable
 import queue
 from PIL import Image
-import google.generativeai as genai
 from dotenv import load_dotenv
-from src.config import REACT_SCREENSHOTS_DIR, WORKSPACE_ROOT
+from src.accounting import MissionBudget, UsageLedger, activate_ledger, record_retry
+from src.agent_memory import AgentMemory
+from src.config import (
+    CHECKPOINT_DHASH_THRESHOLD, COMPILED_MISSIONS, FLIGHT_HINTS, FLIGHT_HINTS_K, LOOP_DETECTOR, MODEL_ROUTER,
+    REACT_HISTORY_DIR, REACT_SCREENSHOTS_DIR, REACT_SPECULATIVE, SITE_KNOWLEDGE_ENABLED, WORKSPACE_ROOT, REACT_STREAMING,
+)
 from src.desktop_controller import DesktopATC
+from src.flight_index import FLIGHT_INDEX, format_hints
+from src.llm_backend import create_backend
+from src.llm_core import VisionCore, generate_json
+from src.llm_schemas import REACT_THOUGHT_SCHEMA
+from src.loop_detector import ASK_USER, FRAME_TOLERANCE, NONE, REGROUND, LoopDetector
+from src.metrics import METRICS, StepTimer, activate, phase, site_of
+from src.mission_compiler import MissionLibrary, compile_trajectory, dhash, hamming, page_key
+from src.model_router import ModelRouter, activate_router
+from src.site_knowledge import SITE_KNOWLEDGE
+from src.structured_output import (
+    IncrementalJSONParser, StructuredOutputError, parse_structured, validate_schema,
+)
 
 load_dotenv()
 
+THINK_ERROR_OBSERVATION = "Error analyzing screen"
+
 
 class ReActAgent:
     """
@@ -31,17 +51,21 @@ class ReActAgent:
     4. 繰り返し: ゴールに到達するまで
     """
     
-    def __init__(self, atc, api_key: str = None, remote_click_queue: queue.Queue = None, enable_desktop: bool = True):
+    def __init__(self, atc, api_key: str = None, remote_click_queue: queue.Queue = None, enable_desktop: bool = True,
+                 backend=None, budget: MissionBudget = None):
         """
         Args:
             atc: ATC (Air Traffic Controller) インスタンス - 実際の操作を行う
             api_key: Google API Key
+            backend: LLMBackend (省略時は環境変数から生成。record/replay もここで差し替えられる)
+            budget: ミッションの予算（トークン・コスト・モデル呼び出し回数）。省略時は AIRPORT_BUDGET_* の設定値
         """
         self.atc = atc
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         self.max_steps = 50  # 無限ループ防止（複雑なタスク対応）
         self.collected_data = {}  # 収集したデータ（URL等）
-        self.history = []  # 行動履歴
+        self.history = AgentMemory()  # 行動履歴（直近はそのまま、古いステップは要約してディスクへ）
+        self.memory_spill_path = None  # 古いステップの書き出し先（省略時は results/react_history/）
         self.screenshot_dir = str(REACT_SCREENSHOTS_DIR)
         os.makedirs(self.screenshot_dir, exist_ok=True)
         self.remote_click_queue = remote_click_queue
@@ -51,95 +75,220 @@ class ReActAgent:
         self.desktop_atc = DesktopATC() if enable_desktop else None
         self.current_mode = "web"  # "web" or "desktop"
         
+        # Streaming thoughts (early action dispatch)
+        self.stream_thoughts = REACT_STREAMING
+        self._stream_thread = None
+        self._on_thought_update = None
+        self._on_step_timing = None
+        
         # Human-in-the-Loop用
-        import threading
         self.pause_event = threading.Event()
         self.pause_event.set() # 初期状態は実行中
         self.user_response = None
         self.awaiting_user = False
         
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-3-flash-preview')
-        else:
-            self.model = None
+        self.backend = backend or create_backend(self.api_key)
+        
+        # 使用量の記録（ステップ別・ミッション全体）と予算
+        self.budget = budget or MissionBudget.from_config()
+        self.ledger = UsageLedger(self.budget)
+        
+        # コンパイル済みミッション（成功した軌跡の再生）
+        self.use_compiled = COMPILED_MISSIONS
+        self.missions = MissionLibrary()
+        
+        # 過去の類似フライト（成功した手順）をプロンプトのヒントにする
+        self.use_flight_hints = FLIGHT_HINTS
+        self.flight_hints = []
+        
+        # サイトごとの知識（検索URL・既知の要素・待ち時間）
+        self.use_site_knowledge = SITE_KNOWLEDGE_ENABLED
+        self._offered_knowledge = {}  # (site, kind, key) -> 提示した座標 (locator) / None (search_url)
+        self._used_knowledge = set()
+        
+        # 停滞の検出（同じ操作の繰り返し・画面が変わらない・URLの往復）
+        self.use_loop_detector = LOOP_DETECTOR
+        self.loop_detector = None
+        self._loop_hint = ""
+        
+        # モデルの段の選択（簡単なステップは安いモデル、失敗・低信頼度が続けば強いモデル）
+        self.use_model_router = MODEL_ROUTER
+        self.router = None
+        self._think_route = None  # 結果を報告していない think の (決定, アクション)
+        
+        # 投機的な think（アクション後にページが落ち着いた時点で次の think を先に投げ、画面が同じなら使う）
+        self.speculative_think = REACT_SPECULATIVE
+        self._speculation = None
+        self.speculation_stats = {"started": 0, "used": 0, "discarded": 0}
     
-    def run(self, goal: str, on_step: Callable = None) -> dict:
+    def run(self, goal: str, on_step: Callable = None, on_thought_update: Callable = None,
+            on_step_timing: Callable = None, on_route: Callable = None) -> dict:
         """
         ReActループを実行
         
         Args:
             goal: ユーザーが達成したいこと（自然言語）
             on_step: 各ステップ後に呼ばれるコールバック（進捗通知用）
+            on_thought_update: ストリーミングモードで思考の続き（observation/reasoning）を受信するたびに呼ばれる
+            on_step_timing: 各ステップ終了時にフェーズ別の計測結果 (metrics.StepTimer.as_dict) を受け取る
+            on_route: モデルの段の選択と結果の記録 (model_router.ModelRouter.report) を受け取る
         
         Returns:
             {
                 "success": bool,
                 "steps_taken": int,
-                "history": list,
+                "history": list,  # 直近のステップのみ（全ステップは self.history を iterate）
                 "final_result": str,
-                "video_path": str | None
+                "video_path": str | None,
+                "status": "budget_exceeded" | "stuck",  # 予算超過 / 停滞で打ち切った場合のみ
+                "replay": {...}  # コンパイル済みミッションを再生した場合のみ (_replay_compiled の結果)
             }
+            使用量は self.ledger.summary() で取得できる
         """
         print(f"\n{'='*50}")
         print(f"🎯 ReAct Agent Starting")
         print(f"   Goal: {goal}")
         print(f"{'='*50}\n")
         
-        self.history = []
+        self.history = AgentMemory(spill_path=self.memory_spill_path or os.path.join(
+            str(REACT_HISTORY_DIR), f"history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"))
+        self._on_thought_update = on_thought_update
+        self._on_step_timing = on_step_timing
+        self.ledger = activate_ledger(UsageLedger(self.budget, goal=goal))
+        self.flight_hints = self._find_flight_hints(goal)
+        self._offered_knowledge = {}
+        self._used_knowledge = set()
+        # 人間に助けを求められるのはサーバー経由（Resume できる）の実行だけ
+        self.loop_detector = LoopDetector(can_ask_user=self.remote_click_queue is not None) if self.use_loop_detector else None
+        self._loop_hint = ""
+        # Vision の呼び出し（re-ground・read）もこのスレッドのルーターを使う
+        self.router = ModelRouter(on_record=on_route) if self.use_model_router else None
+        activate_router(self.router or False)
+        self._think_route = None
+        self._speculation = None
+        self.speculation_stats = {"started": 0, "used": 0, "discarded": 0}
         step_count = 0
         video_path = None
+        replay = None
         
         try:
             # ブラウザセッション開始（動画録画も開始）
             if not self.atc.page:
                 self.atc.start_session()
             
+            # 同じゴールのコンパイル済みミッションがあれば、まず再生する
+            mission = self.missions.find(goal) if self.use_compiled else None
+            if mission:
+                replay = self._replay_compiled(mission, on_step)
+                step_count = replay["steps"]
+                self.missions.record_replay(goal, replay["completed"])
+                if replay["completed"]:
+                    # 最終回答は記録を返さず、いまの画面から通常の ReAct で作り直す
+                    print(f"📦 Compiled mission replayed ({step_count} steps). Answering from the current screen")
+                else:
+                    print(f"↪️ Replay diverged at step {replay['diverged_at']} ({replay['reason']}). "
+                          f"Continuing with live ReAct")
+            
             while step_count < self.max_steps:
                 step_count += 1
                 print(f"\n--- Step {step_count}/{self.max_steps} ---")
+                timer = activate(StepTimer(step_count))
+                self.ledger.step = step_count
                 
                 # 1. OBSERVE: 画面をキャプチャ
-                screenshot_path = self._capture_screen(step_count)
+                with phase("capture"):
+                    screenshot_path = self._capture_screen(step_count)
+                    checkpoint = self._checkpoint(screenshot_path) if self.use_compiled or self.loop_detector or self._speculation else None
                 print(f"👁️ Observed: {screenshot_path}")
                 
-                # 2. THINK: AIに次のアクションを決定させる
-                thought = self._think(goal, screenshot_path, step_count)
-                print(f"🧠 Thought: {thought.get('reasoning', 'No reasoning')}")
+                # 2. THINK: AIに次のアクションを決定させる（停滞が続いていればモデルを呼ばずに介入）
+                assessment = self._assess_progress(checkpoint)
+                self._report_think_route(assessment)
+                speculated = self._take_speculation(step_count, checkpoint, assessment)
+                thought = self._loop_intervention(assessment) or speculated
+                if thought is None:
+                    thought = self._think(goal, screenshot_path, step_count)
+                    if assessment and assessment.level >= REGROUND and thought.get("action") == "click":
+                        self._reground_click(thought, screenshot_path)
+                if assessment and assessment.level > NONE:
+                    thought["loop"] = assessment.as_dict()
+                if self.loop_detector:
+                    self.loop_detector.record(thought.get("action"), thought.get("params"))
+                print(f"🧠 Thought: {thought.get('reasoning', '(streaming...)' if self.stream_thoughts else 'No reasoning')}")
                 print(f"📋 Action: {thought.get('action', 'unknown')} - {thought.get('params', {})}")
+                timer.action = thought.get("action")
+                timer.site = self._current_site()
                 
                 # 履歴に追加
-                self.history.append({
+                step_entry = {
                     "step": step_count,
                     "timestamp": datetime.now().isoformat(),
                     "screenshot": screenshot_path,
                     "thought": thought
-                })
-                
-                # コールバック通知
-                if on_step:
-                    on_step(step_count, thought, screenshot_path)
+                }
+                if checkpoint:
+                    step_entry["checkpoint"] = checkpoint
+                if self.current_mode == "web":
+                    step_entry["url"] = self._page_url()
+                with phase("persist"):
+                    self.history.append(step_entry)
+                    
+                    # コールバック通知
+                    if on_step:
+                        on_step(step_count, thought, screenshot_path)
                 
                 # 3. CHECK: ゴール達成 or 完了判定
+                if thought.get("action") in ("done", "fail"):
+                    with phase("inference"):
+                        self._join_stream()  # 最終的な推論まで記録してから終了する
+                    self._end_step(timer, step_entry)
+                    self._report_think_route(ok=thought["action"] == "done")
+
                 if thought.get("action") == "done":
                     print(f"\n✅ Goal achieved!")
+                    self._learn_site_knowledge(True)
+                    if self.use_compiled and not (replay and replay["completed"]):
+                        self._compile_mission(goal)
                     video_path = self.atc.stop_session()
-                    return {
+                    result = {
                         "success": True,
                         "steps_taken": step_count,
-                        "history": self.history,
-                        "final_result": thought.get("result", "Task completed"),
+                        "history": self.history.recent,
+                        "final_result": thought.get("params", {}).get("result") or thought.get("result", "Task completed"),
                         "video_path": video_path
                     }
+                    if replay:
+                        result["replay"] = replay
+                    return result
                 
                 if thought.get("action") == "fail":
                     print(f"\n❌ Agent determined task cannot be completed")
+                    self._learn_site_knowledge(False)
+                    video_path = self.atc.stop_session()
+                    result = {
+                        "success": False,
+                        "steps_taken": step_count,
+                        "history": self.history.recent,
+                        "final_result": thought.get("params", {}).get("reason") or thought.get("reason", "Failed to complete task"),
+                        "video_path": video_path
+                    }
+                    if thought.get("loop", {}).get("level") == "stop":
+                        result["status"] = "stuck"
+                    return result
+                
+                # 予算チェック: 超過したら次のアクションを実行せずに終了
+                budget_reason = self.ledger.exceeded()
+                if budget_reason:
+                    self._join_stream()
+                    self._end_step(timer, step_entry)
+                    print(f"\n💸 Mission budget exceeded: {budget_reason}")
                     video_path = self.atc.stop_session()
                     return {
                         "success": False,
+                        "status": "budget_exceeded",
                         "steps_taken": step_count,
-                        "history": self.history,
-                        "final_result": thought.get("reason", "Failed to complete task"),
+                        "history": self.history.recent,
+                        "final_result": f"Budget exceeded: {budget_reason}",
                         "video_path": video_path
                     }
                 
@@ -169,6 +318,9 @@ class ReActAgent:
                     
                     print(f"▶️ Resuming with user response: {self.user_response}")
                     self.awaiting_user = False
+                    if self.loop_detector:
+                        self.loop_detector.reset()  # 人間が画面を直した可能性があるので数え直す
+                    self._end_step(timer, step_entry)
                     # ユーザーの回答を履歴に追加して、次の思考に役立てる
                     self.history.append({
                         "step": step_count,
@@ -179,33 +331,40 @@ class ReActAgent:
                     # アクション実行はスキップして次のループ（Observe）に戻る
                     continue
 
-                # 4. ACT: アクションを実行
-                # 4. ACT: アクションを実行
-                action_result = self._act(thought)
+                # 4. ACT: アクションを実行（再生・サイト知識用に対象要素の記述子を先に記録）
+                if self.use_compiled or self.use_site_knowledge:
+                    with phase("persist"):
+                        self._record_element(thought, step_entry)
+                        self._note_knowledge_use(thought)
+                with phase("act"):
+                    action_result = self._act(thought)
 
                 # 結果を履歴に保存（次のThinkで使うため）
-                if self.history:
-                    self.history[-1]["action_result"] = action_result
+                step_entry["action_result"] = action_result
                 
-                # アクションに応じた待機
-                if thought.get("action") in ["goto", "click", "key"]:
-                    time.sleep(2)  # ページ遷移を待つ
-                else:
-                    time.sleep(1)
+                # アクションに応じた待機（ページが落ち着いたら次の think を先に投げておく）
+                on_settled = None
+                if self._can_speculate() and step_count < self.max_steps:
+                    on_settled = lambda: self._start_speculation(goal, step_count + 1)
+                self._settle(thought.get("action"), on_settled=on_settled)
+                self._end_step(timer, step_entry)
             
             # 最大ステップ数到達
+            self._join_stream()
             print(f"\n⚠️ Max steps ({self.max_steps}) reached")
+            self._learn_site_knowledge(False)
             video_path = self.atc.stop_session()
             return {
                 "success": False,
                 "steps_taken": step_count,
-                "history": self.history,
+                "history": self.history.recent,
                 "final_result": "Max steps reached without completing goal",
                 "video_path": video_path
             }
             
         except Exception as e:
             print(f"\n💥 Error: {e}")
+            activate(None)
             try:
                 video_path = self.atc.stop_session()
             except:
@@ -213,11 +372,413 @@ class ReActAgent:
             return {
                 "success": False,
                 "steps_taken": step_count,
-                "history": self.history,
+                "history": self.history.recent,
                 "final_result": f"Error: {str(e)}",
                 "video_path": video_path
             }
+        finally:
+            self._discard_speculation()
+            activate_ledger(None)
+            activate_router(None)
     
+    async def run_async(self, goal: str, **callbacks) -> dict:
+        """
+        asyncio から run() を待つ（引数・戻り値は run() と同じ）。
+        エージェントの ATC は同期 API（Playwright の sync API は起動したスレッドに縛られる）なので、
+        ループは止めずにワーカースレッドで実行する。複数のエージェントを 1 つのループから asyncio.gather で並べられる。
+        """
+        return await asyncio.to_thread(self.run, goal, **callbacks)
+
+    def _find_flight_hints(self, goal: str) -> list:
+        """ミッション開始時に 1 回だけ、似たゴールで成功した過去のフライトを引く"""
+        if not self.use_flight_hints or not self.backend:
+            return []
+        try:
+            started = time.time()
+            hints = FLIGHT_INDEX.search(goal, k=FLIGHT_HINTS_K)
+            if hints:
+                print(f"🗂️ {len(hints)} similar past flights found in {(time.time() - started) * 1000:.1f}ms "
+                      f"(best: {hints[0]['score']:.2f} 「{hints[0]['goal']}」)")
+            return hints
+        except Exception as e:
+            print(f"   ⚠️ Flight Index Error: {e}")
+            return []
+
+    def _page_url(self) -> str:
+        return self.atc.page.url if self.atc.page else ""
+
+    def _settle(self, action: str, on_settled: Callable = None):
+        """アクション後の待機。サイト知識があればページが落ち着くまで（学習した時間が上限）"""
+        default = 2 if action in ["goto", "click", "key"] else 1  # ページ遷移を待つ
+        if self.current_mode == "web" and self.atc.page and action in ("goto", "click", "key", "type", "scroll"):
+            self.atc.settle(action, default, use_knowledge=self.use_site_knowledge, on_settled=on_settled)
+        else:
+            with phase("settle"):
+                time.sleep(default)
+
+    # ---- model routing ----
+    def _think_context(self):
+        """ルーティングの文脈: 直前のアクション（送信しなかった type は「入力の直後」）"""
+        for entry in reversed(self.history.recent):
+            thought = entry.get("thought")
+            if thought:
+                action = thought.get("action")
+                if action == "type" and (thought.get("params") or {}).get("submit"):
+                    return "type_submit"
+                return action
+        return None
+
+    def _report_think_route(self, assessment=None, ok: bool = None):
+        """前の think の結果を報告する: アクションがエラーにならず、次の画面で停滞と判定されなければ成功"""
+        if not self._think_route or not self.router:
+            return
+        decision, action = self._think_route
+        self._think_route = None
+        if ok is None:
+            last = next((h for h in reversed(self.history.recent) if h.get("thought")), {})
+            ok = not str(last.get("action_result", "")).startswith("Error executing") and \
+                (assessment is None or assessment.streak == 0)
+        self.router.report(decision, ok, action=action)
+
+    # ---- speculative think ----
+    def _can_speculate(self) -> bool:
+        # ストリーミング中の think・停滞の注意付きのプロンプトは投機しない（次のステップで内容が変わるため）
+        return bool(self.speculative_think and self.backend and not self.stream_thoughts
+                    and self.current_mode == "web" and self.atc.page and not self._loop_hint)
+
+    def _start_speculation(self, goal: str, step: int):
+        """ページが落ち着いた時点の画面で次のステップの think を投げておく（待機の残り・次の観察と並行）"""
+        self._discard_speculation()
+        try:
+            # ページに触る処理（スクリーンショット・プロンプト）はメインスレッドで済ませる
+            with phase("capture"):
+                screenshot_path = self._capture_screen(f"{step}_spec")
+                checkpoint = self._checkpoint(screenshot_path)
+                prompt = self._think_prompt(goal, step)
+        except Exception as e:
+            print(f"   ⚠️ Speculation Error: {e}")
+            return
+        if not checkpoint:
+            return
+        speculation = {"step": step, "checkpoint": checkpoint, "result": None, "started": time.time()}
+        ledger = self.ledger
+
+        def _run():
+            activate_ledger(ledger)
+            try:
+                speculation["result"] = self._ask_model(prompt, screenshot_path, step)
+            finally:
+                speculation["finished"] = time.time()
+                activate_ledger(None)
+
+        speculation["thread"] = threading.Thread(target=_run, daemon=True)
+        speculation["thread"].start()
+        self._speculation = speculation
+        self.speculation_stats["started"] += 1
+        print(f"   ⏩ Speculative think for step {step} started")
+
+    def _take_speculation(self, step: int, checkpoint: dict, assessment):
+        """投機した think が今と同じ画面で考えたものならその思考を返す。違えば捨てて None"""
+        speculation = self._speculation
+        if not speculation:
+            return None
+        expected = speculation["checkpoint"]
+        if speculation["step"] != step:
+            return self._discard_speculation("stale step")
+        if assessment and assessment.level > NONE:
+            return self._discard_speculation(f"no progress: {assessment.name}")
+        if not checkpoint or page_key(expected["url"]) != page_key(checkpoint["url"]):
+            return self._discard_speculation("page changed")
+        distance = hamming(expected["dhash"], checkpoint["dhash"])
+        if distance > FRAME_TOLERANCE:
+            return self._discard_speculation(f"frame changed ({distance} bits)")
+
+        self._speculation = None
+        with phase("inference"):
+            speculation["thread"].join()
+        thought, decision = speculation["result"] or (None, None)
+        if not thought or thought.get("observation") == THINK_ERROR_OBSERVATION:
+            self.speculation_stats["discarded"] += 1
+            print("   ⏩ Speculative think failed, thinking again")
+            return None
+        if decision:
+            self._think_route = (decision, thought.get("action"))
+        self.speculation_stats["used"] += 1
+        ahead = max(0.0, time.time() - speculation["finished"])
+        print(f"   ⏩ Using speculative think (ready {ahead:.2f}s before it was needed)")
+        thought["speculative"] = True
+        return thought
+
+    def _discard_speculation(self, reason: str = None):
+        """投機した think を捨てる（実行中の呼び出しは止められないので、結果を使わないだけ）"""
+        speculation, self._speculation = self._speculation, None
+        if speculation:
+            self.speculation_stats["discarded"] += 1
+            if reason:
+                print(f"   ⏩ Speculative think discarded ({reason})")
+        return None
+
+    # ---- loop detection ----
+    def _assess_progress(self, checkpoint: dict):
+        if not self.loop_detector:
+            return None
+        checkpoint = checkpoint or {}
+        assessment = self.loop_detector.observe(checkpoint.get("url"), checkpoint.get("dhash"))
+        self._loop_hint = self.loop_detector.hint() if assessment.level > NONE else ""
+        if assessment.level > NONE:
+            print(f"🔁 No progress for {assessment.streak} steps ({assessment.name}): {'; '.join(assessment.reasons)}")
+        return assessment
+
+    def _loop_intervention(self, assessment):
+        """停滞が長引いたときに、モデルの代わりに ask_user / fail の思考を返す（それ以外は None）"""
+        if not assessment or assessment.level < ASK_USER:
+            return None
+        if assessment.level == ASK_USER:
+            self.loop_detector.asked_user = True
+            return {
+                "action": "ask_user",
+                "params": {"question": self.loop_detector.question()},
+                "observation": "Loop detected",
+                "reasoning": "; ".join(assessment.reasons),
+            }
+        return {
+            "action": "fail",
+            "params": {"reason": f"Stopped after {assessment.streak} steps without progress: {'; '.join(assessment.reasons)}"},
+            "observation": "Loop detected",
+            "reasoning": "Escalation exhausted (hint, re-grounding, ask_user)",
+        }
+
+    def _reground_click(self, thought: dict, screenshot_path: str):
+        """停滞中の click は、思考の座標ではなく Vision のグラウンディングで座標を取り直す"""
+        params = thought.get("params", {})
+        description = params.get("description")
+        if not description or not self.backend:
+            return
+        x, y, _ = VisionCore(backend=self.backend).analyze_image(screenshot_path, description)
+        if x is None:
+            return
+        print(f"   🎯 Re-grounded click '{description}': ({params.get('x')}, {params.get('y')}) → ({x}, {y})")
+        thought["params"] = {**params, "x": x, "y": y}
+        thought["regrounded"] = True
+
+    # ---- site knowledge ----
+    def _site_knowledge_section(self, goal: str) -> str:
+        """現在のサイト（最初のステップではゴールに出てくるサイト）の既知の検索URL・要素をプロンプト用にまとめる"""
+        if not self.use_site_knowledge or self.current_mode != "web" or not self.atc.page:
+            return ""
+        site = self._current_site()
+        templates = {site: SITE_KNOWLEDGE.search_templates(site)}
+        if not self.history:
+            templates.update(SITE_KNOWLEDGE.templates_for_goal(goal))
+        
+        lines = []
+        for template_site, site_templates in templates.items():
+            for template in site_templates:
+                lines.append(f"- 検索 ({template_site}): goto {template} （{{query}} を検索語に置き換え。トップページを経由しなくてよい）")
+                self._offered_knowledge[(template_site, "search_url", template)] = None
+        for item in SITE_KNOWLEDGE.stable_locators(site):
+            located = self.atc.locate_element(item["element"])
+            if located:
+                x, y = round(located["x"]), round(located["y"])
+                lines.append(f"- 「{item['description']}」: x={x}, y={y}")
+                self._offered_knowledge[(site, "locator", item["description"])] = (x, y)
+        if not lines:
+            return ""
+        return "\n## このサイトの既知情報（過去のミッションから学習）\n" + "\n".join(lines) + \
+            "\n※ 現在の画面と合っていれば、探索せずにそのまま使ってください。\n"
+
+    def _note_knowledge_use(self, thought: dict):
+        """提示した知識をモデルが使ったかを記録する（ミッションの成否で知識を評価するため）"""
+        action = thought.get("action")
+        params = thought.get("params", {})
+        for (site, kind, key), point in self._offered_knowledge.items():
+            if kind == "search_url" and action == "goto":
+                used = str(params.get("url", "")).startswith(key.split("{query}")[0])
+            elif kind == "locator" and action == "click":
+                used = abs(params.get("x", -100) - point[0]) <= 20 and abs(params.get("y", -100) - point[1]) <= 20
+            else:
+                used = False
+            if used:
+                self._used_knowledge.add((site, kind, key))
+
+    def _learn_site_knowledge(self, success: bool):
+        if not self.use_site_knowledge:
+            return
+        try:
+            SITE_KNOWLEDGE.learn_from_react(self.history, success)
+            for site, kind, key in self._used_knowledge:
+                SITE_KNOWLEDGE.report(site, kind, key, success)
+            for site in {site for site, _, _ in self._used_knowledge}:
+                SITE_KNOWLEDGE.record_flight(site, success, used_knowledge=True)
+        except Exception as e:
+            print(f"   ⚠️ Site Knowledge Error: {e}")
+
+    # ---- compiled missions ----
+    def _checkpoint(self, screenshot_path: str) -> dict:
+        """行動前の画面のチェックポイント（URL + dHash）"""
+        url = "desktop" if self.current_mode == "desktop" else self._page_url()
+        try:
+            return {"url": url, "dhash": dhash(screenshot_path)}
+        except Exception as e:
+            print(f"   ⚠️ Checkpoint Error: {e}")
+            return None
+
+    def _record_element(self, thought: dict, step_entry: dict):
+        """click / type の対象要素の記述子を記録する（座標が変わっても再生時に探し直せるように）"""
+        if self.current_mode != "web" or not self.atc.page:
+            return
+        action = thought.get("action")
+        params = thought.get("params", {})
+        try:
+            if action == "click":
+                element = self.atc.describe_element_at(params.get("x", 0), params.get("y", 0))
+            elif action == "type":
+                element = self.atc.describe_focused_element()
+            else:
+                return
+        except Exception as e:
+            print(f"   ⚠️ Element Descriptor Error: {e}")
+            return
+        if element:
+            step_entry["element"] = element
+
+    def _compile_mission(self, goal: str):
+        if not self.history.complete:
+            return  # 古いステップが残っていない軌跡はコンパイルできない
+        try:
+            mission = compile_trajectory(goal, self.history)
+            if mission:
+                self.missions.save(mission)
+        except Exception as e:
+            print(f"   ⚠️ Mission Compile Error: {e}")
+
+    def _replay_compiled(self, mission: dict, on_step: Callable = None) -> dict:
+        """
+        コンパイル済みミッションをモデルを呼ばずに再生する（read のみ画面を聞き直す）。
+        チェックポイントが合わなくなったら、そのステップの手前で止める。
+        最後の done は再生しない: 記録した回答は前回の画面のものなので、通常の ReAct がいまの画面から答える。
+        
+        Returns:
+            {"completed": bool（done の手前まで再生できた）, "steps": 再生したステップ数,
+             "diverged_at": int | None, "reason": str | None}
+        """
+        print(f"📦 Replaying compiled mission ({len(mission['steps'])} steps, compiled {mission.get('compiled_at')})")
+        for index, compiled in enumerate(mission["steps"]):
+            step = index + 1
+            if step > self.max_steps:
+                return {"completed": False, "steps": index,
+                        "diverged_at": step, "reason": "max steps reached"}
+            if compiled["action"] == "done":
+                return {"completed": True, "steps": index, "diverged_at": None, "reason": None}
+            print(f"\n--- Replay Step {step}/{len(mission['steps'])} ---")
+            timer = activate(StepTimer(step, action=compiled["action"]))
+            self.ledger.step = step
+            
+            with phase("capture"):
+                screenshot_path = self._capture_screen(step)
+                checkpoint = self._checkpoint(screenshot_path)
+            timer.site = self._current_site()
+            
+            thought, reason = self._replay_thought(compiled, checkpoint, screenshot_path)
+            if thought is None:
+                # このステップは通常の ReAct が同じステップ番号でやり直す
+                activate(None)
+                return {"completed": False, "steps": index,
+                        "diverged_at": step, "reason": reason}
+            print(f"📋 Action: {thought['action']} - {thought['params']}")
+            
+            step_entry = {
+                "step": step,
+                "timestamp": datetime.now().isoformat(),
+                "screenshot": screenshot_path,
+                "thought": thought,
+                "checkpoint": checkpoint,
+                "replayed": True
+            }
+            if compiled.get("element"):
+                step_entry["element"] = compiled["element"]
+            with phase("persist"):
+                self.history.append(step_entry)
+                if on_step:
+                    on_step(step, thought, screenshot_path)
+            
+            with phase("act"):
+                action_result = self._act(thought)
+            step_entry["action_result"] = action_result
+            self._settle(thought["action"])
+            self._end_step(timer, step_entry)
+            
+            if action_result.startswith("Error executing"):
+                return {"completed": False, "steps": step,
+                        "diverged_at": step + 1, "reason": action_result}
+        
+        return {"completed": False, "steps": len(mission["steps"]),
+                "diverged_at": len(mission["steps"]) + 1, "reason": "mission ended without done"}
+
+    def _replay_thought(self, compiled: dict, checkpoint: dict, screenshot_path: str):
+        """
+        チェックポイントを確かめ、再生するアクションを組み立てる。
+        Returns (thought, None)、画面が記録と違う場合は (None, 理由)
+        """
+        action = compiled["action"]
+        params = dict(compiled.get("params") or {})
+        expected = compiled.get("checkpoint") or {}
+        verify = compiled.get("verify", "screen")
+        
+        if verify != "none":
+            if not checkpoint:
+                return None, "no checkpoint"
+            if page_key(expected.get("url")) != page_key(checkpoint["url"]):
+                return None, f"page changed ({checkpoint['url']})"
+        if verify == "screen":
+            distance = hamming(expected["dhash"], checkpoint["dhash"])
+            if distance > CHECKPOINT_DHASH_THRESHOLD:
+                return None, f"screen changed (dHash distance {distance})"
+        
+        element = compiled.get("element")
+        if element and self.current_mode == "web" and self.atc.page:
+            located = self.atc.locate_element(element)
+            if not located:
+                return None, f"element not found ({element.get('text') or element.get('css')})"
+            if action == "click":
+                params["x"], params["y"] = round(located["x"]), round(located["y"])
+            elif action == "type" and (self.atc.describe_focused_element() or {}).get("css") != element.get("css"):
+                # 入力先にフォーカスが無ければクリックで合わせる
+                self.atc.page.mouse.click(located["x"], located["y"])
+        
+        if action == "read":
+            params["result"] = VisionCore(backend=self.backend).ask_about_image(screenshot_path, params.get("target", ""))
+        
+        thought = {
+            "action": action,
+            "params": params,
+            "observation": "Replayed from compiled mission",
+            "reasoning": f"Checkpoint matched ({verify})",
+            "replayed": True
+        }
+        return thought, None
+
+    def _current_site(self) -> str:
+        if self.current_mode == "desktop":
+            return "desktop"
+        try:
+            return site_of(self.atc.page.url) if self.atc.page else "unknown"
+        except Exception:
+            return "unknown"
+
+    def _end_step(self, timer: StepTimer, step_entry: dict):
+        """ステップの計測を締め、履歴・集計・コールバックに渡す"""
+        activate(None)
+        timing = timer.finish()
+        timing["usage"] = self.ledger.step_totals(timer.step)
+        network = self.atc.network_usage() if self.atc else None
+        if network:
+            timing["network"] = network
+        step_entry["timing"] = timing
+        METRICS.observe_step(timing, kind="react")
+        if self._on_step_timing:
+            self._on_step_timing(timer.step, timing)
+
     def _capture_screen(self, step: int, click_point: tuple = None) -> str:
         """現在の画面をキャプチャ。click_pointがあれば赤丸を描画"""
         path = f"{self.screenshot_dir}/step_{step}_{int(time.time())}.png"
@@ -248,13 +809,37 @@ class ReActAgent:
     def _think(self, goal: str, screenshot_path: str, step: int) -> dict:
         """AIが画面を見て次のアクションを決定"""
         
-        if not self.model:
+        if not self.backend:
             # Mock mode
             return self._mock_think(goal, step)
         
+        thought, decision = self._ask_model(self._think_prompt(goal, step), screenshot_path, step, stream=self.stream_thoughts)
+        if decision:
+            # 結果（アクションが効いたか）は次の観察で報告する
+            self._think_route = (decision, thought.get("action"))
+        return thought
+
+    def _think_prompt(self, goal: str, step: int) -> str:
+        """思考プロンプト（ページを読むのでメインスレッドで組み立てる）"""
         # 過去の行動履歴をまとめる
         history_summary = self._format_history()
         
+        # このサイトについて学習済みの検索URL・要素
+        with phase("capture"):
+            site_section = self._site_knowledge_section(goal)
+        
+        # 停滞しているときの注意
+        loop_section = f"\n## 注意: 進展が止まっています\n{self._loop_hint}\n" if self._loop_hint else ""
+        
+        # 似たゴールで過去に成功した手順（あれば）
+        hints_section = ""
+        if self.flight_hints:
+            hints_section = f"""
+## 参考: 似たミッションで過去に成功した手順
+{format_hints(self.flight_hints)}
+※ 画面が同じとは限りません。現在の画面で確かめてから使い、使える部分は探索を省いてください。
+"""
+        
         prompt = f"""あなたは自律型GUIエージェントです。画面を見て、ゴールを達成するために次に何をすべきか決定してください。
 
 ## ゴール
@@ -262,7 +847,7 @@ class ReActAgent:
 
 ## これまでの行動履歴
 {history_summary}
-
+{loop_section}{hints_section}{site_section}
 ## 重要: ユーザーの回答があれば、それに従って行動してください
 履歴に「👤 ユーザーの回答:」がある場合、その内容を最優先で考慮してください。
 同じ質問を繰り返さないでください。ユーザーが回答したら、その内容に基づいて次のアクション（検索、移動など）を実行してください。
@@ -336,11 +921,12 @@ class ReActAgent:
 以下のJSON形式で出力してください。JSONのみを出力し、他の説明は不要です。
 
 {{
-    "observation": "現在の画面に何が見えるかの説明",
-    "reasoning": "なぜこのアクションを選ぶのかの推論",
     "action": "アクション名",
-    "params": {{...アクションのパラメータ...}}
+    "params": {{...アクションのパラメータ...}},
+    "observation": "現在の画面に何が見えるかの説明",
+    "reasoning": "なぜこのアクションを選ぶのかの推論"
 }}
+※ キーは必ずこの順番（action → params → observation → reasoning）で出力してください
 
 ## 重要なルール
 - 画像をよく見て、現在の状態を正確に把握してください
@@ -351,29 +937,117 @@ class ReActAgent:
 - ゴールに近づくための最短ルートを考えてください
 - 迷ったらwaitして状況を観察してください
 """
+        return prompt
 
+    def _ask_model(self, prompt: str, screenshot_path: str, step: int, stream: bool = False):
+        """
+        プロンプトと画面から思考を得る。(thought, ルーティングの決定) を返す。
+        失敗したときは wait の思考と None（決定は失敗として報告済み）
+        """
+        decision = self.router.choose("think", self._think_context()) if self.router else None
+        model = decision.model if decision else None
+        if decision and decision.reason != "base":
+            print(f"   🧭 Think model: {model} ({decision.reason})")
         try:
-            img = Image.open(screenshot_path)
-            response = self.model.generate_content([prompt, img])
-            text = response.text.strip()
-            
-            # Extract JSON
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0].strip()
-            
-            return json.loads(text)
+            with phase("encode"):
+                img = Image.open(screenshot_path)
+            try:
+                if stream:
+                    thought = self._think_streaming([prompt, img], step, model=model)
+                else:
+                    thought = generate_json(self.backend, [prompt, img], REACT_THOUGHT_SCHEMA, "react_thought", model=model)
+            except StructuredOutputError as e:
+                # 修復できない出力だった場合は、ステップを無駄にせず一度だけ聞き直す
+                print(f"   ⚠️ Invalid thought JSON ({e}). Re-asking once...")
+                record_retry()
+                retry_prompt = prompt + "\n\n前回の出力は上記のJSON形式として不正でした。JSONオブジェクトのみを出力してください。"
+                thought = generate_json(self.backend, [retry_prompt, img], REACT_THOUGHT_SCHEMA, "react_thought", model=model)
+            if decision:
+                decision.done()
+            return thought, decision
             
         except Exception as e:
             print(f"Think Error: {e}")
+            if decision:
+                self.router.report(decision, ok=False, error=str(e)[:200])
             return {
-                "observation": "Error analyzing screen",
+                "observation": THINK_ERROR_OBSERVATION,
                 "reasoning": f"Error: {str(e)}",
                 "action": "wait",
                 "params": {"seconds": 2}
-            }
+            }, None
     
+    def _think_streaming(self, contents: list, step: int, model: str = None) -> dict:
+        """
+        思考をストリーミングで受信し、action/params が揃った時点で返す（早期ディスパッチ）。
+        observation / reasoning はバックグラウンドで受信を続け、返した dict に追記される。
+        """
+        with phase("queue"):
+            self._join_stream()
+
+        started = time.time()
+        response = self.backend.generate(contents, stream=True, model=model)
+        parser = IncrementalJSONParser()
+        thought = {}
+        ready = threading.Event()
+        errors = []
+        chunks = []
+
+        def _consume():
+            try:
+                for chunk in response:
+                    chunks.append(chunk)
+                    parser.feed(chunk)
+
+                    partial = parser.snapshot() or {}
+                    for key in ("observation", "reasoning"):
+                        if isinstance(partial.get(key), str):
+                            thought[key] = partial[key]
+
+                    if not ready.is_set():
+                        members = parser.members()
+                        if "action" in members and "params" in members:
+                            thought.update(validate_schema(
+                                {"action": members["action"], "params": members["params"]},
+                                REACT_THOUGHT_SCHEMA,
+                            ))
+                            thought["time_to_action"] = round(time.time() - started, 3)
+                            ready.set()
+
+                    if ready.is_set() and self._on_thought_update:
+                        self._on_thought_update(step, thought)
+
+                final = parse_structured("".join(chunks), REACT_THOUGHT_SCHEMA, "react_thought")
+                if ready.is_set():
+                    # ディスパッチ済みの action/params は変更しない
+                    thought.update({k: v for k, v in final.items() if k not in ("action", "params")})
+                else:
+                    thought.update(final)
+                    thought["time_to_action"] = round(time.time() - started, 3)
+                thought["think_time"] = round(time.time() - started, 3)
+                if self._on_thought_update:
+                    self._on_thought_update(step, thought)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                ready.set()
+
+        self._stream_thread = threading.Thread(target=_consume, daemon=True)
+        self._stream_thread.start()
+        with phase("inference"):
+            ready.wait()
+
+        if "action" not in thought:
+            self._join_stream()
+            raise errors[0] if errors else StructuredOutputError("Stream ended without an action")
+        return thought
+
+    def _join_stream(self, timeout: float = 30):
+        """前ステップの思考ストリームの受信完了を待つ"""
+        if self._stream_thread and self._stream_thread.is_alive():
+            self._stream_thread.join(timeout)
+        self._stream_thread = None
+
     def _act(self, thought: dict) -> str:
         """決定されたアクションを実行し、結果メッセージを返す"""
         action = thought.get("action", "wait")
@@ -581,7 +1255,12 @@ class ReActAgent:
             return "(まだ行動していません)"
         
         lines = []
-        for h in self.history[-7:]:  # 直近7ステップ（ユーザー介入を含むため増やす）
+        summary = self.history.summary_text()
+        if summary:
+            # 古いステップは要約と事実だけ（プロンプトの長さはステップ数によらず一定）
+            lines.append(summary)
+            lines.append("直近のステップ:")
+        for h in self.history.recent:  # 直近のステップ（ユーザー介入を含む）
             if h.get("role") == "user_intervention":
                 # ユーザーからの回答
                 lines.append(f"👤 ユーザーの回答: 「{h.get('response', '')}」")
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -11,7 +11,13 @@ import time
 import threading
 import tempfile
 from .history_manager import HistoryManager
-from src.config import RESULTS_DIR, REACT_SCREENSHOTS_DIR, VIDEOS_DIR
+from .metrics import METRICS, parse_timing_line
+from .accounting import USAGE_TOTALS, MissionBudget, parse_usage_line
+from .profiler import PROFILE_FILE, SamplingProfiler, profiler_env
+from .model_router import ROUTER_STATS, parse_route_line
+from .autopilot import ENGINES, EXECUTION_PROFILES, SESSION_POLICIES, parse_suite_line
+from .browsing import BROWSING_PROFILES
+from src.config import MODEL_ROUTER, MODEL_TIERS, RESULTS_DIR, REACT_SCREENSHOTS_DIR, REACT_STEPS_LIMIT, VIDEOS_DIR
 
 # Initialize API and History Manager
 app = FastAPI(title="Airport Cockpit API")
@@ -33,6 +39,7 @@ app.add_middleware(
 
 # Task State
 CURRENT_PROCESS = None
+PROCESS_SLOT = threading.Lock()  # サブプロセスのミッションは同時に1つまで
 CURRENT_FLIGHT_ID = None
 LOG_FILE = str(RESULTS_DIR / "server_execution.log")
 
@@ -44,8 +51,86 @@ REMOTE_CLICK_QUEUE = queue.Queue()
 class RunRequest(BaseModel):
     mode: str # "web", "desktop", "weather_demo"
     scenario: Optional[str] = None
-
-def run_process_wrapper(command: List[str], flight_id: str):
+    record_llm: Optional[bool] = False      # LLMの入出力をフライトのテープに記録
+    replay_flight: Optional[str] = None     # 指定フライトのテープからLLM応答を再生（オフライン）
+    max_tokens: Optional[int] = None        # ミッション予算（省略時は AIRPORT_BUDGET_* の設定値）
+    max_cost: Optional[float] = None
+    max_model_calls: Optional[int] = None
+    profile: Optional[bool] = False         # サンプリングプロファイラで profile.collapsed を記録
+    profile_hz: Optional[int] = None        # 省略時は AIRPORT_PROFILER_HZ
+    model_router: Optional[bool] = None     # モデルの段の自動選択（省略時は AIRPORT_MODEL_ROUTER）
+    workers: Optional[int] = None           # 独立したタスクの並列数（省略時はプランの workers: / AIRPORT_AUTOPILOT_WORKERS）
+    session_policy: Optional[str] = None    # "task" / "worker"（省略時は AIRPORT_AUTOPILOT_SESSION）
+    execution_profile: Optional[str] = None # クリックの実行プロファイル fast / audit / debug（省略時は AIRPORT_EXECUTION_PROFILE）
+    engine: Optional[str] = None            # "sync" / "async"（1 つのイベントループで並列実行。省略時は AIRPORT_AUTOPILOT_ENGINE）
+    browsing: Optional[str] = None          # ブラウジングプロファイル full / lite / text（省略時は AIRPORT_BROWSING_PROFILE）
+    profile_store: Optional[bool] = None    # 共有 HTTP キャッシュと保存したログインの再利用（省略時は AIRPORT_PROFILE_STORE）
+
+LLM_TAPE_FILE = "llm_tape.jsonl"
+
+def budget_env(req) -> dict:
+    """サブプロセス用: リクエストで指定されたミッション予算を環境変数で渡す"""
+    env = {}
+    for field, name in (("max_tokens", "AIRPORT_BUDGET_MAX_TOKENS"),
+                        ("max_cost", "AIRPORT_BUDGET_MAX_COST"),
+                        ("max_model_calls", "AIRPORT_BUDGET_MAX_CALLS")):
+        value = getattr(req, field, None)
+        if value is not None:
+            env[name] = str(value)
+    return env
+
+def llm_backend_env(flight_id: str, record_llm: bool = False, replay_flight: Optional[str] = None) -> dict:
+    """サブプロセス用: LLMバックエンド選択を環境変数で渡す"""
+    if replay_flight:
+        tape = history_mgr.flight_path(replay_flight, LLM_TAPE_FILE)
+        if not os.path.exists(tape):
+            raise HTTPException(status_code=404, detail=f"No LLM tape recorded for {replay_flight}")
+        return {"AIRPORT_LLM_BACKEND": "replay", "AIRPORT_LLM_TAPE": tape}
+    if record_llm:
+        return {"AIRPORT_LLM_BACKEND": "record", "AIRPORT_LLM_TAPE": history_mgr.flight_path(flight_id, LLM_TAPE_FILE)}
+    return {}
+
+def router_env(req) -> dict:
+    """サブプロセス用: モデルルーターの有効・無効を環境変数で渡す"""
+    value = getattr(req, "model_router", None)
+    return {} if value is None else {"AIRPORT_MODEL_ROUTER": "1" if value else "0"}
+
+def autopilot_env(req) -> dict:
+    """サブプロセス用: 並列数・ブラウザの再利用方針・実行プロファイル・エンジン・ブラウジング・プロファイルストアを環境変数で渡す"""
+    env = {}
+    if getattr(req, "workers", None):
+        env["AIRPORT_AUTOPILOT_WORKERS"] = str(req.workers)
+    if getattr(req, "session_policy", None):
+        if req.session_policy not in SESSION_POLICIES:
+            raise HTTPException(status_code=400, detail=f"session_policy must be one of {', '.join(SESSION_POLICIES)}")
+        env["AIRPORT_AUTOPILOT_SESSION"] = req.session_policy
+    if getattr(req, "execution_profile", None):
+        if req.execution_profile not in EXECUTION_PROFILES:
+            raise HTTPException(status_code=400, detail=f"execution_profile must be one of {', '.join(EXECUTION_PROFILES)}")
+        env["AIRPORT_EXECUTION_PROFILE"] = req.execution_profile
+    if getattr(req, "engine", None):
+        if req.engine not in ENGINES:
+            raise HTTPException(status_code=400, detail=f"engine must be one of {', '.join(ENGINES)}")
+        env["AIRPORT_AUTOPILOT_ENGINE"] = req.engine
+    if getattr(req, "browsing", None):
+        check_browsing(req.browsing)
+        env["AIRPORT_BROWSING_PROFILE"] = req.browsing
+    if getattr(req, "profile_store", None) is not None:
+        env["AIRPORT_PROFILE_STORE"] = "1" if req.profile_store else "0"
+    return env
+
+def check_browsing(browsing: Optional[str]):
+    if browsing and browsing not in BROWSING_PROFILES:
+        raise HTTPException(status_code=400, detail=f"browsing must be one of {', '.join(BROWSING_PROFILES)}")
+
+def worker_profile_env(flight_id: str, req) -> dict:
+    """サブプロセス用: プロファイル指定時はワーカーが自分自身をサンプリングする"""
+    if not getattr(req, "profile", False):
+        return {}
+    history_mgr.log_event(flight_id, "SYSTEM", "Sampling profiler enabled for worker process")
+    return profiler_env(history_mgr.flight_path(flight_id, PROFILE_FILE), req.profile_hz)
+
+def run_process_wrapper(command: List[str], flight_id: str, extra_env: Optional[dict] = None):
     global CURRENT_PROCESS
     
     # Log start
@@ -53,6 +138,7 @@ def run_process_wrapper(command: List[str], flight_id: str):
     
     # Ensure results dir exists
     os.makedirs(str(RESULTS_DIR), exist_ok=True)
+    budget_stop = None
     
     with open(LOG_FILE, "w", encoding="utf-8") as f:
         def log_line(message: str, event_type: str = "ACTION"):
@@ -69,20 +155,48 @@ def run_process_wrapper(command: List[str], flight_id: str):
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 cwd="/workspaces/Airport",
-                env={**os.environ, "PYTHONPATH": f"{os.environ.get('PYTHONPATH', '')}:."},
+                env={**os.environ, "PYTHONPATH": f"{os.environ.get('PYTHONPATH', '')}:.", **(extra_env or {})},
                 text=True,
                 bufsize=1
             )
             
             # Real-time logging
             for line in iter(CURRENT_PROCESS.stdout.readline, ''):
+                timing = parse_timing_line(line)
+                if timing:
+                    # autopilot のステップ計測はメトリクスに集計し、TIMING イベントとして記録
+                    METRICS.observe_step(timing, kind="autopilot")
+                    history_mgr.log_event(flight_id, "TIMING", json.dumps(timing, ensure_ascii=False))
+                    continue
+                route = parse_route_line(line)
+                if route:
+                    # モデルの段の選択と結果（ポリシー調整用）
+                    ROUTER_STATS.observe(route)
+                    history_mgr.log_event(flight_id, "ROUTE", json.dumps(route, ensure_ascii=False))
+                    continue
+                suite = parse_suite_line(line)
+                if suite:
+                    # タスクごとの結果と並列実行の集計（壁時計時間 vs タスク時間の合計）
+                    history_mgr.update_metadata(flight_id, suite=suite)
+                    log_line(f"[SYSTEM] Suite: {suite['passed']}/{suite['tasks']} passed in {suite['wall_time']}s "
+                             f"(task time {suite['task_time']}s, {suite['workers']} workers)", "SYSTEM")
+                    continue
+                usage = parse_usage_line(line)
+                if usage:
+                    # ミッション全体の使用量はフライトのメタデータに保存
+                    budget_stop = usage.get("stopped_by_budget")
+                    history_mgr.update_metadata(flight_id, usage=usage)
+                    history_mgr.log_event(flight_id, "USAGE", json.dumps(usage["totals"], ensure_ascii=False))
+                    continue
                 log_line(line, "ACTION")
             
             CURRENT_PROCESS.stdout.close()
             return_code = CURRENT_PROCESS.wait()
             
             status = "COMPLETED" if return_code == 0 else "FAILED"
-            msg = f"Mission finished with code {return_code}"
+            if budget_stop:
+                status = "BUDGET_EXCEEDED"
+            msg = f"Mission finished with code {return_code}" + (f" ({budget_stop})" if budget_stop else "")
             
             log_line(f"[SYSTEM] {msg}", "SYSTEM")
             history_mgr.end_flight(flight_id, status)
@@ -101,6 +215,7 @@ def run_process_wrapper(command: List[str], flight_id: str):
             except Exception as cleanup_err:
                 log_line(f"[WARN] Temp plan cleanup failed: {cleanup_err}", "SYSTEM")
             CURRENT_PROCESS = None
+            PROCESS_SLOT.release()
 
 @app.get("/api/status")
 def get_status():
@@ -112,9 +227,6 @@ def get_status():
 def run_mission(req: RunRequest, background_tasks: BackgroundTasks):
     global CURRENT_PROCESS, CURRENT_FLIGHT_ID
     
-    if CURRENT_PROCESS and CURRENT_PROCESS.poll() is None:
-        raise HTTPException(status_code=400, detail="Mission already in progress")
-
     command = []
     if req.mode == "web":
         if not req.scenario:
@@ -127,11 +239,26 @@ def run_mission(req: RunRequest, background_tasks: BackgroundTasks):
     else:
         raise HTTPException(status_code=400, detail="Invalid mode")
     
+    if not PROCESS_SLOT.acquire(blocking=False):
+        raise HTTPException(status_code=400, detail="Mission already in progress")
+    
     # Initialize Flight Recorder
-    CURRENT_FLIGHT_ID = history_mgr.start_flight()
+    try:
+        CURRENT_FLIGHT_ID = history_mgr.start_flight()
+        history_mgr.update_metadata(CURRENT_FLIGHT_ID, mission=req.scenario or req.mode)
+        extra_env = {
+            **llm_backend_env(CURRENT_FLIGHT_ID, req.record_llm, req.replay_flight),
+            **budget_env(req),
+            **router_env(req),
+            **autopilot_env(req),
+            **worker_profile_env(CURRENT_FLIGHT_ID, req),
+        }
+    except Exception:
+        PROCESS_SLOT.release()
+        raise
     
     # Run in background
-    background_tasks.add_task(run_process_wrapper, command, CURRENT_FLIGHT_ID)
+    background_tasks.add_task(run_process_wrapper, command, CURRENT_FLIGHT_ID, extra_env)
     
     return {"message": f"Mission {req.mode} started", "flight_id": CURRENT_FLIGHT_ID}
 
@@ -148,12 +275,20 @@ def get_flights():
     """過去のフライト一覧を取得"""
     return {"flights": history_mgr.get_all_flights()}
 
+FLIGHT_ARTIFACTS = {"profile": PROFILE_FILE, "llm_tape": LLM_TAPE_FILE}
+
 @app.get("/api/flights/{flight_id}")
 def get_flight_details(flight_id: str):
-    """特定のフライトの詳細ログを取得"""
+    """特定のフライトの詳細ログを取得（プロファイル・LLMテープがあればそのURLも返す）"""
+    artifacts = {}
+    for name, filename in FLIGHT_ARTIFACTS.items():
+        path = history_mgr.flight_path(flight_id, filename)
+        if os.path.exists(path):
+            artifacts[name] = path.replace(str(RESULTS_DIR), "/static/results")
     return {
         "metadata": history_mgr._load_json(flight_id, "metadata.json"),
-        "logs": history_mgr.get_flight_data(flight_id)
+        "logs": history_mgr.get_flight_data(flight_id),
+        "artifacts": artifacts,
     }
 
 @app.get("/api/videos")
@@ -178,6 +313,8 @@ def stream_video(filename: str):
 # ============================================
 
 from .llm_core import VisionCore, Attendant
+from .structured_output import PARSE_STATS
+from .llm_backend import HEDGE_STATS, LLM_CALL_STATS
 import yaml
 import json
 
@@ -196,6 +333,17 @@ class ChatMissionRequest(BaseModel):
 class ExecutePlanRequest(BaseModel):
     plan: list
     summary: Optional[str] = None
+    record_llm: Optional[bool] = False
+    replay_flight: Optional[str] = None
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    max_model_calls: Optional[int] = None
+    profile: Optional[bool] = False
+    profile_hz: Optional[int] = None
+    model_router: Optional[bool] = None
+    execution_profile: Optional[str] = None  # クリックの実行プロファイル（省略時は AIRPORT_EXECUTION_PROFILE）
+    browsing: Optional[str] = None  # ブラウジングプロファイル（省略時は AIRPORT_BROWSING_PROFILE）
+    profile_store: Optional[bool] = None  # 共有 HTTP キャッシュと保存したログイン（省略時は AIRPORT_PROFILE_STORE）
 
 @app.post("/api/chat")
 def chat_with_attendant(req: ChatRequest):
@@ -240,8 +388,9 @@ def execute_plan(req: ExecutePlanRequest, background_tasks: BackgroundTasks):
     """
     global CURRENT_PROCESS, CURRENT_FLIGHT_ID
     
-    if CURRENT_PROCESS and CURRENT_PROCESS.poll() is None:
+    if not PROCESS_SLOT.acquire(blocking=False):
         raise HTTPException(status_code=400, detail="Mission already in progress")
+    PROCESS_SLOT.release()  # 枠の確保はYAML生成後に行う（ここでは早期に弾くだけ）
     
     # Convert plan to YAML format for autopilot
     yaml_content = {
@@ -287,13 +436,30 @@ def execute_plan(req: ExecutePlanRequest, background_tasks: BackgroundTasks):
         yaml.safe_dump(yaml_content, tmp, allow_unicode=True, default_flow_style=False)
         dynamic_yaml_path = tmp.name
     
+    if not PROCESS_SLOT.acquire(blocking=False):
+        os.remove(dynamic_yaml_path)
+        raise HTTPException(status_code=400, detail="Mission already in progress")
+    
     # Initialize Flight Recorder
-    CURRENT_FLIGHT_ID = history_mgr.start_flight()
-    history_mgr.log_event(CURRENT_FLIGHT_ID, "PLAN", json.dumps(req.plan, ensure_ascii=False))
+    try:
+        CURRENT_FLIGHT_ID = history_mgr.start_flight()
+        history_mgr.log_event(CURRENT_FLIGHT_ID, "PLAN", json.dumps(req.plan, ensure_ascii=False))
+        history_mgr.update_metadata(CURRENT_FLIGHT_ID, mission=req.summary or "Dynamic Mission")
+        extra_env = {
+            **llm_backend_env(CURRENT_FLIGHT_ID, req.record_llm, req.replay_flight),
+            **budget_env(req),
+            **router_env(req),
+            **autopilot_env(req),
+            **worker_profile_env(CURRENT_FLIGHT_ID, req),
+        }
+    except Exception:
+        PROCESS_SLOT.release()
+        os.remove(dynamic_yaml_path)
+        raise
     
     # Run autopilot with generated YAML
     command = ["python", "run_airport.py", "web", dynamic_yaml_path]
-    background_tasks.add_task(run_process_wrapper, command, CURRENT_FLIGHT_ID)
+    background_tasks.add_task(run_process_wrapper, command, CURRENT_FLIGHT_ID, extra_env)
     
     return {
         "message": "Mission started",
@@ -306,13 +472,66 @@ def get_current_plan():
     """現在のプランを取得"""
     return CURRENT_PLAN or {"plan": [], "summary": "No plan generated yet"}
 
+@app.get("/api/llm/stats")
+def get_llm_stats():
+    """構造化出力のパース統計（修復回数・失敗回数など）とLLM呼び出し統計"""
+    return {"parse": PARSE_STATS.snapshot(), "calls": LLM_CALL_STATS.snapshot(), "usage": USAGE_TOTALS.totals(),
+            "hedging": HEDGE_STATS.snapshot()}
+
+@app.get("/api/usage")
+def get_usage():
+    """LLM使用量（トークン・バイト・推定コスト）: プロセス全体とゴール（ミッション）別"""
+    return {"process": USAGE_TOTALS.summary(), "by_goal": history_mgr.usage_by_goal()}
+
+@app.get("/api/metrics")
+def get_metrics():
+    """ステップのフェーズ別時間ヒストグラムとLLM統計 (Prometheus text format)"""
+    calls = LLM_CALL_STATS.snapshot()
+    extra = [
+        ("airport_llm_calls_total", "counter", "LLM calls.", calls["calls"], None),
+        ("airport_llm_errors_total", "counter", "Failed LLM calls.", calls["errors"], None),
+        ("airport_llm_bytes_uploaded_total", "counter", "Prompt and image bytes sent to the LLM.", calls["bytes_uploaded"], None),
+        ("airport_llm_latency_seconds_total", "counter", "Total LLM call latency.", calls["latency_total"], None),
+    ]
+    usage = USAGE_TOTALS.totals()
+    for direction in ("input", "output"):
+        extra.append(("airport_llm_tokens_total", "counter", "LLM tokens (estimated when usage metadata is missing).",
+                      usage[f"{direction}_tokens"], {"direction": direction}))
+    extra.append(("airport_llm_retries_total", "counter", "LLM call retries.", usage["retries"], None))
+    extra.append(("airport_llm_cost_usd_total", "counter", "Estimated LLM cost in USD.", usage["cost"], None))
+    for schema, counts in PARSE_STATS.snapshot()["schemas"].items():
+        for event, count in counts.items():
+            extra.append(("airport_llm_parse_events_total", "counter", "Structured output parse events.",
+                          count, {"schema": schema, "event": event}))
+    # 同じメトリクスのサンプルは続けて出す（Prometheus の text format はファミリーごとにまとまっている必要がある）
+    router_rows = ROUTER_STATS.snapshot()
+    for row in router_rows:
+        extra.append(("airport_llm_routed_calls_total", "counter", "Model router decisions by call kind and model.",
+                      row["calls"], {"kind": row["kind"], "model": row["model"]}))
+    for row in router_rows:
+        extra.append(("airport_llm_routed_misses_total", "counter", "Routed calls that failed or had low confidence.",
+                      row["misses"], {"kind": row["kind"], "model": row["model"]}))
+    for event, count in HEDGE_STATS.snapshot().items():
+        extra.append(("airport_llm_hedge_events_total", "counter", "Hedged LLM call events.", count, {"event": event}))
+    return PlainTextResponse(METRICS.render_prometheus(extra), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/model_router")
+def get_model_router():
+    """モデルの段の設定と、kind × model ごとの結果（失敗率・平均信頼度）"""
+    return {"enabled": MODEL_ROUTER, "tiers": MODEL_TIERS, "stats": ROUTER_STATS.snapshot()}
+
 
 # ============================================
 # ReAct Agent Endpoints (Autonomous Mode)
 # ============================================
 
 from .react_agent import ReActAgent
+from .agent_memory import SPILL_FILE
+from .mission_compiler import MissionLibrary
+from .flight_index import FLIGHT_INDEX, index_flight
+from .site_knowledge import SITE_KNOWLEDGE
 from .main import ATC
+from .llm_backend import create_backend, RecordingBackend, ReplayBackend
 
 # ReAct state
 REACT_AGENT = None
@@ -323,19 +542,72 @@ REACT_STEPS = []
 class ReActRequest(BaseModel):
     goal: str
     max_steps: Optional[int] = 50
-
-def run_react_wrapper(goal: str, flight_id: str, max_steps: int = 50):
+    stream: Optional[bool] = None  # None = config default (AIRPORT_REACT_STREAMING)
+    record_llm: Optional[bool] = False
+    replay_flight: Optional[str] = None
+    replay_latency: Optional[float] = 0.0
+    max_tokens: Optional[int] = None
+    max_cost: Optional[float] = None
+    max_model_calls: Optional[int] = None
+    profile: Optional[bool] = False
+    profile_hz: Optional[int] = None
+    use_compiled: Optional[bool] = None  # None = config default (AIRPORT_COMPILED_MISSIONS)
+    flight_hints: Optional[bool] = None  # None = config default (AIRPORT_FLIGHT_HINTS)
+    site_knowledge: Optional[bool] = None  # None = config default (AIRPORT_SITE_KNOWLEDGE)
+    model_router: Optional[bool] = None  # None = config default (AIRPORT_MODEL_ROUTER)
+    speculative: Optional[bool] = None  # None = config default (AIRPORT_REACT_SPECULATIVE)
+    browsing: Optional[str] = None  # None = config default (AIRPORT_BROWSING_PROFILE)
+    profile_store: Optional[bool] = None  # None = config default (AIRPORT_PROFILE_STORE): shared HTTP cache
+
+def build_react_backend(flight_id: str, req: "ReActRequest"):
+    """ReAct用のLLMバックエンド（記録 / 再生 / 通常）"""
+    if req.replay_flight:
+        tape = history_mgr.flight_path(req.replay_flight, LLM_TAPE_FILE)
+        if not os.path.exists(tape):
+            raise HTTPException(status_code=404, detail=f"No LLM tape recorded for {req.replay_flight}")
+        return ReplayBackend(tape, latency=req.replay_latency or 0.0)
+    backend = create_backend()
+    if req.record_llm and backend:
+        return RecordingBackend(backend, history_mgr.flight_path(flight_id, LLM_TAPE_FILE))
+    return backend
+
+def run_react_wrapper(goal: str, flight_id: str, max_steps: int = 50, stream: Optional[bool] = None, backend=None,
+                      budget: Optional[MissionBudget] = None, profiler: Optional[SamplingProfiler] = None,
+                      use_compiled: Optional[bool] = None, flight_hints: Optional[bool] = None,
+                      site_knowledge: Optional[bool] = None, model_router: Optional[bool] = None,
+                      speculative: Optional[bool] = None, browsing: Optional[str] = None,
+                      profile_store: Optional[bool] = None):
     """ReActエージェントをバックグラウンドで実行"""
     global REACT_AGENT, REACT_RESULT, REACT_RUNNING, REACT_STEPS
     
     REACT_RUNNING = True
     REACT_STEPS = []
+    agent = None
+    if profiler:
+        # エージェントのスレッドに加え、サーバーの他のスレッド（ロック待ちなど）もサンプリングする
+        profiler.start()
     
     try:
-        atc = ATC()
-        agent = ReActAgent(atc, remote_click_queue=REMOTE_CLICK_QUEUE)
+        atc = ATC(browsing=browsing)
+        if profile_store is not None:
+            atc.shared_cache = profile_store
+        agent = ReActAgent(atc, remote_click_queue=REMOTE_CLICK_QUEUE, backend=backend, budget=budget)
         if max_steps:
             agent.max_steps = max_steps
+        if stream is not None:
+            agent.stream_thoughts = stream
+        if use_compiled is not None:
+            agent.use_compiled = use_compiled
+        if flight_hints is not None:
+            agent.use_flight_hints = flight_hints
+        if site_knowledge is not None:
+            agent.use_site_knowledge = site_knowledge
+        if model_router is not None:
+            agent.use_model_router = model_router
+        if speculative is not None:
+            agent.speculative_think = speculative
+        # 古いステップの完全な記録はフライトの Black Box と同じディレクトリへ
+        agent.memory_spill_path = history_mgr.flight_path(flight_id, SPILL_FILE)
         REACT_AGENT = agent
         
         # コールバックで各ステップをログに記録
@@ -346,23 +618,83 @@ def run_react_wrapper(goal: str, flight_id: str, max_steps: int = 50):
                 "reasoning": thought.get("reasoning", ""),
                 "action": thought.get("action", ""),
                 "params": thought.get("params", {}),
+                "time_to_action": thought.get("time_to_action"),
+                "replayed": thought.get("replayed", False),
+                "loop": thought.get("loop"),
+                "speculative": thought.get("speculative", False),
                 "screenshot": screenshot.replace("/workspaces/Airport/results", "/static/results") if screenshot else None
             }
             REACT_STEPS.append(step_data)
+            # UI 用には直近のステップだけ保持する（全ステップは Black Box の REACT イベント）
+            del REACT_STEPS[:-REACT_STEPS_LIMIT]
             history_mgr.log_event(flight_id, "REACT", json.dumps(step_data, ensure_ascii=False))
         
-        result = agent.run(goal, on_step=on_step)
+        # ストリーミングモード: 行動開始後に届いた observation / reasoning をUIに反映
+        def on_thought_update(step_num, thought):
+            for step_data in reversed(REACT_STEPS):
+                if step_data["step"] == step_num:
+                    step_data["observation"] = thought.get("observation", "")
+                    step_data["reasoning"] = thought.get("reasoning", "")
+                    step_data["think_time"] = thought.get("think_time")
+                    break
+            if thought.get("think_time") is not None:
+                history_mgr.log_event(flight_id, "THOUGHT", json.dumps({
+                    "step": step_num,
+                    "observation": thought.get("observation", ""),
+                    "reasoning": thought.get("reasoning", ""),
+                    "time_to_action": thought.get("time_to_action"),
+                    "think_time": thought.get("think_time"),
+                }, ensure_ascii=False))
+        
+        # ステップ終了時: フェーズ別の時間を Black Box とUI（ウォーターフォール）へ
+        def on_step_timing(step_num, timing):
+            for step_data in reversed(REACT_STEPS):
+                if step_data["step"] == step_num:
+                    step_data["timing"] = timing
+                    break
+            history_mgr.log_event(flight_id, "TIMING", json.dumps(timing, ensure_ascii=False))
+        
+        # モデルの段の選択と結果: ポリシー調整用に Black Box へ
+        def on_route(record):
+            history_mgr.log_event(flight_id, "ROUTE", json.dumps(record, ensure_ascii=False))
+        
+        result = agent.run(goal, on_step=on_step, on_thought_update=on_thought_update, on_step_timing=on_step_timing,
+                           on_route=on_route)
         REACT_RESULT = result
         
         # 動画パスをログに記録
         if result.get("video_path"):
             history_mgr.log_event(flight_id, "VIDEO", f"Recording saved: {result['video_path']}")
         
+        if agent.history.folded:
+            history_mgr.update_metadata(flight_id, memory=agent.history.stats())
+        if agent.speculation_stats["started"]:
+            history_mgr.update_metadata(flight_id, speculation=agent.speculation_stats)
+        if agent.flight_hints:
+            history_mgr.update_metadata(flight_id, hint_flights=[h["flight_id"] for h in agent.flight_hints])
+        replay = result.get("replay")
+        if replay:
+            history_mgr.update_metadata(flight_id, replay=replay)
+            if replay["completed"]:
+                history_mgr.log_event(flight_id, "SYSTEM", f"Compiled mission replayed ({replay['steps']} steps)")
+            else:
+                history_mgr.log_event(flight_id, "SYSTEM", f"Compiled mission diverged at step {replay['diverged_at']}: {replay['reason']}")
+        
         # 終了処理
         status = "COMPLETED" if result["success"] else "FAILED"
+        if result.get("status") == "budget_exceeded":
+            status = "BUDGET_EXCEEDED"
+        elif result.get("status") == "stuck":
+            status = "STUCK"
         history_mgr.log_event(flight_id, "SYSTEM", f"ReAct finished: {result['final_result']}")
         history_mgr.end_flight(flight_id, status)
         
+        # 次のミッションのヒントになるよう、フライトを索引に追加
+        try:
+            index_flight(history_mgr, flight_id)
+        except Exception as e:
+            print(f"⚠️ Flight Index Error: {e}")
+        
         # 注意: stop_session()はReActAgent.run()内で既に呼ばれている
         
     except Exception as e:
@@ -370,6 +702,12 @@ def run_react_wrapper(goal: str, flight_id: str, max_steps: int = 50):
         history_mgr.log_event(flight_id, "ERROR", str(e))
         history_mgr.end_flight(flight_id, "CRASHED")
     finally:
+        if agent:
+            usage = agent.ledger.summary()
+            history_mgr.update_metadata(flight_id, usage=usage)
+            history_mgr.log_event(flight_id, "USAGE", json.dumps(usage["totals"], ensure_ascii=False))
+        if profiler:
+            history_mgr.log_event(flight_id, "SYSTEM", f"Profile saved: {profiler.stop()} ({profiler.sample_count} samples)")
         REACT_RUNNING = False
 
 @app.post("/api/react")
@@ -382,16 +720,27 @@ def start_react_agent(req: ReActRequest, background_tasks: BackgroundTasks):
     
     if REACT_RUNNING:
         raise HTTPException(status_code=400, detail="ReAct agent is already running")
+    check_browsing(req.browsing)
     
     # Initialize Flight Recorder
     CURRENT_FLIGHT_ID = history_mgr.start_flight()
+    history_mgr.update_metadata(CURRENT_FLIGHT_ID, mission=req.goal)
     REACT_STEPS = []
     REACT_RESULT = None
+    backend = build_react_backend(CURRENT_FLIGHT_ID, req)
+    budget = MissionBudget.from_config(req.max_tokens, req.max_cost, req.max_model_calls)
+    profiler = SamplingProfiler(history_mgr.flight_path(CURRENT_FLIGHT_ID, PROFILE_FILE), req.profile_hz) if req.profile else None
+    # バックグラウンド開始前に実行中にしておく（連続したリクエストの二重起動を防ぐ）
+    REACT_RUNNING = True
     
     history_mgr.log_event(CURRENT_FLIGHT_ID, "SYSTEM", f"ReAct Agent started with goal: {req.goal}")
+    if backend:
+        history_mgr.log_event(CURRENT_FLIGHT_ID, "SYSTEM", f"LLM backend: {backend.name}")
     
     # Run in background
-    background_tasks.add_task(run_react_wrapper, req.goal, CURRENT_FLIGHT_ID, req.max_steps)
+    background_tasks.add_task(run_react_wrapper, req.goal, CURRENT_FLIGHT_ID, req.max_steps, req.stream, backend, budget, profiler,
+                              req.use_compiled, req.flight_hints, req.site_knowledge, req.model_router,
+                              req.speculative, req.browsing, req.profile_store)
     
     return {
         "message": "ReAct Agent started",
@@ -399,6 +748,35 @@ def start_react_agent(req: ReActRequest, background_tasks: BackgroundTasks):
         "goal": req.goal
     }
 
+@app.get("/api/compiled_missions")
+def list_compiled_missions():
+    """コンパイル済みミッション（成功した ReAct の軌跡）の一覧と再生統計"""
+    return {"missions": MissionLibrary().list()}
+
+@app.get("/api/flight_index")
+def search_flight_index(goal: str, k: int = 5):
+    """ゴールに似た過去のフライト（ReAct のヒントに使われるもの）を検索"""
+    started = time.time()
+    matches = FLIGHT_INDEX.search(goal, k=k)
+    return {"size": len(FLIGHT_INDEX), "took_ms": round((time.time() - started) * 1000, 3), "matches": matches}
+
+@app.get("/api/site_knowledge")
+def list_site_knowledge():
+    """学習済みのサイト知識（検索URL・既知の要素・待ち時間）があるサイトの一覧"""
+    return {"sites": SITE_KNOWLEDGE.sites()}
+
+@app.get("/api/site_knowledge/{site}")
+def get_site_knowledge(site: str):
+    if site not in SITE_KNOWLEDGE.sites():
+        raise HTTPException(status_code=404, detail="No knowledge for this site")
+    return SITE_KNOWLEDGE.get(site)
+
+@app.delete("/api/site_knowledge/{site}")
+def delete_site_knowledge(site: str):
+    """サイトの知識を捨てる（サイトの構成が変わったときなど）"""
+    SITE_KNOWLEDGE.invalidate(site)
+    return {"message": f"Knowledge for {site} invalidated"}
+
 @app.get("/api/react/status")
 def get_react_status():
     """ReActエージェントの状態を取得"""
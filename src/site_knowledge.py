@@ -0,0 +1,310 @@
+"""
+Site Knowledge - per-domain navigation knowledge learned from finished missions.
+
+サイトごとに次の知識を results/site_knowledge/<host>.json に溜め、ReAct / autopilot が参照する:
+    search_urls - 検索結果ページの URL テンプレート (例: https://www.google.com/search?q={query})
+                  入力したテキストが次のページの URL のクエリに現れたら学習する
+    locators    - 説明文（"search box" など）→ 要素の記述子 (ATC.describe_element_at)。
+                  2 回以上同じ要素に当たったものを「安定」とみなして使う
+    settle      - アクション後に画面が落ち着くまでの時間のサンプル (ATC.wait_for_settle)
+                  クリックのたびに書かないよう、メモリに溜めて SETTLE_FLUSH_SAMPLES 件ごとと
+                  セッションの終わり（ATC.stop_session）・プロセスの終了時にまとめて書く
+
+使った知識が続けて失敗したら、その項目を捨てる（FAILURE_LIMIT 回）。
+サイトの知識を使ったミッションが続けて失敗したら、そのサイトの知識を丸ごと捨てる（SITE_FAILURE_LIMIT 回）。
+
+ファイルは autopilot のワーカープロセスとサーバーの両方から書かれるので、
+読むときは mtime を見てキャッシュを更新し、書くときは一時ファイル経由で置き換える。
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from urllib.parse import parse_qsl, urlparse
+
+from src.config import SITE_KNOWLEDGE_DIR
+from src.metrics import site_of
+
+FAILURE_LIMIT = 3          # 項目ごとの連続失敗の上限
+SITE_FAILURE_LIMIT = 3     # 知識を使ったミッションの連続失敗の上限
+STABLE_LOCATOR_SEEN = 2    # この回数以上同じ要素に当たった locator を使う
+SETTLE_SAMPLES = 30        # アクションごとに保持する直近のサンプル数
+MIN_SETTLE_SAMPLES = 5
+MIN_SETTLE_SECONDS = 0.3
+SETTLE_FLUSH_SAMPLES = 10  # サイトごとにこの件数のサンプルが溜まったらファイルに書く
+MIN_GOAL_LABEL = 3         # ゴール文に単語として現れればサイトとみなすドメインラベルの最短の長さ
+GENERIC_LABELS = ("www", "com", "co", "jp", "org", "net")
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def normalize_description(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+
+def _empty(site: str) -> dict:
+    return {
+        "site": site,
+        "search_urls": [],
+        "locators": {},
+        "settle": {},
+        "flights": {"successes": 0, "consecutive_failures": 0},
+        "updated_at": _now(),
+    }
+
+
+def search_template(url: str, query: str):
+    """Template of a result URL whose query string carries `query`, else None."""
+    if not url or not query:
+        return None
+    parsed = urlparse(url)
+    wanted = " ".join(query.split()).lower()
+    for name, value in parse_qsl(parsed.query):
+        if " ".join(value.split()).lower() == wanted:
+            return f"{parsed.scheme}://{parsed.netloc}{parsed.path}?{name}={{query}}"
+    return None
+
+
+class SiteKnowledgeBase:
+    def __init__(self, directory: str = None):
+        self.directory = str(directory or SITE_KNOWLEDGE_DIR)
+        self._lock = threading.RLock()
+        self._cache = {}  # site -> (mtime, data)
+        self._pending_settle = {}  # site -> {action: [[seconds, settled], ...]}（まだ書いていないサンプル）
+
+    # ---- storage ----
+    def _path(self, site: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^\w.-]", "_", site) + ".json")
+
+    def _read(self, site: str) -> dict:
+        path = self._path(site)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return _empty(site)
+        cached = self._cache.get(site)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = _empty(site)
+        self._cache[site] = (mtime, data)
+        return data
+
+    def _write(self, site: str, data: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        data["updated_at"] = _now()
+        path = self._path(site)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._cache[site] = (os.path.getmtime(path), data)
+
+    def _update(self, site: str, func):
+        if not site or site in ("unknown", "desktop"):
+            return None
+        with self._lock:
+            data = self._read(site)
+            result = func(data)
+            self._write(site, data)
+            return result
+
+    def get(self, site: str) -> dict:
+        with self._lock:
+            return self._read(site)
+
+    def sites(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def invalidate(self, site: str):
+        with self._lock:
+            self._cache.pop(site, None)
+            self._pending_settle.pop(site, None)
+            try:
+                os.remove(self._path(site))
+            except OSError:
+                pass
+        print(f"🗑️ Site knowledge invalidated: {site}")
+
+    # ---- search URL templates ----
+    def learn_search_url(self, url: str, query: str) -> bool:
+        """Learns the search URL template when `url` is a result page for `query`. Returns whether it was one."""
+        template = search_template(url, query)
+        if not template:
+            return False
+
+        def _learn(data):
+            for item in data["search_urls"]:
+                if item["template"] == template:
+                    item["seen"] += 1
+                    return True
+            data["search_urls"].append({"template": template, "seen": 1, "uses": 0, "failures": 0, "learned_at": _now()})
+            print(f"📚 Learned search URL for {site_of(url)}: {template}")
+            return True
+
+        return bool(self._update(site_of(url), _learn))
+
+    def search_templates(self, site: str) -> list:
+        return [item["template"] for item in self.get(site)["search_urls"] if item["failures"] < FAILURE_LIMIT]
+
+    def templates_for_goal(self, goal: str) -> dict:
+        """
+        {site: [templates]} for known sites named in the goal: their domain (e.g. "x.com") or, for a name of
+        MIN_GOAL_LABEL letters or more, their longest label as a whole word (e.g. "Google" → www.google.com).
+        """
+        goal = (goal or "").lower()
+        found = {}
+        for site in self.sites():
+            domain = site[len("www."):] if site.startswith("www.") else site
+            labels = [label for label in site.split(".") if label not in GENERIC_LABELS]
+            name = max(labels, key=len) if labels else ""
+            named = re.search(rf"(?<![\w.-]){re.escape(domain)}\b", goal) or \
+                (len(name) >= MIN_GOAL_LABEL and re.search(rf"\b{re.escape(name)}\b", goal))
+            if named:
+                templates = self.search_templates(site)
+                if templates:
+                    found[site] = templates
+        return found
+
+    # ---- element locators ----
+    def learn_locator(self, site: str, description: str, element: dict):
+        key = normalize_description(description)
+        if not key or not element:
+            return
+
+        def _learn(data):
+            item = data["locators"].get(key)
+            same = item and item["element"].get("css") == element.get("css") and item["element"].get("text") == element.get("text")
+            if same:
+                item["seen"] += 1
+                item["failures"] = 0
+            else:
+                # 別の要素に当たったら数え直す
+                data["locators"][key] = {"description": description, "element": element, "seen": 1, "failures": 0}
+            data["locators"][key]["updated_at"] = _now()
+
+        self._update(site, _learn)
+
+    def locator(self, site: str, description: str):
+        """Stable element descriptor for `description` on `site`, or None."""
+        item = self.get(site)["locators"].get(normalize_description(description))
+        if item and item["seen"] >= STABLE_LOCATOR_SEEN and item["failures"] < FAILURE_LIMIT:
+            return item["element"]
+        return None
+
+    def stable_locators(self, site: str, limit: int = 8) -> list:
+        items = [item for item in self.get(site)["locators"].values()
+                 if item["seen"] >= STABLE_LOCATOR_SEEN and item["failures"] < FAILURE_LIMIT]
+        return sorted(items, key=lambda item: -item["seen"])[:limit]
+
+    # ---- usage feedback / invalidation ----
+    def report(self, site: str, kind: str, key: str, ok: bool):
+        """Feedback on a used item: kind "search_url" (key = template) or "locator" (key = description)."""
+        def _report(data):
+            if kind == "search_url":
+                items = [item for item in data["search_urls"] if item["template"] == key]
+            else:
+                items = [data["locators"][k] for k in [normalize_description(key)] if k in data["locators"]]
+            for item in items:
+                item["uses"] = item.get("uses", 0) + 1
+                item["failures"] = 0 if ok else item["failures"] + 1
+            # 失敗が続いた項目は捨てる
+            data["search_urls"] = [item for item in data["search_urls"] if item["failures"] < FAILURE_LIMIT]
+            data["locators"] = {k: item for k, item in data["locators"].items() if item["failures"] < FAILURE_LIMIT}
+
+        self._update(site, _report)
+
+    def record_flight(self, site: str, success: bool, used_knowledge: bool):
+        """Outcome of a mission on `site`. Repeated failures of missions that used the knowledge drop it."""
+        if not used_knowledge:
+            return
+
+        def _record(data):
+            flights = data["flights"]
+            if success:
+                flights["successes"] += 1
+                flights["consecutive_failures"] = 0
+            else:
+                flights["consecutive_failures"] += 1
+            return flights["consecutive_failures"] >= SITE_FAILURE_LIMIT
+
+        if self._update(site, _record):
+            self.invalidate(site)
+
+    # ---- settle times ----
+    def observe_settle(self, site: str, action: str, seconds: float, settled: bool):
+        if not site or site in ("unknown", "desktop"):
+            return
+        with self._lock:
+            pending = self._pending_settle.setdefault(site, {})
+            pending.setdefault(action, []).append([round(seconds, 3), bool(settled)])
+            full = sum(len(samples) for samples in pending.values()) >= SETTLE_FLUSH_SAMPLES
+        if full:
+            self.flush_settle(site)
+
+    def flush_settle(self, site: str = None):
+        """Writes the buffered settle samples (of `site`, or of every site)."""
+        with self._lock:
+            sites = [site] if site else list(self._pending_settle)
+            for name in sites:
+                pending = self._pending_settle.pop(name, None)
+                if not pending:
+                    continue
+
+                def _observe(data):
+                    for action, new_samples in pending.items():
+                        samples = data["settle"].setdefault(action, [])
+                        samples.extend(new_samples)
+                        del samples[:-SETTLE_SAMPLES]
+
+                try:
+                    self._update(name, _observe)
+                except OSError as e:
+                    print(f"⚠️ Site Knowledge Error: {e}")
+
+    def settle_time(self, site: str, action: str, default: float) -> float:
+        """
+        Typical settle time for `action` on `site`: p90 of the settled samples with a 50% margin,
+        capped at `default`. `default` until enough samples have settled.
+        """
+        with self._lock:
+            samples = self._read(site)["settle"].get(action, []) + \
+                self._pending_settle.get(site, {}).get(action, [])
+        samples = [seconds for seconds, settled in samples[-SETTLE_SAMPLES:] if settled]
+        if len(samples) < MIN_SETTLE_SAMPLES:
+            return default
+        samples.sort()
+        p90 = samples[min(len(samples) - 1, int(len(samples) * 0.9))]
+        return min(default, max(MIN_SETTLE_SECONDS, p90 * 1.5))
+
+    # ---- learning from a finished ReAct run ----
+    def learn_from_react(self, history: list, success: bool):
+        """
+        Learns from ReActAgent.history: search URLs (typed text → next URLs) and, for successful runs,
+        locators of clicked elements that had a description.
+        """
+        steps = [h for h in history if h.get("thought")]
+        for i, entry in enumerate(steps):
+            thought = entry["thought"]
+            params = thought.get("params") or {}
+            if thought.get("action") == "type" and params.get("text"):
+                for later in steps[i + 1:i + 4]:
+                    if self.learn_search_url(later.get("url"), params["text"]):
+                        break
+            if success and thought.get("action") == "click" and entry.get("element") and params.get("description"):
+                self.learn_locator(site_of(entry.get("url")), params["description"], entry["element"])
+
+
+# サーバー・エージェント・autopilot で共有
+SITE_KNOWLEDGE = SiteKnowledgeBase()
+atexit.register(SITE_KNOWLEDGE.flush_settle)
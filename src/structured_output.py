@@ -0,0 +1,479 @@
+"""
+Structured Output - tolerant JSON parsing and schema validation for LLM responses.
+
+Gemini の constrained JSON output が使えない場合や、出力が途中で切れた場合の
+フォールバックとして、壊れた JSON を修復しながら読み取る。
+"""
+
+import copy
+import json
+import re
+import threading
+
+
+class StructuredOutputError(ValueError):
+    """Raised when an LLM response cannot be turned into a schema-valid object."""
+
+
+def strip_code_fences(text: str) -> str:
+    """Removes ```json ... ``` fences that models like to wrap around JSON."""
+    text = (text or "").strip()
+    if "```json" in text:
+        text = text.split("```json", 1)[1].split("```", 1)[0]
+    elif text.startswith("```") or "\n```" in text:
+        parts = text.split("```")
+        if len(parts) >= 2:
+            text = parts[1]
+    return text.strip()
+
+
+class IncrementalJSONParser:
+    """
+    Character-level JSON scanner that accepts text chunk by chunk.
+
+    - feed() can be called with arbitrary fragments (streaming)
+    - members() returns the top-level object members whose values are complete
+    - snapshot() returns a best-effort object for the text seen so far
+    - close() repairs the document (unterminated strings, missing brackets,
+      trailing commas, Python literals, single quotes) and returns valid JSON text
+    """
+
+    _LITERALS = {"true": "true", "false": "false", "null": "null",
+                 "True": "true", "False": "false", "None": "null",
+                 "NaN": "null", "Infinity": "null", "-Infinity": "null"}
+    _ESCAPES = set('"\\/bfnrtu')
+    _HEX = set("0123456789abcdefABCDEF")
+    _NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+    # 途中で切れた数値（"-"、"1e"、"1e-" など）
+    _NUMBER_FRAGMENT = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)?([eE][+-]?)?")
+
+    def __init__(self):
+        self._out = []
+        self._stack = []  # [{"type": "{" | "[", "state": ..., "start": int}]
+        self._in_string = False
+        self._escape = False
+        self._escape_at = 0    # 最後のバックスラッシュの位置（_out の添字）
+        self._unicode = None   # \u エスケープの後に読んだ 16 進数の桁数（\u の中でなければ None）
+        self._quote = '"'
+        self._item_role = None
+        self._item_start = 0
+        self._token = []
+        self._current_key = None
+        self._members = {}
+        self.started = False
+        self.done = False
+        self.repaired = False
+
+    # ---- public API ----
+    def feed(self, chunk: str):
+        for ch in chunk or "":
+            if self.done:
+                break
+            self._consume(ch)
+        return self
+
+    def members(self) -> dict:
+        """Top-level members whose values have been fully received."""
+        result = {}
+        for key, raw in self._members.items():
+            try:
+                result[key] = json.loads(raw)
+            except ValueError:
+                continue
+        return result
+
+    def snapshot(self):
+        """Best-effort parse of everything received so far (does not consume the parser)."""
+        if not self.started:
+            return None
+        clone = copy.deepcopy(self)
+        try:
+            return json.loads(clone.close())
+        except ValueError:
+            return None
+
+    def close(self) -> str:
+        """Finishes the document and returns repaired JSON text."""
+        if self._unicode is not None:
+            self._break_unicode()
+        if self._in_string and self._item_role == "key":
+            # 途中までしか届いていないキーは捨てる
+            del self._out[self._item_start:]
+            self._in_string = False
+            self._escape = False
+            self.repaired = True
+        elif self._in_string:
+            if self._escape:
+                self._out.pop()
+                self._escape = False
+            self._in_string = False
+            self._out.append('"')
+            self.repaired = True
+            self._string_closed()
+        self._flush_token()
+        while self._stack:
+            self.repaired = True
+            self._close_container(self._stack[-1]["type"])
+        return "".join(self._out)
+
+    # ---- scanner ----
+    def _consume(self, ch):
+        if not self.started:
+            if ch in "{[":
+                self.started = True
+                self._open(ch)
+            return
+
+        if self._in_string:
+            if self._unicode is not None:
+                if ch in self._HEX:
+                    self._out.append(ch)
+                    self._unicode += 1
+                    if self._unicode == 4:
+                        self._unicode = None
+                    return
+                self._break_unicode()
+            if self._escape:
+                self._escape = False
+                if ch == "u":
+                    self._unicode = 0
+                elif ch == "'":
+                    # シングルクォート文字列の \' は JSON ではエスケープ不要
+                    self._out.pop()
+                    self.repaired = True
+                elif ch not in self._ESCAPES:
+                    # JSON にないエスケープ（\q など）はバックスラッシュ自体の文字として残す
+                    self._out.append("\\")
+                    self.repaired = True
+                self._out.append(ch)
+            elif ch == "\\":
+                self._escape = True
+                self._escape_at = len(self._out)
+                self._out.append(ch)
+            elif ch == self._quote:
+                self._in_string = False
+                self._out.append('"')
+                self._string_closed()
+            elif ch == '"':
+                # 二重引用符がシングルクォート文字列の中に現れた
+                self._out.append('\\"')
+                self.repaired = True
+            elif ch == "\n":
+                self._out.append("\\n")
+                self.repaired = True
+            elif ch == "\t":
+                self._out.append("\\t")
+                self.repaired = True
+            elif ch == "\r":
+                self.repaired = True
+            else:
+                self._out.append(ch)
+            return
+
+        if self._token and not (ch.isalnum() or ch in "+-._"):
+            self._flush_token()
+
+        if ch in " \t\r\n":
+            return
+        if ch in "\"'":
+            if ch == "'":
+                self.repaired = True
+            self._item_role = self._before_item()
+            self._item_start = len(self._out)
+            self._quote = ch
+            self._in_string = True
+            self._out.append('"')
+        elif ch in "{[":
+            self._before_item()
+            self._open(ch)
+        elif ch in "}]":
+            if self._stack:
+                self._close_container(ch)
+        elif ch == ",":
+            frame = self._stack[-1]
+            if frame["state"] == "comma":
+                frame["state"] = "key" if frame["type"] == "{" else "value"
+                self._out.append(",")
+            else:
+                self.repaired = True
+        elif ch == ":":
+            frame = self._stack[-1]
+            if frame["type"] == "{" and frame["state"] == "colon":
+                frame["state"] = "value"
+                self._out.append(":")
+            else:
+                self.repaired = True
+        elif ch.isalnum() or ch in "+-.":
+            if not self._token:
+                self._item_role = self._before_item()
+                self._item_start = len(self._out)
+            self._token.append(ch)
+        else:
+            self.repaired = True
+
+    def _break_unicode(self):
+        """A \\u escape without its four hex digits (e.g. "\\u12"): keeps it as literal text."""
+        self._out.insert(self._escape_at, "\\")
+        self._unicode = None
+        self.repaired = True
+
+    def _before_item(self):
+        """Fixes missing separators before a new key/value and returns its role."""
+        frame = self._stack[-1]
+        if frame["state"] == "comma":
+            self._out.append(",")
+            self.repaired = True
+            frame["state"] = "key" if frame["type"] == "{" else "value"
+        elif frame["state"] == "colon":
+            self._out.append(":")
+            self.repaired = True
+            frame["state"] = "value"
+        return frame["state"]
+
+    def _open(self, ch):
+        self._stack.append({
+            "type": ch,
+            "state": "key" if ch == "{" else "value",
+            "start": len(self._out),
+        })
+        self._out.append(ch)
+
+    def _close_container(self, ch):
+        frame = self._stack[-1]
+        closer = "}" if frame["type"] == "{" else "]"
+        if ch != closer:
+            self.repaired = True
+        if frame["state"] == "colon":
+            self._out.append(":null")
+            self.repaired = True
+        elif frame["type"] == "{" and frame["state"] == "value" and self._out[-1] == ":":
+            self._out.append("null")
+            self.repaired = True
+        elif self._out[-1] == ",":
+            self._out.pop()
+            self.repaired = True
+        self._out.append(closer)
+        self._stack.pop()
+        if not self._stack:
+            self.done = True
+        else:
+            self._value_done(frame["start"])
+
+    def _string_closed(self):
+        if self._item_role == "key":
+            raw = "".join(self._out[self._item_start:])
+            try:
+                key = json.loads(raw)
+            except ValueError:
+                # 壊れた \u エスケープなど: 中身をそのまま文字列のキーにする
+                key = raw[1:-1]
+                del self._out[self._item_start:]
+                self._out.append(json.dumps(key))
+                self.repaired = True
+            self._key_done(key)
+        else:
+            self._value_done(self._item_start)
+
+    def _flush_token(self):
+        if not self._token:
+            return
+        token = "".join(self._token)
+        self._token = []
+        if self._item_role == "key":
+            self.repaired = True
+            self._out.append(json.dumps(token))
+            self._key_done(token)
+            return
+        if token in self._LITERALS:
+            literal = self._LITERALS[token]
+        elif self._NUMBER.fullmatch(token):
+            literal = self._number(token)
+        elif self._NUMBER_FRAGMENT.fullmatch(token):
+            # 切れた数値は読めた桁までの数にする。桁が無ければ（"-" だけなど）null
+            digits = self._NUMBER.match(token)
+            literal = self._number(digits.group(0)) if digits else "null"
+        else:
+            literal = json.dumps(token)  # 引用符の無い文字列
+        if literal != token:
+            self.repaired = True
+        self._out.append(literal)
+        self._value_done(self._item_start)
+
+    @staticmethod
+    def _number(token):
+        """A JSON number for a Python-style one (+1, .5, 01, 1.); JSON numbers are kept as they are."""
+        if re.fullmatch(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?", token):
+            return token
+        if any(c in token for c in ".eE"):
+            return json.dumps(float(token))
+        return str(int(token))
+
+    def _key_done(self, key):
+        frame = self._stack[-1]
+        frame["state"] = "colon"
+        if len(self._stack) == 1:
+            self._current_key = key
+
+    def _value_done(self, start):
+        frame = self._stack[-1]
+        frame["state"] = "comma"
+        if len(self._stack) == 1 and frame["type"] == "{" and self._current_key is not None:
+            self._members[self._current_key] = "".join(self._out[start:])
+            self._current_key = None
+
+
+def parse_json_text(text: str):
+    """
+    Parses (possibly broken) JSON text.
+    Returns: (value, repaired)
+    """
+    cleaned = strip_code_fences(text)
+    try:
+        return json.loads(cleaned), False
+    except ValueError:
+        pass
+
+    try:
+        parser = IncrementalJSONParser().feed(cleaned)
+    except ValueError as e:
+        raise StructuredOutputError(f"Unrepairable JSON: {e}") from e
+    if not parser.started:
+        raise StructuredOutputError(f"No JSON object found in response: {cleaned[:80]!r}")
+    try:
+        return json.loads(parser.close()), True
+    except ValueError as e:
+        raise StructuredOutputError(f"Unrepairable JSON: {e}") from e
+
+
+# ---- schema validation ----
+_TRUE_STRINGS = {"true", "yes", "1"}
+_FALSE_STRINGS = {"false", "no", "0", ""}
+
+
+def validate_schema(value, schema: dict, path: str = "$"):
+    """
+    Validates value against the Gemini response-schema subset used in llm_schemas.
+    Lenient coercions (e.g. "123" -> 123) are applied; the coerced value is returned.
+    """
+    if value is None:
+        if schema.get("nullable"):
+            return None
+        raise StructuredOutputError(f"{path}: value is null")
+
+    kind = schema.get("type", "").upper()
+
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            raise StructuredOutputError(f"{path}: expected object, got {type(value).__name__}")
+        properties = schema.get("properties", {})
+        result = dict(value)
+        for name in schema.get("required", []):
+            if result.get(name) is None and not properties.get(name, {}).get("nullable"):
+                raise StructuredOutputError(f"{path}.{name}: required field missing")
+        for name, sub in properties.items():
+            if name in result:
+                if result[name] is None and name not in schema.get("required", []):
+                    continue
+                result[name] = validate_schema(result[name], sub, f"{path}.{name}")
+        return result
+
+    if kind == "ARRAY":
+        if isinstance(value, dict):
+            value = [value]
+        if not isinstance(value, list):
+            raise StructuredOutputError(f"{path}: expected array")
+        items = schema.get("items")
+        if not items:
+            return value
+        return [validate_schema(v, items, f"{path}[{i}]") for i, v in enumerate(value)]
+
+    if kind in ("NUMBER", "INTEGER"):
+        if isinstance(value, bool):
+            raise StructuredOutputError(f"{path}: expected number, got boolean")
+        if isinstance(value, str):
+            try:
+                value = float(value.strip())
+            except ValueError:
+                raise StructuredOutputError(f"{path}: expected number, got {value!r}")
+        if not isinstance(value, (int, float)):
+            raise StructuredOutputError(f"{path}: expected number")
+        if kind == "INTEGER":
+            return int(round(value))
+        return value
+
+    if kind == "BOOLEAN":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in _TRUE_STRINGS | _FALSE_STRINGS:
+            return value.strip().lower() in _TRUE_STRINGS
+        if isinstance(value, (int, float)):
+            return bool(value)
+        raise StructuredOutputError(f"{path}: expected boolean")
+
+    if kind == "STRING":
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        value = str(value)
+        enum = schema.get("enum")
+        if enum and value not in enum:
+            lowered = value.strip().lower()
+            match = next((e for e in enum if e.lower() == lowered), None)
+            if match is None:
+                raise StructuredOutputError(f"{path}: {value!r} is not one of {enum}")
+            value = match
+        return value
+
+    return value
+
+
+# ---- counters ----
+class ParseStats:
+    """Thread-safe counters for structured-output parsing, per schema name."""
+
+    EVENTS = ("responses", "constrained", "repairs", "parse_failures", "validation_failures")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def increment(self, schema_name: str, event: str, amount: int = 1):
+        with self._lock:
+            counts = self._counts.setdefault(schema_name, dict.fromkeys(self.EVENTS, 0))
+            counts[event] = counts.get(event, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            per_schema = {name: dict(c) for name, c in self._counts.items()}
+        totals = dict.fromkeys(self.EVENTS, 0)
+        for counts in per_schema.values():
+            for event, n in counts.items():
+                totals[event] = totals.get(event, 0) + n
+        return {"totals": totals, "schemas": per_schema}
+
+    def reset(self):
+        with self._lock:
+            self._counts = {}
+
+
+PARSE_STATS = ParseStats()
+
+
+def parse_structured(text: str, schema: dict, schema_name: str) -> dict:
+    """
+    Parses an LLM response into a schema-valid object.
+    Broken JSON is repaired when possible; every outcome is counted in PARSE_STATS.
+    """
+    PARSE_STATS.increment(schema_name, "responses")
+    try:
+        value, repaired = parse_json_text(text)
+    except StructuredOutputError:
+        PARSE_STATS.increment(schema_name, "parse_failures")
+        raise
+    if repaired:
+        PARSE_STATS.increment(schema_name, "repairs")
+
+    try:
+        return validate_schema(value, schema)
+    except StructuredOutputError:
+        PARSE_STATS.increment(schema_name, "validation_failures")
+        raise
@@ -0,0 +1,233 @@
+"""
+Template Matcher - ROI-first, multi-scale OpenCV matching for ATC's visual click check.
+
+以前の find_element_visually はクリックのたびに画面全体と要素の PNG をカラーでデコードし、
+画面全体を 1 スケールで matchTemplate していた。ここでは:
+    ROI         - DOM のバウンディングボックスの周りを先に探し、十分な信頼度が出なければ画面全体を探す
+    ピラミッド   - 画面全体の探索は pyrDown で縮小した画像で候補を出し、元の解像度では候補の近傍だけを確かめる
+    スケール     - テンプレートを SCALES 倍に拡大縮小して試す（ズーム・DPI の違い、キャッシュしたテンプレートと今の画面の差）
+    キャッシュ   - 要素のテンプレートは (サイト, セレクタ) ごとに LRU で保持し、次のステップからは要素のスクリーンショットを撮らない。
+                   キャッシュしたテンプレートで見つからなければ撮り直して差し替える（レイアウト・見た目の変更）
+    フレーム     - 同じ PNG (bytes オブジェクト) の画面はデコードし直さない（スレッドごとに直前の 1 枚）
+matchTemplate はすべてグレースケールで行う。結果は信頼度の高い順の候補のリスト
+    {"x", "y", "width", "height", "confidence", "scale", "search": "roi" | "full"}（座標は CSS px、x/y は中心）。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from src.config import TEMPLATE_CACHE_SIZE
+from src.metrics import phase
+
+SCALES = (1.0, 0.9, 1.1, 0.8, 1.25, 0.67, 1.5, 0.5, 2.0)
+ACCEPT = 0.95            # この信頼度の候補が出たら残りのスケールは試さない
+MIN_CONFIDENCE = 0.8     # ROI の最良候補がこれ未満なら画面全体を探す（ATC.click が座標を採用する閾値と同じ）
+ROI_MARGIN = 1.0         # ROI = ボックスを各辺に (ボックスの幅・高さ × ROI_MARGIN + ROI_PADDING) px 広げた範囲
+ROI_PADDING = 32
+MIN_PYRAMID_SIDE = 12    # 縮小したテンプレートの短辺がこれを下回るところまでは縮めない
+MAX_PYRAMID_LEVELS = 3
+MIN_TEMPLATE_SIDE = 4
+TOP_K = 5
+
+_local = threading.local()
+
+
+def decode_gray(png: bytes):
+    return cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def _scaled(template, scale: float):
+    if scale == 1.0:
+        return template
+    h, w = template.shape[:2]
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(template, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+
+
+def _peaks(result, count: int, width: int, height: int) -> list:
+    """The `count` best positions of a matchTemplate result, suppressing the area around each pick."""
+    result = result.copy()
+    peaks = []
+    for _ in range(count):
+        _, value, _, (x, y) = cv2.minMaxLoc(result)
+        if value <= -1.0:
+            break
+        peaks.append((float(value), x, y))
+        result[max(0, y - height // 2):y + height // 2 + 1, max(0, x - width // 2):x + width // 2 + 1] = -1.0
+    return peaks
+
+
+def _match_region(image, template, origin, scales, top_k: int, accept: float = ACCEPT) -> list:
+    """Matches `template` at each scale inside `image`, a crop whose top-left corner is `origin` in the frame (px)."""
+    found = []
+    for scale in scales:
+        tpl = _scaled(template, scale)
+        th, tw = tpl.shape[:2]
+        if th > image.shape[0] or tw > image.shape[1] or min(th, tw) < MIN_TEMPLATE_SIDE:
+            continue
+        result = np.nan_to_num(cv2.matchTemplate(image, tpl, cv2.TM_CCOEFF_NORMED), nan=-1.0, posinf=-1.0, neginf=-1.0)
+        for value, x, y in _peaks(result, top_k, tw, th):
+            found.append({"left": origin[0] + x, "top": origin[1] + y, "width": tw, "height": th,
+                          "confidence": value, "scale": scale})
+        if found and max(c["confidence"] for c in found) >= accept:
+            break
+    return found
+
+
+def _match_pyramid(frame, template, scales, top_k: int) -> list:
+    """Whole-frame search: candidates on a downscaled pyramid level, confirmed at full resolution around each one."""
+    levels = 0
+    while levels < MAX_PYRAMID_LEVELS and min(template.shape[:2]) * min(scales) / 2 ** (levels + 1) >= MIN_PYRAMID_SIDE:
+        levels += 1
+    if not levels:
+        return _match_region(frame, template, (0, 0), scales, top_k)
+
+    small_frame, small_template = frame, template
+    for _ in range(levels):
+        small_frame, small_template = cv2.pyrDown(small_frame), cv2.pyrDown(small_template)
+    factor = 2 ** levels
+    coarse = _match_region(small_frame, small_template, (0, 0), scales, top_k)
+
+    refined = []
+    for candidate in _rank(coarse, top_k):
+        pad = factor * 2
+        left, top = max(0, candidate["left"] * factor - pad), max(0, candidate["top"] * factor - pad)
+        width, height = candidate["width"] * factor + pad * 2, candidate["height"] * factor + pad * 2
+        crop = frame[top:top + height, left:left + width]
+        refined.extend(_match_region(crop, template, (left, top), (candidate["scale"],), 1))
+    return refined
+
+
+def _rank(candidates: list, top_k: int) -> list:
+    """Best first, dropping candidates centred inside a better one (the same spot found at another scale)."""
+    kept = []
+    for candidate in sorted(candidates, key=lambda c: -c["confidence"]):
+        cx, cy = candidate["left"] + candidate["width"] / 2, candidate["top"] + candidate["height"] / 2
+        if any(abs(cx - (k["left"] + k["width"] / 2)) < k["width"] / 2 and abs(cy - (k["top"] + k["height"] / 2)) < k["height"] / 2
+               for k in kept):
+            continue
+        kept.append(candidate)
+        if len(kept) >= top_k:
+            break
+    return kept
+
+
+class TemplateMatcher:
+    def __init__(self, cache_size: int = None):
+        self.cache_size = max(1, cache_size or TEMPLATE_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()  # key -> grayscale template
+        self._stats = {"matches": 0, "roi_hits": 0, "full_searches": 0, "cache_hits": 0, "refreshed": 0,
+                       "decodes": 0, "seconds": 0.0}
+
+    # ---- frames / templates ----
+    def frame(self, png: bytes):
+        """Decoded grayscale screen. The last PNG decoded on this thread is reused as is."""
+        last = getattr(_local, "frame", None)
+        if last is not None and last[0] is png:
+            return last[1]
+        with phase("encode"):
+            gray = decode_gray(png)
+        _local.frame = (png, gray)
+        self._count("decodes")
+        return gray
+
+    def cached(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+            return template
+
+    def remember(self, key, png: bytes):
+        with phase("encode"):
+            template = decode_gray(png)
+        if key is not None and template is not None:
+            with self._lock:
+                self._templates[key] = template
+                self._templates.move_to_end(key)
+                while len(self._templates) > self.cache_size:
+                    self._templates.popitem(last=False)
+        return template
+
+    def forget(self, key=None):
+        with self._lock:
+            if key is None:
+                self._templates.clear()
+            else:
+                self._templates.pop(key, None)
+
+    # ---- matching ----
+    def match(self, screen_png: bytes, capture=None, key=None, box: dict = None, viewport_width: float = None,
+              top_k: int = TOP_K) -> list:
+        """
+        Ranked candidates for an element in a screenshot.
+        capture: returns the element's PNG; called only when `key` has no cached template (or it no longer matches).
+        key: template cache key across steps, e.g. (site, selector).
+        box: the element's DOM bounding box (CSS px); the ROI around it is searched first.
+        viewport_width: CSS width of the page, to convert between screenshot px and CSS px (device scale factor).
+        """
+        started = time.time()
+        frame = self.frame(screen_png)
+        ratio = frame.shape[1] / viewport_width if viewport_width else 1.0
+
+        template = self.cached(key)
+        fresh = template is None
+        if fresh:
+            if capture is None:
+                return []  # キャッシュに無く、撮る手段も無い
+            template = self.remember(key, capture())
+        else:
+            self._count("cache_hits")
+        candidates = self._search(frame, template, box, ratio, top_k)
+        if not fresh and capture and (not candidates or candidates[0]["confidence"] < MIN_CONFIDENCE):
+            # 見た目が変わった要素: 撮り直したテンプレートで探し直す
+            self._count("refreshed")
+            template = self.remember(key, capture())
+            candidates = self._search(frame, template, box, ratio, top_k)
+
+        self._count("matches")
+        self._count("seconds", time.time() - started)
+        return [{
+            "x": (c["left"] + c["width"] / 2) / ratio, "y": (c["top"] + c["height"] / 2) / ratio,
+            "width": c["width"] / ratio, "height": c["height"] / ratio,
+            "confidence": round(c["confidence"], 4), "scale": c["scale"], "search": c["search"],
+        } for c in candidates]
+
+    def _search(self, frame, template, box, ratio: float, top_k: int) -> list:
+        candidates = []
+        if box:
+            width, height = box["width"] * ratio, box["height"] * ratio
+            mx, my = width * ROI_MARGIN + ROI_PADDING, height * ROI_MARGIN + ROI_PADDING
+            left, top = max(0, int(box["x"] * ratio - mx)), max(0, int(box["y"] * ratio - my))
+            right, bottom = int(box["x"] * ratio + width + mx), int(box["y"] * ratio + height + my)
+            roi = frame[top:bottom, left:right]
+            if roi.size:
+                candidates = [{**c, "search": "roi"} for c in _match_region(roi, template, (left, top), SCALES, top_k)]
+            if candidates and max(c["confidence"] for c in candidates) >= MIN_CONFIDENCE:
+                self._count("roi_hits")
+                return _rank(candidates, top_k)
+        self._count("full_searches")
+        candidates += [{**c, "search": "full"} for c in _match_pyramid(frame, template, SCALES, top_k)]
+        return _rank(candidates, top_k)
+
+    # ---- stats ----
+    def _count(self, name: str, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, templates=len(self._templates))
+        stats["seconds"] = round(stats["seconds"], 3)
+        stats["avg_ms"] = round(stats["seconds"] * 1000 / stats["matches"], 2) if stats["matches"] else None
+        return stats
+
+
+TEMPLATE_MATCHER = TemplateMatcher()